@@ -0,0 +1,5 @@
+"""Code shared by the ``dashboard`` and ``frontend`` projects.
+
+The settings of both projects put the root of the repository on
+``sys.path``, so this package is imported as ``common``.
+"""
@@ -0,0 +1,203 @@
+"""Measurements shared by the ``benchmark`` commands of both projects.
+
+``measure`` runs an operation ``repeat`` times for the latency percentiles,
+then once more to count the SQL queries and to measure the peak memory
+allocated by Python (``tracemalloc`` slows allocations down, so that run is
+not timed). Results are plain dicts which ``compare`` matches by name and
+size against the results of another run. ``BenchmarkCommand`` is the
+command around a project's own ``run``.
+"""
+import gc
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of sorted ``samples``."""
+    return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))]
+
+
+def measure(name, size, operation, repeat=10, before=None, warmup=True):
+    """Time ``operation`` and return a result dict (times in milliseconds).
+
+    ``before`` runs ahead of every call, untimed, to reset caches. With
+    ``warmup``, one untimed call first loads templates and code paths. The
+    garbage collector is paused while timing, like ``timeit`` does.
+    """
+    if warmup:
+        if before:
+            before()
+        operation()
+    timings = []
+    for _ in range(repeat):
+        if before:
+            before()
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            operation()
+            timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            gc.enable()
+
+    if before:
+        before()
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            operation()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'name': name,
+        'size': size,
+        'repeat': repeat,
+        'mean': sum(timings) / len(timings),
+        'p50': percentile(timings, 0.5),
+        'p90': percentile(timings, 0.9),
+        'p99': percentile(timings, 0.99),
+        'max': timings[-1],
+        'queries': len(queries),
+        'peak_memory': peak_memory,
+    }
+
+
+def benchmark_database():
+    """Create an empty database in a temporary file; returns a function removing it."""
+    directory = tempfile.mkdtemp()
+    connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    def destroy():
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(directory)
+    return destroy
+
+
+def compare(baseline, results, threshold=0.2, min_delta=2.0):
+    """Match ``results`` with ``baseline`` by name and size.
+
+    Returns ``(result, previous, ratio, regressed)`` tuples. ``ratio`` is the
+    p50 latency relative to the baseline; a benchmark regressed when it runs
+    more queries, or when it is more than ``threshold`` and ``min_delta``
+    milliseconds slower (a few milliseconds are within the noise).
+    """
+    previous = {(result['name'], result['size']): result for result in baseline}
+    rows = []
+    for result in results:
+        before = previous.get((result['name'], result['size']))
+        if before is None:
+            continue
+        ratio = result['p50'] / before['p50'] if before['p50'] else float('inf')
+        slower = ratio > 1 + threshold and result['p50'] - before['p50'] > min_delta
+        regressed = slower or result['queries'] > before['queries']
+        rows.append((result, before, ratio, regressed))
+    return rows
+
+
+def sizes(value):
+    return [int(size) for size in value.split(',')]
+
+
+class BenchmarkCommand(BaseCommand):
+    """``manage.py benchmark``: runs ``run`` on a temporary database, saves and compares the results.
+
+    Subclasses set ``project`` and ``default_sizes``, add their own
+    arguments in ``add_run_arguments``, and name them in ``run_options``.
+    """
+    project = None
+    default_sizes = ()
+    sizes_help = 'Comma separated sizes of the generated datasets.'
+    run_options = ()
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=sizes, default=list(self.default_sizes),
+            help=self.sizes_help)
+        self.add_run_arguments(parser)
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Seed of the generated datasets.')
+        parser.add_argument(
+            '--output',
+            help='Write the results to this JSON file.')
+        parser.add_argument(
+            '--compare',
+            help='JSON file of a previous run to compare the results with.')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Relative p50 slowdown reported as a regression.')
+
+    def add_run_arguments(self, parser):
+        pass
+
+    def run(self, sizes, seed, log, **options):
+        """The results of the benchmarks, each passed to ``log`` as it is measured."""
+        raise NotImplementedError
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)['results']
+
+        self.stdout.write('{:<42} {:>6} {:>10} {:>10} {:>10} {:>8} {:>10}'.format(
+            'benchmark', 'size', 'p50 ms', 'p90 ms', 'p99 ms', 'queries', 'peak MB'))
+
+        def log(result):
+            line = '{name:<42} {size:>6} {p50:>10.1f} {p90:>10.1f} {p99:>10.1f} {queries:>8}'.format(
+                **result) + ' {:>10.1f}'.format(result['peak_memory'] / 1e6)
+            if 'bytes' in result:
+                line += '  {bytes} bytes, {gzip_bytes} gzipped'.format(**result)
+            self.stdout.write(line)
+
+        names = ('sizes',) + tuple(self.run_options) + ('seed',)
+        destroy = benchmark_database()
+        try:
+            results = self.run(log=log, **{name: options[name] for name in names})
+        finally:
+            destroy()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'project': self.project,
+                    'created': datetime.now().isoformat(),
+                    'python': platform.python_version(),
+                    'options': {name: options[name] for name in names},
+                    'results': results,
+                }, f, indent=2)
+            self.stdout.write('Results written to {}'.format(options['output']))
+
+        if baseline is not None:
+            self.report(compare(baseline, results, options['threshold']))
+
+    def report(self, rows):
+        self.stdout.write('')
+        regressions = 0
+        for result, before, ratio, regressed in rows:
+            line = '{:<42} {:>6} {:>10.1f} -> {:>10.1f} ms ({:+.0%}), {} -> {} queries'.format(
+                result['name'], result['size'], before['p50'], result['p50'], ratio - 1,
+                before['queries'], result['queries'])
+            if regressed:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError('{} benchmarks regressed.'.format(regressions))
+        self.stdout.write(self.style.SUCCESS('No regression.'))
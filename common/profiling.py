@@ -0,0 +1,212 @@
+"""Opt-in per-request profiling, for the dashboard and the frontend.
+
+``ProfilingMiddleware`` profiles a random ``PROFILING_SAMPLE_RATE`` fraction
+of the requests (0, the default, disables it entirely). A profiled request
+records its wall time, the number and duration of its SQL queries, the time
+spent rendering templates and rendering the response (for the frontend's
+API views, the REST framework renderer serializing the data), returned in a ``Server-Timing`` header.
+Profiles are kept per view in a window of the most recent
+``PROFILING_WINDOW`` samples, summarized by ``stats``.
+"""
+import random
+import threading
+from bisect import bisect_left
+from collections import deque
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.utils import CursorDebugWrapper
+from django.http import Http404, JsonResponse
+from django.template import base
+
+# Upper bounds (ms) of the histogram buckets; the last bucket is unbounded.
+HISTOGRAM_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+HISTOGRAM_LABELS = ['<={}'.format(bound) for bound in HISTOGRAM_BOUNDS] + ['>{}'.format(HISTOGRAM_BOUNDS[-1])]
+SLOWEST_QUERIES = 5
+
+_local = threading.local()
+
+
+def _timings():
+    """The timings of the request profiled in this thread, if any."""
+    return getattr(_local, 'timings', None)
+
+
+class ProfilingCursorWrapper(CursorDebugWrapper):
+    """Debug cursor adding the precise duration of each query to the profile.
+
+    ``connection.queries`` only keeps durations rounded to the millisecond.
+    """
+
+    def execute(self, sql, params=None):
+        started = perf_counter()
+        try:
+            return super(ProfilingCursorWrapper, self).execute(sql, params)
+        finally:
+            _local.queries.append(((perf_counter() - started) * 1000, sql))
+
+    def executemany(self, sql, param_list):
+        started = perf_counter()
+        try:
+            return super(ProfilingCursorWrapper, self).executemany(sql, param_list)
+        finally:
+            _local.queries.append(((perf_counter() - started) * 1000, sql))
+
+
+def instrument_templates():
+    """Time ``Template.render``; nested templates count in their parent."""
+    if getattr(base.Template.render, 'profiled', False):
+        return
+    render = base.Template.render
+
+    def profiled_render(self, context):
+        timings = _timings()
+        if timings is None or _local.in_template:
+            return render(self, context)
+        _local.in_template = True
+        started = perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            _local.in_template = False
+            timings['template'] = timings.get('template', 0) + perf_counter() - started
+
+    profiled_render.profiled = True
+    base.Template.render = profiled_render
+
+
+def _percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))]
+
+
+class Stats(object):
+    """Rolling window of profiles per view."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def add(self, view, profile):
+        with self._lock:
+            if view not in self._views:
+                self._views[view] = deque(maxlen=self.window)
+            self._views[view].append(profile)
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+    def summary(self):
+        """Latency percentiles, histogram and mean phases per view.
+
+        ``slowest_queries`` lists the slowest statements (without their
+        parameters) with the longest time each of them took.
+        """
+        with self._lock:
+            views = {view: list(profiles) for view, profiles in self._views.items()}
+        summary = {}
+        for view, profiles in views.items():
+            totals = sorted(profile['total'] for profile in profiles)
+            histogram = [0] * len(HISTOGRAM_LABELS)
+            for total in totals:
+                histogram[bisect_left(HISTOGRAM_BOUNDS, total)] += 1
+            slowest = {}
+            for profile in profiles:
+                for time, sql in profile['slowest']:
+                    slowest[sql] = max(time, slowest.get(sql, 0))
+            slowest = sorted(slowest.items(), key=lambda query: -query[1])[:SLOWEST_QUERIES]
+            summary[view] = {
+                'count': len(profiles),
+                'p50': _percentile(totals, 0.5),
+                'p90': _percentile(totals, 0.9),
+                'p99': _percentile(totals, 0.99),
+                'max': totals[-1],
+                'histogram': dict(zip(HISTOGRAM_LABELS, histogram)),
+                'mean': {
+                    name: sum(profile[name] for profile in profiles) / len(profiles)
+                    for name in ('total', 'sql', 'queries', 'template', 'render')
+                },
+                'slowest_queries': [{'time': time, 'sql': sql} for sql, time in slowest],
+            }
+        return summary
+
+
+STATS = Stats(getattr(settings, 'PROFILING_WINDOW', 1000))
+
+
+class ProfilingMiddleware(object):
+    """Profile a sample of the requests, see the module docstring.
+
+    Put it first in ``MIDDLEWARE`` so that the other middleware is included.
+    """
+
+    def __init__(self, get_response):
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        if not self.sample_rate:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        instrument_templates()
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        _local.timings = {}
+        _local.queries = queries = []
+        _local.in_template = False
+        debug_cursors = {}
+        for connection in connections.all():
+            debug_cursors[connection] = connection.force_debug_cursor
+            connection.force_debug_cursor = True
+            connection.make_debug_cursor = lambda cursor, db=connection: ProfilingCursorWrapper(cursor, db)
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            total = perf_counter() - started
+            for connection, force_debug_cursor in debug_cursors.items():
+                connection.force_debug_cursor = force_debug_cursor
+                del connection.make_debug_cursor
+            timings, _local.timings = _local.timings, None
+
+        profile = {
+            'total': total * 1000,
+            'sql': sum(time for time, sql in queries),
+            'queries': len(queries),
+            'template': timings.get('template', 0) * 1000,
+            'render': timings.get('render', 0) * 1000,
+            'slowest': sorted(queries, key=lambda query: -query[0])[:SLOWEST_QUERIES],
+        }
+        match = request.resolver_match
+        STATS.add(match.view_name if match else '<unresolved>', profile)
+        response['Server-Timing'] = ', '.join([
+            'total;dur={:.1f}'.format(profile['total']),
+            'sql;dur={:.1f};desc="{} queries"'.format(profile['sql'], profile['queries']),
+            'template;dur={:.1f}'.format(profile['template']),
+            'render;dur={:.1f}'.format(profile['render']),
+        ])
+        return response
+
+    def process_template_response(self, request, response):
+        timings = _timings()
+        if timings is not None:
+            started = perf_counter()
+
+            def rendered(response):
+                timings['render'] = timings.get('render', 0) + perf_counter() - started
+            response.add_post_render_callback(rendered)
+        return response
+
+
+def stats(request):
+    """The profiling summary as JSON, for staff or with ``DEBUG``."""
+    if not settings.DEBUG and not request.user.is_staff:
+        raise Http404
+    return JsonResponse({
+        'sample_rate': getattr(settings, 'PROFILING_SAMPLE_RATE', 0),
+        'window': STATS.window,
+        'views': STATS.summary(),
+    })
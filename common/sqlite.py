@@ -0,0 +1,40 @@
+"""Production SQLite: pragmas on every connection and a read-only alias.
+
+``PRAGMAS`` in the settings of a database is a list of ``(name, value)``
+run as ``PRAGMA`` statements on each new connection to it; with
+``journal_mode = wal`` readers no longer wait for writes to commit, nor
+writes for readers. ``ReadReplicaRouter`` sends reads to
+``settings.SQLITE_READ_ALIAS``, a second, read-only connection to the same
+file, except within a transaction of the default alias, which must see its
+own writes.
+"""
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def apply_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    for name, value in connection.settings_dict.get('PRAGMAS', ()):
+        connection.connection.execute('PRAGMA {} = {}'.format(name, value))
+
+
+class ReadReplicaRouter(object):
+    """Route reads to the read-only alias outside of transactions."""
+
+    def db_for_read(self, model, **hints):
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return settings.SQLITE_READ_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
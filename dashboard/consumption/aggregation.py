@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""Vectorized aggregation of consumption series.
+
+Series of several users are aligned into a ``Matrix`` (users x 30 minute
+slots, NaN where there is no reading) and resampled to hours, days, weeks or
+months with ``numpy.add.reduceat``. Users are processed in chunks and the
+per-bucket results merged, so memory depends on the chunk size and not on the
+number of users.
+"""
+from __future__ import unicode_literals
+
+import numpy as np
+
+from consumption.models import Rollup, User
+from consumption.series import DAY, INTERVAL, TimeSeries, from_epoch
+from consumption.storage import get_storage
+from consumption.utils import chunks
+
+HOUR = 60 * 60
+WEEK = 7 * DAY
+# The epoch is a Thursday; weeks start on Monday.
+WEEK_OFFSET = 3 * DAY
+
+PERIODS = ('half_hour', 'hour', 'day', 'week', 'month')
+
+
+def bucket_of(epochs, period):
+    """The epoch of the start of the ``period`` containing each of ``epochs``."""
+    epochs = np.asarray(epochs, dtype=np.int64)
+    if period == 'half_hour':
+        return epochs // INTERVAL * INTERVAL
+    if period == 'hour':
+        return epochs // HOUR * HOUR
+    if period == 'day':
+        return epochs // DAY * DAY
+    if period == 'week':
+        return (epochs + WEEK_OFFSET) // WEEK * WEEK - WEEK_OFFSET
+    if period == 'month':
+        months = epochs.astype('datetime64[s]').astype('datetime64[M]')
+        return months.astype('datetime64[s]').astype(np.int64)
+    raise ValueError('Unknown period {!r}, expected one of {}.'.format(period, ', '.join(PERIODS)))
+
+
+class Aggregate(object):
+    """Consumption per bucket, summed over users.
+
+    ``buckets`` holds the epoch at which each bucket starts, ``total`` the sum
+    of the readings, ``count`` the number of readings and ``users`` the
+    number of users with at least one reading in the bucket. ``groups`` maps
+    an ``(area, tariff)`` pair to the ``Aggregate`` of its users.
+    """
+
+    def __init__(self, buckets, total, count, users, groups=None):
+        self.buckets = buckets
+        self.total = total
+        self.count = count
+        self.users = users
+        self.groups = groups or {}
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=np.int64),
+                   np.empty(0, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.buckets)
+
+    @property
+    def mean(self):
+        """Mean reading per bucket (Wh per 30 minutes)."""
+        return self.total / np.maximum(self.count, 1)
+
+    @property
+    def user_mean(self):
+        """Mean consumption of a user per bucket."""
+        return self.total / np.maximum(self.users, 1)
+
+    def merge(self, other):
+        """Add the buckets of ``other``, which may cover a different range."""
+        buckets = np.union1d(self.buckets, other.buckets)
+        merged = []
+        for name in ('total', 'count', 'users'):
+            values = np.zeros(len(buckets), dtype=getattr(self, name).dtype)
+            values[np.searchsorted(buckets, self.buckets)] += getattr(self, name)
+            values[np.searchsorted(buckets, other.buckets)] += getattr(other, name)
+            merged.append(values)
+        groups = dict(self.groups)
+        for key, group in other.groups.items():
+            groups[key] = groups[key].merge(group) if key in groups else group
+        return Aggregate(buckets, *merged, groups=groups)
+
+
+class Matrix(object):
+    """Series of several users aligned on the same 30 minute slots."""
+
+    def __init__(self, user_ids, start, values):
+        self.user_ids = list(user_ids)
+        self.start = start
+        self.values = values
+
+    @classmethod
+    def from_series(cls, series_by_user):
+        """Align ``{user_id: TimeSeries}`` into one users x slots array."""
+        series_by_user = {user_id: series for user_id, series in series_by_user.items() if len(series)}
+        if not series_by_user:
+            return cls([], 0, np.empty((0, 0), dtype=np.float32))
+        start = min(series.start for series in series_by_user.values())
+        end = max(series.end for series in series_by_user.values())
+        values = np.full((len(series_by_user), (end - start) // INTERVAL), np.nan, dtype=np.float32)
+        for row, series in enumerate(series_by_user.values()):
+            offset = (series.start - start) // INTERVAL
+            values[row, offset:offset + len(series)] = series.values
+        return cls(series_by_user.keys(), start, values)
+
+    def timestamps(self):
+        return self.start + np.arange(self.values.shape[1], dtype=np.int64) * INTERVAL
+
+    def series(self, row):
+        return TimeSeries(self.start, self.values[row])
+
+    def resample(self, period):
+        """Sum the readings per ``period``.
+
+        Returns ``(buckets, totals, counts)``; ``totals`` and ``counts`` are
+        users x buckets arrays.
+        """
+        if not self.values.size:
+            return np.empty(0, dtype=np.int64), np.empty((len(self.user_ids), 0)), \
+                np.empty((len(self.user_ids), 0), dtype=np.int64)
+        slots = bucket_of(self.timestamps(), period)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(slots)) + 1))
+        readings = ~np.isnan(self.values)
+        filled = np.where(readings, self.values, 0).astype(np.float64)
+        totals = np.add.reduceat(filled, starts, axis=1)
+        counts = np.add.reduceat(readings.astype(np.int64), starts, axis=1)
+        return slots[starts], totals, counts
+
+    def aggregate(self, period, keys=None):
+        """Aggregate every user per ``period``, grouped by ``keys`` (one per user) if given."""
+        buckets, totals, counts = self.resample(period)
+        if not len(buckets):
+            return Aggregate.empty()
+        if keys is None:
+            return self._aggregate(buckets, totals, counts)
+        keys = list(keys)
+        groups = {}
+        for key in set(keys):
+            rows = np.array([k == key for k in keys])
+            groups[key] = self._aggregate(buckets, totals[rows], counts[rows])
+        aggregate = self._aggregate(buckets, totals, counts)
+        aggregate.groups = groups
+        return aggregate
+
+    @staticmethod
+    def _aggregate(buckets, totals, counts):
+        present = counts.sum(axis=0) > 0
+        return Aggregate(
+            buckets[present],
+            totals.sum(axis=0)[present],
+            counts.sum(axis=0)[present],
+            (counts > 0).sum(axis=0)[present],
+        )
+
+
+def aggregate_users(users, period, storage=None, start=None, end=None, chunk_size=500):
+    """Aggregate the readings of ``users`` per ``period``, grouped by area and tariff."""
+    storage = storage or get_storage()
+    aggregate = Aggregate.empty()
+    for chunk in chunks(users, chunk_size):
+        keys = {user.id: (user.area, user.tariff) for user in chunk}
+        matrix = Matrix.from_series(storage.all_series(list(keys), start, end))
+        part = matrix.aggregate(period, [keys[user_id] for user_id in matrix.user_ids])
+        aggregate = aggregate.merge(part)
+    return aggregate
+
+
+def aggregate_rollups(period, start=None, end=None):
+    """Same as ``aggregate_users`` for every user, read from ``Rollup`` (days and months only).
+
+    ``start`` and ``end`` select the buckets starting in ``[start, end)``.
+    """
+    rollups = Rollup.objects.filter(period=period)
+    if start is not None:
+        rollups = rollups.filter(start__gte=from_epoch(start).date())
+    if end is not None:
+        rollups = rollups.filter(start__lt=from_epoch(end).date())
+    rows = list(rollups.order_by('start').values_list('start', 'area', 'tariff', 'users', 'total', 'count'))
+    if not rows:
+        return Aggregate.empty()
+    starts = np.array([row[0] for row in rows], dtype='datetime64[s]').astype(np.int64)
+    users, total, count = (np.array([row[i] for row in rows]) for i in (3, 4, 5))
+    keys = [(row[1], row[2]) for row in rows]
+    buckets = np.unique(starts)
+    index = np.searchsorted(buckets, starts)
+
+    def collect(selected):
+        aggregate = Aggregate(
+            buckets, np.zeros(len(buckets)), np.zeros(len(buckets), dtype=np.int64),
+            np.zeros(len(buckets), dtype=np.int64))
+        np.add.at(aggregate.total, index[selected], total[selected])
+        np.add.at(aggregate.count, index[selected], count[selected])
+        np.add.at(aggregate.users, index[selected], users[selected])
+        present = aggregate.count > 0
+        return Aggregate(*(a[present] for a in (buckets, aggregate.total, aggregate.count, aggregate.users)))
+
+    aggregate = collect(np.ones(len(rows), dtype=bool))
+    aggregate.groups = {key: collect(np.array([k == key for k in keys])) for key in set(keys)}
+    return aggregate
+
+
+def summarize(period='day', start=None, end=None):
+    """Aggregate all users per ``period``, optionally between two epochs.
+
+    Days and months are pre-aggregated by the import, so they are read from
+    the rollups; shorter periods and weeks are computed from the stored
+    series.
+    """
+    if period not in PERIODS:
+        raise ValueError('Unknown period {!r}, expected one of {}.'.format(period, ', '.join(PERIODS)))
+    if period in (Rollup.DAY, Rollup.MONTH):
+        return aggregate_rollups(period, start, end)
+    return aggregate_users(User.objects.order_by('id'), period, start=start, end=end)
@@ -6,3 +6,6 @@ from django.apps import AppConfig
 
 class ConsumptionConfig(AppConfig):
     name = 'consumption'
+
+    def ready(self):
+        from common import sqlite  # noqa: F401
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of the import and the views on generated datasets.
+
+Every benchmark is measured by ``common.benchmark.measure``, which also
+counts its SQL queries and the peak memory allocated by Python.
+"""
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client
+from django.test.utils import override_settings
+
+from common.benchmark import measure
+from consumption.aggregation import PERIODS
+from consumption.dataset import generate
+from consumption.importer import run_import
+from consumption.models import User
+
+SIZES = (10, 100)
+
+
+def benchmark_import(data_dir, size, workers, repeat):
+    """Full imports, parsing or from a warm parse cache, and no-op incremental imports."""
+    results = []
+    for name, use_cache in (('import', False), ('import (parse cache)', True)):
+        imported = []
+
+        def full_import(use_cache=use_cache):
+            imported.append(run_import(data_dir, workers=workers, use_cache=use_cache))
+
+        # The warm-up run of the cached import fills the cache.
+        result = measure(name, size, full_import, repeat, warmup=use_cache)
+        rows = imported[-1].rows
+        result.update(rows=rows, rows_per_second=rows / (result['p50'] / 1000))
+        results.append(result)
+
+    results.append(measure(
+        'import --incremental (unchanged)', size,
+        lambda: run_import(data_dir, workers=workers, incremental=True), repeat, warmup=False))
+    return results
+
+
+def benchmark_views(size, repeat):
+    """The pages and every period of their charts, with empty caches."""
+    client = Client()
+    user_id = User.objects.order_by('id').values_list('id', flat=True).first()
+    urls = [('summary', '/summary/'), ('detail', '/detail/{}/'.format(user_id))]
+    for period in PERIODS:
+        urls.append(('summary chart {}'.format(period), '/summary/chart/?period={}'.format(period)))
+    for period in PERIODS:
+        urls.append(('detail chart {}'.format(period), '/detail/{}/chart/?period={}'.format(user_id, period)))
+
+    results = []
+    for name, url in urls:
+        def get(url=url):
+            response = client.get(url)
+            if response.status_code != 200:
+                raise AssertionError('{} returned {}'.format(url, response.status_code))
+        results.append(measure(name, size, get, repeat, before=cache.clear))
+    return results
+
+
+def run(sizes=SIZES, days=365, repeat=10, workers=1, seed=0, log=None):
+    """Benchmark datasets of ``sizes`` users, each on an empty database."""
+    results = []
+    for size in sizes:
+        data_dir = tempfile.mkdtemp()
+        try:
+            generate(data_dir, users=size, days=days, seed=seed)
+            call_command('flush', interactive=False, verbosity=0)
+            cache.clear()
+            with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver'],
+                                   CONSUMPTION_CACHE_DIR=os.path.join(data_dir, 'cache')):
+                for result in benchmark_import(data_dir, size, workers, max(1, repeat // 5)) + \
+                        benchmark_views(size, repeat):
+                    results.append(result)
+                    if log:
+                        log(result)
+        finally:
+            shutil.rmtree(data_dir)
+    return results
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Monthly bills priced from the half-hourly readings.
+
+``settings.CONSUMPTION_TARIFFS`` maps the tariff names of ``user_data.csv``
+to a tariff definition: the dotted path of a ``Tariff`` class under
+``'class'`` and its arguments. ``settings.CONSUMPTION_SUPPLY_COST`` defines
+what the supplied energy costs in the same way. Tariffs price the readings
+of many users at once, as a ``consumption.aggregation.Matrix`` (users x 30
+minute slots), with array operations over whole months.
+
+``bill_users`` stores the result in ``MonthlyStatistics``: consumption in
+kWh, the bill (what the user pays) and the cost (what the energy cost)
+of each user and month with readings.
+"""
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from consumption.aggregation import Matrix, bucket_of
+from consumption.models import DataVersion, MonthlyStatistics, User
+from consumption.series import DAY, INTERVAL, from_epoch
+from consumption.storage import get_storage
+from consumption.utils import chunks
+
+SLOTS = DAY // INTERVAL
+
+
+class Tariff(object):
+    """Prices readings per month: energy charges plus a monthly ``standing_charge``.
+
+    Subclasses implement ``energy``. The standing charge applies to the
+    months with at least one reading.
+    """
+
+    def __init__(self, standing_charge=0.0):
+        self.standing_charge = standing_charge
+
+    def price(self, matrix):
+        """``(months, kwh, charges, present)`` for the users and months of ``matrix``.
+
+        ``months`` holds the epoch of the first day of each month; the other
+        arrays are users x months, ``present`` being true where there are
+        readings.
+        """
+        months, totals, counts = matrix.resample('month')
+        kwh = totals / 1000
+        present = counts > 0
+        charges = self.energy(matrix, kwh) + self.standing_charge * present
+        return months, kwh, charges, present
+
+    def energy(self, matrix, kwh):
+        """Energy charges per user and month; ``kwh`` is the consumption per user and month."""
+        raise NotImplementedError
+
+
+class FlatTariff(Tariff):
+    """One ``rate`` per kWh."""
+
+    def __init__(self, rate, standing_charge=0.0):
+        super(FlatTariff, self).__init__(standing_charge)
+        self.rate = rate
+
+    def energy(self, matrix, kwh):
+        return kwh * self.rate
+
+
+def _slot(moment):
+    hours, minutes = (int(part) for part in moment.split(':'))
+    if (hours * 60 + minutes) * 60 % INTERVAL:
+        raise ValueError('Band limits must fall on a {} minute boundary.'.format(INTERVAL // 60))
+    return (hours * 60 + minutes) * 60 // INTERVAL
+
+
+class TimeOfUseTariff(Tariff):
+    """A rate per kWh for each band of the (UTC) day.
+
+    ``bands`` is a list of ``[start, end, rate]`` with ``HH:MM`` limits, end
+    excluded; a band ending at or before its start wraps around midnight.
+    Together the bands must cover the whole day.
+    """
+
+    def __init__(self, bands, standing_charge=0.0):
+        super(TimeOfUseTariff, self).__init__(standing_charge)
+        self.rates = np.full(SLOTS, np.nan)
+        for start, end, rate in bands:
+            start, end = _slot(start), _slot(end)
+            slots = np.arange(start, end if end > start else end + SLOTS) % SLOTS
+            self.rates[slots] = rate
+        if np.isnan(self.rates).any():
+            raise ValueError('The bands of a time of use tariff must cover the whole day.')
+
+    def energy(self, matrix, kwh):
+        rates = self.rates[matrix.timestamps() % DAY // INTERVAL].astype(np.float32)
+        weighted = Matrix(matrix.user_ids, matrix.start, matrix.values * rates)
+        return weighted.resample('month')[1] / 1000
+
+
+class TieredTariff(Tariff):
+    """Rates per kWh by block of monthly consumption.
+
+    ``tiers`` is a list of ``[limit, rate]`` in increasing order of limit:
+    the kWh of a month up to the first limit are charged at the first rate,
+    the next ones up to the second limit at the second rate, and so on. The
+    last limit is ``None``.
+    """
+
+    def __init__(self, tiers, standing_charge=0.0):
+        super(TieredTariff, self).__init__(standing_charge)
+        if not tiers or tiers[-1][0] is not None:
+            raise ValueError('The last tier must have no limit.')
+        self.tiers = tiers
+
+    def energy(self, matrix, kwh):
+        charges = np.zeros_like(kwh)
+        lower = 0.0
+        for limit, rate in self.tiers:
+            upper = np.inf if limit is None else limit
+            charges += np.clip(kwh - lower, 0, upper - lower) * rate
+            lower = upper
+        return charges
+
+
+def load_tariff(definition):
+    """A ``Tariff`` from a settings definition."""
+    arguments = dict(definition)
+    return import_string(arguments.pop('class'))(**arguments)
+
+
+def get_tariffs():
+    return {name: load_tariff(definition) for name, definition in settings.CONSUMPTION_TARIFFS.items()}
+
+
+def get_supply_cost():
+    return load_tariff(settings.CONSUMPTION_SUPPLY_COST)
+
+
+def bill_users(user_ids=None, tariffs=None, storage=None, chunk_size=500, since=None):
+    """Compute and store the monthly statistics of ``user_ids`` (default: every user).
+
+    Users are priced by tariff in chunks of ``chunk_size``. ``tariffs``
+    restricts billing to users of these tariff names. ``since`` (an epoch)
+    re-bills only the months from the one containing it, the earlier ones
+    being left as they are. Users whose tariff is
+    not defined in the settings are left out and lose the statistics of a
+    tariff they had before; returns their ids.
+    """
+    storage = storage or get_storage()
+    definitions = get_tariffs()
+    supply_cost = get_supply_cost()
+    users = User.objects.all()
+    if tariffs is not None:
+        users = users.filter(tariff__in=tariffs)
+    by_tariff = defaultdict(list)
+    if user_ids is None:
+        for user_id, tariff in users.values_list('id', 'tariff'):
+            by_tariff[tariff].append(user_id)
+    else:
+        for ids in chunks(user_ids):
+            for user_id, tariff in users.filter(id__in=ids).values_list('id', 'tariff'):
+                by_tariff[tariff].append(user_id)
+
+    start = None if since is None else int(bucket_of(since, 'month'))
+    unpriced = []
+    for tariff, tariff_user_ids in sorted(by_tariff.items()):
+        if tariff not in definitions:
+            unpriced.extend(tariff_user_ids)
+            for ids in chunks(tariff_user_ids):
+                MonthlyStatistics.objects.filter(user_id__in=ids).delete()
+            continue
+        for ids in chunks(tariff_user_ids, chunk_size):
+            matrix = Matrix.from_series(storage.all_series(ids, start))
+            months, kwh, bills, present = definitions[tariff].price(matrix)
+            costs = supply_cost.price(matrix)[2]
+            stale = MonthlyStatistics.objects.filter(user_id__in=ids)
+            if start is not None:
+                stale = stale.filter(month__gte=from_epoch(start).date())
+            stale.delete()
+            month_dates = [from_epoch(month).date() for month in months.tolist()]
+            rows, columns = np.nonzero(present)
+            MonthlyStatistics.objects.bulk_create([
+                MonthlyStatistics(
+                    user_id=matrix.user_ids[row], month=month_dates[column],
+                    consumption=consumption, total_bill=bill, total_cost=cost)
+                for row, column, consumption, bill, cost in zip(
+                    rows.tolist(), columns.tolist(), kwh[rows, columns].tolist(),
+                    bills[rows, columns].tolist(), costs[rows, columns].tolist())
+            ])
+    DataVersion.bump()
+    return unpriced
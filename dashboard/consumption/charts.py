@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Chart data for the views: downsampled and cached.
+
+A chart is cached per name (which series), range, period, number of points
+and method. The key also contains the data version (``DataVersion``), which
+every write of readings, rollups, bills or users bumps, so nothing has to be
+invalidated when the data changes.
+
+While a background job writes (``consumption.jobs``), the version stays the
+one from before the job started: what was cached then keeps being served.
+Each result built from complete data is also saved, without the version, in
+``settings.CONSUMPTION_SNAPSHOT_CACHE``; a result missing from the cache
+during a job is served from there, and is built from the half-written data
+(and not cached) only if it was never built before.
+"""
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.cache import cache, caches
+
+from consumption.downsampling import downsample
+from consumption.models import DataVersion, Job
+
+CACHE_TIMEOUT = 60 * 60
+DEFAULT_POINTS = 1000
+MAX_POINTS = 10000
+
+
+def snapshot():
+    """``(version, writing)``: ``writing`` is true while a writing job runs.
+
+    The version changes whenever readings, rollups, bills or users are
+    written, by a job or not.
+    """
+    job = Job.objects.filter(kind__in=Job.WRITING, started_at__isnull=False).order_by(
+        '-started_at', '-id').values_list('status', 'data_version').first()
+    if job is not None and job[0] == Job.RUNNING:
+        return job[1], True
+    return 'v{}'.format(DataVersion.current()), False
+
+
+def data_version():
+    """Changes whenever the data changes, see ``snapshot``."""
+    return snapshot()[0]
+
+
+def cached(kind, parts, build):
+    """Return ``build()``, cached for ``kind``, the ``parts`` of the key and the current data."""
+    version, writing = snapshot()
+    parts = ':'.join(str(part) for part in parts)
+    key = 'consumption:{}:{}:{}'.format(kind, version, parts)
+    data = cache.get(key)
+    if data is not None:
+        return data
+    snapshots = caches[settings.CONSUMPTION_SNAPSHOT_CACHE]
+    last_key = 'consumption:{}:{}'.format(kind, parts)
+    if writing:
+        data = snapshots.get(last_key)
+        return build() if data is None else data
+    data = build()
+    cache.set(key, data, CACHE_TIMEOUT)
+    snapshots.set(last_key, data)
+    return data
+
+
+def cached_chart(name, period, start, end, points, method, build):
+    """Return ``build()``, cached for the parameters and the current data."""
+    return cached('chart', (name, period, start, end, points, method), build)
+
+
+def chart_data(x, series, points, method):
+    """Reduce ``series`` (a list of ``(name, values)``) sharing the epochs ``x``.
+
+    The points kept are chosen on the first series and used for all of them.
+    """
+    if not series or not len(x):
+        return {'x': [], 'series': {name: [] for name, values in series}, 'size': 0}
+    indices = downsample(x, series[0][1], points, method)
+    return {
+        'x': x[indices].tolist(),
+        'series': {name: values[indices].tolist() for name, values in series},
+        'size': len(x),
+    }
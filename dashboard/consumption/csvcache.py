@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Binary cache of parsed consumption files.
+
+Parsing dominates the time spent reading a CSV file. Once a whole file has
+been parsed, its readings are saved as a ``.npy`` structured array of int64
+epochs and float32 values, named after a hash of the file's path, size,
+mtime and content; reading the same file again maps that array into memory
+instead of parsing. Entries are evicted least recently used first (a hit
+refreshes the entry's mtime) when the directory grows over its size cap.
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+from django.conf import settings
+
+ENTRY_DTYPE = np.dtype([('epoch', '<i8'), ('value', '<f4')])
+
+
+def get_parse_cache():
+    """The cache configured in settings, ``None`` if ``CONSUMPTION_CACHE_DIR`` is unset."""
+    directory = getattr(settings, 'CONSUMPTION_CACHE_DIR', None)
+    if not directory:
+        return None
+    return ParseCache(directory, settings.CONSUMPTION_CACHE_SIZE)
+
+
+class ParseCache(object):
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    @staticmethod
+    def digest(f, block_size):
+        """``(hash, length, last byte)`` of the rest of ``f``, read ``block_size`` bytes at a time."""
+        digest = hashlib.blake2b(digest_size=16)
+        length, last = 0, b''
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+            length += len(block)
+            last = block[-1:]
+        return digest.hexdigest(), length, last
+
+    @staticmethod
+    def key(path, size, mtime, digest):
+        identity = '\0'.join([os.path.abspath(path), str(size), str(mtime), digest])
+        return hashlib.blake2b(identity.encode('utf-8'), digest_size=16).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key):
+        """``(epochs, values)`` memory-mapped from entry ``key``, or ``None``."""
+        path = self._path(key)
+        try:
+            entries = np.load(path, mmap_mode='r')
+            os.utime(path)
+        except (IOError, OSError, ValueError):
+            return None
+        return entries['epoch'], entries['value']
+
+    def put(self, key, epochs, values):
+        """Store an entry; empty files are not worth one (and cannot be mapped)."""
+        if not len(epochs):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = np.empty(len(epochs), dtype=ENTRY_DTYPE)
+        entries['epoch'] = epochs
+        entries['value'] = values
+        # Written aside and renamed, so a concurrent reader never maps a partial file.
+        fd, temporary = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, entries)
+            os.replace(temporary, self._path(key))
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    def size(self):
+        return sum(size for mtime, size, path in self._entries())
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in ``max_size``."""
+        entries = sorted(self._entries())
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npy'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return entries
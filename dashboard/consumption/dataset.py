@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Synthetic data in the layout of the challenge CSV files.
+
+``generate`` writes ``user_data.csv`` and one ``consumption/<id>.csv`` per
+user, with a reading every 30 minutes following a daily load curve, so the
+import and the views can be benchmarked at any scale. The same seed always
+produces the same files.
+"""
+from __future__ import unicode_literals
+
+import csv
+import io
+import os
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+from consumption.series import DAY, INTERVAL, to_epoch
+
+AREAS = ('a1', 'a2')
+TARIFFS = ('t1', 't2', 't3')
+
+GeneratedDataset = namedtuple('GeneratedDataset', 'users rows bytes seconds')
+
+
+def timestamp_column(start, days):
+    """The ``datetime`` column of ``days`` days of readings from ``start``, as bytes lines."""
+    epochs = to_epoch(start) + np.arange(days * DAY // INTERVAL, dtype=np.int64) * INTERVAL
+    return [value.replace('T', ' ').encode() for value in epochs.astype('datetime64[s]').astype(str)]
+
+
+def readings(rng, slots):
+    """Half-hourly readings (Wh) of one user: a daily curve with noise."""
+    phase = np.arange(slots) % (DAY // INTERVAL) * (2 * np.pi / (DAY // INTERVAL))
+    base = rng.uniform(50, 300)
+    curve = base * (1 + 0.6 * np.sin(phase - rng.uniform(1.5, 2.5)))
+    noise = rng.gamma(2.0, base / 4, slots)
+    return np.round(curve + noise)
+
+
+def generate(data_dir, users=60, days=365, start=None, first_id=3000, seed=None):
+    """Write ``users`` users with ``days`` days of readings under ``data_dir``."""
+    started = time.time()
+    rng = np.random.RandomState(seed)
+    start = start or datetime(2016, 1, 1)
+    consumption_dir = os.path.join(data_dir, 'consumption')
+    if not os.path.isdir(consumption_dir):
+        os.makedirs(consumption_dir)
+
+    user_ids = range(first_id, first_id + users)
+    with open(os.path.join(data_dir, 'user_data.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'area', 'tariff'])
+        for user_id in user_ids:
+            writer.writerow([user_id, rng.choice(AREAS), rng.choice(TARIFFS)])
+
+    timestamps = timestamp_column(start, days)
+    written = 0
+    for user_id in user_ids:
+        values = np.char.mod(b'%.1f', readings(rng, len(timestamps)))
+        buffer = io.BytesIO()
+        buffer.write(b'datetime,consumption\r\n')
+        buffer.write(b''.join(b'%s,%s\r\n' % row for row in zip(timestamps, values)))
+        with open(os.path.join(consumption_dir, '{}.csv'.format(user_id)), 'wb') as f:
+            written += f.write(buffer.getvalue())
+    return GeneratedDataset(users, users * len(timestamps), written, time.time() - started)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Reduce a line chart series to a number of points a browser can draw.
+
+Both methods return the indices of the points to keep, so several series
+sharing the same x axis can be reduced with the indices of the first one.
+"""
+from __future__ import unicode_literals
+
+import numpy as np
+
+METHODS = ('lttb', 'minmax')
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets (Steinarsson, 2013).
+
+    Keeps the first and last points and, in each of ``threshold - 2`` buckets,
+    the point forming the largest triangle with the previously kept point and
+    the average of the next bucket, which preserves peaks.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    size = len(x)
+    if threshold >= size or threshold < 3:
+        return np.arange(size)
+
+    edges = np.linspace(1, size - 1, threshold - 1).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = size - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < len(edges) else size
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+        areas = np.abs(
+            (x[previous] - average_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (average_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def minmax(y, threshold):
+    """Keep the lowest and the highest point of ``threshold / 2`` buckets."""
+    y = np.asarray(y, dtype=np.float64)
+    size = len(y)
+    if threshold >= size or threshold < 2:
+        return np.arange(size)
+
+    edges = np.linspace(0, size, threshold // 2 + 1).astype(np.int64)
+    kept = set()
+    for start, end in zip(edges[:-1], edges[1:]):
+        if end > start:
+            kept.add(start + int(np.argmin(y[start:end])))
+            kept.add(start + int(np.argmax(y[start:end])))
+    return np.array(sorted(kept), dtype=np.int64)
+
+
+def downsample(x, y, threshold, method='lttb'):
+    """Indices of the points of ``(x, y)`` to draw with ``method``."""
+    if method == 'lttb':
+        return lttb(x, y, threshold)
+    if method == 'minmax':
+        return minmax(y, threshold)
+    raise ValueError('Unknown method {!r}, expected one of {}.'.format(method, ', '.join(METHODS)))
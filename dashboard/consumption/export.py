@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""Streaming export of the stored readings as CSV or NDJSON.
+
+Users are read from the storage ``USERS_PER_QUERY`` at a time and each one
+is formatted and sent before the next is loaded, so memory use depends on
+the size of one batch, not of the export.
+"""
+from __future__ import unicode_literals
+
+from datetime import datetime
+
+from django.http import StreamingHttpResponse
+from django.utils.text import compress_sequence
+
+from consumption.models import User
+from consumption.series import format_epochs, to_epoch
+from consumption.storage import get_storage
+from consumption.utils import chunks
+
+USERS_PER_QUERY = 50
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def selected_users(query):
+    """Users selected by ``user`` (comma separated ids), ``area`` and ``tariff`` in ``query``.
+
+    Returns a queryset ordered by id. Raises ``ValueError`` for invalid ids.
+    """
+    users = User.objects.order_by('id')
+    if query.get('user'):
+        try:
+            ids = [int(i) for i in query['user'].split(',') if i]
+        except ValueError:
+            raise ValueError('user must be comma separated ids.')
+        users = users.filter(id__in=ids)
+    for name in ('area', 'tariff'):
+        if query.get(name):
+            users = users.filter(**{name: query[name]})
+    return users
+
+
+def date_range(query):
+    """``(start, end)`` epochs of the ``YYYY-MM-DD`` dates ``start`` and ``end`` (excluded) in ``query``."""
+    try:
+        return tuple(
+            to_epoch(datetime.strptime(query[name], '%Y-%m-%d')) if query.get(name) else None
+            for name in ('start', 'end'))
+    except ValueError:
+        raise ValueError('start and end must be YYYY-MM-DD.')
+
+
+def parameters(query):
+    """Filters of an export from the query string ``query``.
+
+    Users are selected with ``selected_users`` and dates with ``date_range``.
+    Raises ``ValueError`` for invalid values.
+    """
+    fmt = query.get('format', 'csv')
+    if fmt not in FORMATS:
+        raise ValueError('Unknown format.')
+    users = selected_users(query)
+    start, end = date_range(query)
+    return {
+        'format': fmt,
+        'user_ids': list(users.values_list('id', flat=True)),
+        'start': start,
+        'end': end,
+        'gzip': query.get('gzip') in ('1', 'true'),
+    }
+
+
+def readings(user_ids, start=None, end=None, progress=None):
+    """Yield ``(user_id, moments, values)`` per user, both as lists of strings.
+
+    ``progress(done, total)`` is called before each batch of users is read.
+    """
+    storage = get_storage()
+    for index, ids in enumerate(chunks(user_ids, USERS_PER_QUERY)):
+        if progress is not None:
+            progress(index * USERS_PER_QUERY, len(user_ids))
+        batch = storage.all_series(ids, start, end)
+        for user_id in ids:
+            series = batch.pop(user_id, None)
+            if series is None or not len(series):
+                continue
+            mask = series.mask
+            # float32 to str gives the shortest repr, e.g. 39.0 rather than 39.0000000001.
+            yield user_id, format_epochs(series.timestamps()[mask]), series.values[mask].astype(str).tolist()
+
+
+def csv_chunks(user_ids, start=None, end=None, progress=None):
+    yield 'user_id,datetime,consumption\r\n'
+    for user_id, moments, values in readings(user_ids, start, end, progress):
+        yield ''.join('{},{},{}\r\n'.format(user_id, moment, value) for moment, value in zip(moments, values))
+
+
+def ndjson_chunks(user_ids, start=None, end=None, progress=None):
+    for user_id, moments, values in readings(user_ids, start, end, progress):
+        yield ''.join(
+            '{{"user_id": {}, "datetime": "{}", "consumption": {}}}\n'.format(user_id, moment, value)
+            for moment, value in zip(moments, values))
+
+
+def export_response(params):
+    """A ``StreamingHttpResponse`` of the readings selected by ``parameters``."""
+    generate = csv_chunks if params['format'] == 'csv' else ndjson_chunks
+    content = (chunk.encode('utf-8') for chunk in generate(params['user_ids'], params['start'], params['end']))
+    if params['gzip']:
+        content = compress_sequence(content)
+    response = StreamingHttpResponse(content, content_type=FORMATS[params['format']])
+    if params['gzip']:
+        response['Content-Encoding'] = 'gzip'
+    response['Content-Disposition'] = 'attachment; filename="consumption.{}"'.format(params['format'])
+    return response
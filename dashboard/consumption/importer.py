@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""Read the challenge CSV files and write them into the database.
+
+Parsing is CPU bound and independent per file, so it runs in a process pool;
+the parent process is the only one talking to the database and hands the
+parsed readings to the storage backend (``consumption.storage``) in large
+transactions.
+"""
+from __future__ import unicode_literals
+
+import csv
+import glob
+import hashlib
+import os
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import transaction
+
+from consumption.billing import bill_users
+from consumption.csvcache import get_parse_cache
+from consumption.models import DataVersion, ImportCheckpoint, User
+from consumption.rollups import update_changed_groups, update_rollups
+from consumption.series import from_epoch, to_epoch
+from consumption.storage import get_storage
+from consumption.utils import chunks
+from consumption.validation import (  # noqa: F401
+    BLOCK_SIZE, DATETIME_FORMAT, QualityReport, fill_gaps, parse_datetime, parse_file, validate_file, write_report)
+
+
+def read_users(path):
+    """Yield ``(id, area, tariff)`` tuples from ``user_data.csv``."""
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if not row:
+                continue
+            yield int(row[0]), row[1].strip(), row[2].strip()
+
+
+def user_id_from_path(path):
+    return int(os.path.splitext(os.path.basename(path))[0])
+
+
+ParsedFile = namedtuple(
+    'ParsedFile', 'user_id epochs values start offset size mtime prefix_hash cached report filled')
+
+# Bytes before the checkpoint offset whose hash tells a file rewritten in place.
+PREFIX_WINDOW = 64 * 1024
+
+
+def window_hash(f, offset):
+    """BLAKE2b of the ``PREFIX_WINDOW`` bytes of file ``f`` before ``offset``."""
+    start = max(offset - PREFIX_WINDOW, 0)
+    f.seek(start)
+    return hashlib.blake2b(f.read(offset - start), digest_size=20).hexdigest()
+
+
+def read_consumption(
+        path, offset=0, cache=None, previous=None, max_gap=0, checkpoint_hash=None, block_size=BLOCK_SIZE):
+    """Parse one ``consumption/<user_id>.csv`` file from byte ``offset``.
+
+    Returns a ``ParsedFile`` holding the readings as an int64 array of
+    ``epochs`` and a float32 array of ``values``, sorted, with each datetime
+    validated against ``DATETIME_FORMAT``. A timestamp which appears more
+    than once keeps its last reading. ``offset`` in the result points just
+    after the last complete line, so a line that is still being written is
+    picked up by the next import; ``size`` and ``mtime`` are taken before
+    reading so that a concurrent append is never marked as seen.
+
+    Only the ``PREFIX_WINDOW`` bytes before ``offset`` and the bytes after it
+    are read. ``checkpoint_hash`` is the ``window_hash`` of these bytes when
+    they were imported; if they changed, the file was rewritten in place and
+    is read from the start. ``start`` in the result is where it was read
+    from, and ``prefix_hash`` the hash of the window before the new
+    ``offset``. A rewrite which leaves the window as it was is not seen:
+    ``import`` without ``--incremental`` reads every file again.
+
+    Rows are checked while they are parsed, ``block_size`` bytes at a time
+    (``consumption.validation.parse_file``): the bytes held do not grow with
+    the file, only the readings returned do. ``report`` is the
+    ``QualityReport`` of the rows read, ``previous`` the
+    epoch of the last reading imported before ``offset``. Gaps of at most
+    ``max_gap`` readings are filled; ``filled`` counts the readings added.
+
+    A whole file read with a ``cache`` (``consumption.csvcache``) is hashed
+    block by block and looked up in it before parsing, and stored in it
+    after. Its report was written
+    when it was parsed, so a cache hit has none.
+    """
+    user_id = user_id_from_path(path)
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        if offset and checkpoint_hash is not None and window_hash(f, offset) != checkpoint_hash:
+            offset, previous = 0, None
+
+        key = cached = report = None
+        if cache is not None and offset == 0:
+            f.seek(0)
+            digest, length, last = cache.digest(f, block_size)
+            if length == stat.st_size and last == b'\n':
+                key = cache.key(path, stat.st_size, stat.st_mtime_ns, digest)
+                cached = cache.get(key)
+        if cached is not None:
+            epochs, values = cached
+            end = length
+        else:
+            f.seek(offset)
+            report = QualityReport(user_id, offset, previous)
+            epochs, values, end = parse_file(f, report, header=offset == 0, block_size=block_size)
+            if key is not None and end == length:
+                cache.put(key, epochs, values)
+        checkpoint_hash = window_hash(f, offset + end)
+
+    epochs, values, filled = fill_gaps(epochs, values, max_gap)
+    if report is not None:
+        report.filled = filled
+    return ParsedFile(
+        user_id, epochs, values, offset, offset + end, stat.st_size, stat.st_mtime_ns,
+        checkpoint_hash, cached is not None, report, filled)
+
+
+def ends_line(path, offset):
+    """Whether ``offset`` is just after a newline, i.e. a valid place to resume."""
+    if offset == 0:
+        return True
+    with open(path, 'rb') as f:
+        f.seek(offset - 1)
+        return f.read(1) == b'\n'
+
+
+def consumption_paths(data_dir):
+    return sorted(glob.glob(os.path.join(data_dir, 'consumption', '*.csv')))
+
+
+def parse_files(tasks, workers, cache=None, max_gap=0):
+    """Yield ``read_consumption`` results for ``(path, offset, previous, checkpoint_hash)`` tasks.
+
+    Tasks are handed to the pool in windows so that only a bounded number of
+    parsed files is ever waiting to be written, however many files there are.
+    """
+    if workers <= 1:
+        for path, offset, previous, checkpoint_hash in tasks:
+            yield read_consumption(path, offset, cache, previous, max_gap, checkpoint_hash)
+        return
+
+    window = workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(tasks), window):
+            paths, offsets, previous, checkpoint_hashes = zip(*tasks[start:start + window])
+            for result in executor.map(
+                    read_consumption, paths, offsets, [cache] * len(paths), previous, [max_gap] * len(paths),
+                    checkpoint_hashes):
+                yield result
+
+
+def import_users(path):
+    """Create or update users from ``user_data.csv``.
+
+    Returns the ids of all known users and the ids of the users whose area or
+    tariff changed.
+    """
+    existing = {user.id: user for user in User.objects.all()}
+    created = []
+    changed = []
+    with transaction.atomic():
+        for user_id, area, tariff in read_users(path):
+            user = existing.get(user_id)
+            if user is None:
+                user = User(id=user_id, area=area, tariff=tariff)
+                created.append(user)
+                existing[user_id] = user
+            elif (user.area, user.tariff) != (area, tariff):
+                User.objects.filter(pk=user_id).update(area=area, tariff=tariff)
+                changed.append(user_id)
+        User.objects.bulk_create(created)
+        if created or changed:
+            DataVersion.bump()
+    return set(existing), changed
+
+
+class ReadingWriter(object):
+    """Buffer parsed files and hand them to the storage backend in batches.
+
+    The readings, rollups and checkpoints of a batch are written in one
+    transaction, so an interrupted import never leaves a user half written or
+    a checkpoint ahead of the data.
+    """
+
+    def __init__(self, batch_size, storage=None):
+        self.batch_size = batch_size
+        self.storage = storage or get_storage()
+        self.written = 0
+        self._reset()
+
+    def _reset(self):
+        self.files = []
+        self.rows = 0
+
+    def add(self, parsed, checkpoint=None):
+        """Queue ``parsed``; ``checkpoint`` is where it was read from, if any."""
+        self.files.append((parsed, checkpoint))
+        self.rows += len(parsed.epochs)
+        if self.rows >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.files:
+            return
+        with transaction.atomic():
+            self.storage.write(self.files)
+            update_rollups(self.files, self.storage)
+            user_ids = [parsed.user_id for parsed, checkpoint in self.files]
+            for ids in chunks(user_ids):
+                ImportCheckpoint.objects.filter(user_id__in=ids).delete()
+            ImportCheckpoint.objects.bulk_create([
+                self._checkpoint(parsed, checkpoint) for parsed, checkpoint in self.files])
+            DataVersion.bump()
+        self.written += self.rows
+        self._reset()
+
+    def _checkpoint(self, parsed, previous):
+        last_datetime = from_epoch(parsed.epochs.max()) if len(parsed.epochs) else None
+        if previous is not None and previous.last_datetime is not None:
+            if last_datetime is None or last_datetime < previous.last_datetime:
+                last_datetime = previous.last_datetime
+        return ImportCheckpoint(
+            user_id=parsed.user_id,
+            offset=parsed.offset,
+            size=parsed.size,
+            mtime=parsed.mtime,
+            prefix_hash=parsed.prefix_hash,
+            last_datetime=last_datetime,
+        )
+
+
+class ImportResult(object):
+
+    def __init__(self):
+        self.users = 0
+        self.files = 0
+        self.unchanged = 0
+        self.cached = 0
+        self.rows = 0
+        self.skipped = []
+        self.seconds = 0.0
+        self.bytes = 0
+        self.quality = Counter()
+        self.filled = 0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def plan_tasks(paths, incremental):
+    """Decide where each file has to be read from.
+
+    Returns ``(tasks, checkpoints, unchanged)``. In incremental mode a file
+    whose size and mtime match its checkpoint is not opened at all, and a file
+    which only grew is read from the checkpoint offset. A file which shrank or
+    whose checkpoint no longer falls on a line boundary was rewritten, and is
+    read again from the start; so is a file whose ``PREFIX_WINDOW`` bytes
+    before the checkpoint offset changed, which ``read_consumption`` finds
+    from the ``prefix_hash`` of the checkpoint.
+    """
+    checkpoints = {}
+    if incremental:
+        checkpoints = {cp.user_id: cp for cp in ImportCheckpoint.objects.all()}
+
+    tasks = []
+    resumed = {}
+    unchanged = 0
+    for path in paths:
+        user_id = user_id_from_path(path)
+        checkpoint = checkpoints.get(user_id)
+        if checkpoint is not None:
+            stat = os.stat(path)
+            if stat.st_size == checkpoint.size and stat.st_mtime_ns == checkpoint.mtime:
+                unchanged += 1
+                continue
+            if stat.st_size >= checkpoint.offset and ends_line(path, checkpoint.offset):
+                previous = to_epoch(checkpoint.last_datetime) if checkpoint.last_datetime else None
+                tasks.append((path, checkpoint.offset, previous, checkpoint.prefix_hash))
+                resumed[user_id] = checkpoint
+                continue
+        tasks.append((path, 0, None, None))
+    return tasks, resumed, unchanged
+
+
+def run_import(data_dir, workers=1, batch_size=50000, incremental=False, use_cache=True, progress=None,
+               max_gap=0, report_dir=None):
+    """Import ``data_dir``; ``progress(done, total)`` is called after each file read.
+
+    The quality report of each file parsed is written to ``report_dir``, if
+    given, and added up in ``result.quality``; gaps of at most ``max_gap``
+    readings are filled.
+    """
+    result = ImportResult()
+    started = time.time()
+
+    known_users, changed_users = import_users(os.path.join(data_dir, 'user_data.csv'))
+    result.users = len(known_users)
+    if changed_users:
+        # Users moved to another area or tariff: their days have to be
+        # re-aggregated under the new group, and billed under the new tariff.
+        with transaction.atomic():
+            update_changed_groups(changed_users)
+            bill_users(changed_users)
+
+    paths = []
+    for path in consumption_paths(data_dir):
+        if user_id_from_path(path) in known_users:
+            paths.append(path)
+        else:
+            result.skipped.append(path)
+
+    tasks, resumed, result.unchanged = plan_tasks(paths, incremental)
+
+    cache = get_parse_cache() if use_cache else None
+    writer = ReadingWriter(batch_size)
+    for parsed in parse_files(tasks, workers, cache, max_gap):
+        # A file rewritten in place was read from the start, and replaces what was stored.
+        writer.add(parsed, resumed.get(parsed.user_id) if parsed.start else None)
+        result.files += 1
+        result.cached += parsed.cached
+        result.filled += parsed.filled
+        if parsed.report is not None:
+            result.quality.update(parsed.report.issues())
+            if report_dir:
+                write_report(report_dir, parsed.report)
+        if progress is not None:
+            progress(result.files, len(tasks))
+    writer.flush()
+    if cache is not None:
+        cache.evict()
+
+    result.rows = writer.written
+    result.seconds = time.time() - started
+    return result
+
+
+def _validate(path, report_dir):
+    report = validate_file(path, user_id_from_path(path), report_dir)
+    return report.rows, report.issues(), os.path.getsize(path)
+
+
+def run_validation(data_dir, workers=1, report_dir=None):
+    """Check every consumption file of ``data_dir`` without importing anything.
+
+    Files are read in blocks and only their reports are kept, written to
+    ``report_dir`` if given. Returns an ``ImportResult`` with the files,
+    rows, bytes and ``quality`` totals.
+    """
+    result = ImportResult()
+    started = time.time()
+    paths = consumption_paths(data_dir)
+    if workers <= 1:
+        checked = [_validate(path, report_dir) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            checked = list(executor.map(_validate, paths, [report_dir] * len(paths), chunksize=16))
+    for rows, issues, size in checked:
+        result.files += 1
+        result.rows += rows
+        result.bytes += size
+        result.quality.update(issues)
+    result.seconds = time.time() - started
+    return result
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""Background jobs: imports, rollup rebuilds and exports off the request path.
+
+Jobs are rows of ``Job``, so they survive restarts. ``submit`` adds a
+pending job, or returns the identical one already pending: a pending job
+holds its key in ``Job.pending_key``, which is unique, so two requests
+cannot both add it. A ``JobRunner``
+runs them in ``settings.CONSUMPTION_JOB_WORKERS`` threads of the process,
+started by the first request to the job views (or by ``manage.py
+runjobs`` in a process of its own). A thread claims the oldest pending job
+with a conditional ``UPDATE``, so two threads or processes never run the
+same job. A writing job (``Job.WRITING``) does not start while another
+one runs, in any process: the ``UPDATE`` claiming it only applies when no
+writing job is running. Exports run next to it.
+
+A job reports its progress through ``JobContext.progress``, which is also
+where cancellation takes effect: it raises ``JobCancelled`` once the job
+is cancelled. A rollup rebuild runs in one transaction, so it is rolled
+back entirely. An import keeps the batches already written, and the next
+incremental import resumes after them.
+
+Progress is kept in memory and saved to the database at most every
+``SAVE_INTERVAL`` seconds, and not while the job is in a transaction: in
+SQLite, the job's own connection would write within it, and another
+connection would wait for it to commit. A cancellation requested by
+another process is read as often; within a transaction, through a
+connection of its own, which sees what other processes committed.
+
+Jobs left running by a process which is gone are set back to pending when
+a runner starts, and whenever a runner finds a writing job running.
+"""
+from __future__ import unicode_literals
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from consumption import export as exports
+from consumption.charts import data_version
+from consumption.importer import run_import
+from consumption.models import Job, User
+from consumption.rollups import rebuild_rollups
+from consumption.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+SAVE_INTERVAL = 0.5
+POLL_INTERVAL = 5.0
+EXPORT_PARAMETERS = ('format', 'user', 'area', 'tariff', 'start', 'end', 'gzip')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _worker_name():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def _alive(worker):
+    """Whether the process ``host:pid`` may still be running."""
+    host, _, pid = worker.rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def clean_params(kind, params):
+    """The parameters of a ``kind`` job from ``params`` (a dict of strings or values).
+
+    Raises ``ValueError`` for an unknown kind or invalid parameters.
+    """
+    if kind == Job.IMPORT:
+        return {'incremental': params.get('incremental') in (True, '1', 'true')}
+    if kind == Job.REBUILD_ROLLUPS:
+        return {}
+    if kind == Job.EXPORT:
+        cleaned = {name: str(params[name]) for name in EXPORT_PARAMETERS if params.get(name)}
+        exports.parameters(cleaned)
+        return cleaned
+    raise ValueError('Unknown job kind.')
+
+
+def job_key(kind, params):
+    return hashlib.sha1(json.dumps([kind, params], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def submit(kind, params=None):
+    """``(job, created)``: a new pending job, or the identical job already pending.
+
+    Raises ``ValueError`` like ``clean_params``.
+    """
+    params = clean_params(kind, params or {})
+    key = job_key(kind, params)
+    while True:
+        try:
+            with transaction.atomic():
+                job = Job.objects.create(
+                    kind=kind, params=json.dumps(params, sort_keys=True), key=key, pending_key=key)
+        except IntegrityError:
+            job = Job.objects.filter(pending_key=key).first()
+            if job is not None:
+                return job, False
+            # It was claimed or cancelled in the meantime.
+            continue
+        transaction.on_commit(get_runner().wake)
+        return job, True
+
+
+def cancel(job):
+    """Cancel ``job``; returns ``False`` if it had already finished.
+
+    A pending job is cancelled at once, a running one at its next progress
+    report. A job running in this process is told without writing to the
+    database, which it may be holding the write lock of.
+    """
+    context = get_runner().context(job.id)
+    if context is not None:
+        context.cancelled.set()
+        return True
+    if Job.objects.filter(id=job.id, status=Job.PENDING).update(
+            status=Job.CANCELLED, pending_key=None, finished_at=timezone.now()):
+        return True
+    return bool(Job.objects.filter(id=job.id, status=Job.RUNNING).update(cancel_requested=True))
+
+
+def as_json(job):
+    """The state of ``job``, with the progress in memory if it runs in this process."""
+    context = get_runner().context(job.id) if job.status == Job.RUNNING else None
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'params': json.loads(job.params),
+        'status': job.status,
+        'progress': context.progress_value if context else job.progress,
+        'message': context.message if context else job.message,
+        'cancel_requested': job.cancel_requested or bool(context and context.cancelled.is_set()),
+        'result': json.loads(job.result) if job.result else None,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
+
+
+def export_path(job):
+    params = json.loads(job.params)
+    name = 'job-{}.{}'.format(job.id, params.get('format', 'csv'))
+    if params.get('gzip') in ('1', 'true'):
+        name += '.gz'
+    return os.path.join(settings.CONSUMPTION_EXPORT_DIR, name)
+
+
+def run_import_job(job, params, context):
+    result = run_import(
+        settings.DATA_DIR, incremental=params['incremental'], progress=context.progress,
+        report_dir=settings.CONSUMPTION_QUALITY_DIR)
+    return {
+        'users': result.users, 'files': result.files, 'unchanged': result.unchanged,
+        'rows': result.rows, 'skipped': len(result.skipped), 'seconds': result.seconds,
+        'quality': dict(result.quality),
+    }
+
+
+def run_rebuild_rollups_job(job, params, context):
+    rebuild_rollups(get_storage(), progress=context.progress)
+    return {'users': User.objects.count()}
+
+
+def run_export_job(job, params, context):
+    options = exports.parameters(params)
+    generate = exports.csv_chunks if options['format'] == 'csv' else exports.ndjson_chunks
+    path = export_path(job)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    opener = gzip.open if options['gzip'] else open
+    try:
+        with opener(path, 'wb') as f:
+            for chunk in generate(options['user_ids'], options['start'], options['end'], context.progress):
+                f.write(chunk.encode('utf-8'))
+    except Exception:
+        os.remove(path)
+        raise
+    return {'users': len(options['user_ids']), 'size': os.path.getsize(path)}
+
+
+FUNCTIONS = {
+    Job.IMPORT: run_import_job,
+    Job.REBUILD_ROLLUPS: run_rebuild_rollups_job,
+    Job.EXPORT: run_export_job,
+}
+
+
+def claim(job, data_version=''):
+    """Set the pending ``job`` running; returns ``False`` if it cannot be claimed.
+
+    It cannot when another thread or process claimed it first or, for a
+    writing job, while another writing job runs. Both are checked by the
+    statement setting it running, in which SQLite holds the write lock.
+    """
+    qn = connection.ops.quote_name
+    table = qn(Job._meta.db_table)
+    sql = 'UPDATE {0} SET {1} = %s, {2} = NULL, {3} = %s, {4} = %s, {5} = %s WHERE {6} = %s AND {1} = %s'
+    params = [
+        Job.RUNNING, connection.ops.adapt_datetimefield_value(timezone.now()), _worker_name(), data_version,
+        job.id, Job.PENDING,
+    ]
+    if job.kind in Job.WRITING:
+        sql += ' AND NOT EXISTS (SELECT 1 FROM {0} WHERE {1} = %s AND {7} IN ({8}))'
+        params += [Job.RUNNING] + list(Job.WRITING)
+    columns = (qn(Job._meta.get_field(name).column)
+               for name in ('status', 'pending_key', 'started_at', 'worker', 'data_version', 'id', 'kind'))
+    sql = sql.format(table, *columns, ', '.join(['%s'] * len(Job.WRITING)))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount == 1
+
+
+def writing_job_runs():
+    """Whether a writing job runs, once the jobs of processes which are gone are set back to pending."""
+    if not Job.objects.filter(status=Job.RUNNING, kind__in=Job.WRITING).exists():
+        return False
+    requeue_interrupted()
+    return Job.objects.filter(status=Job.RUNNING, kind__in=Job.WRITING).exists()
+
+
+class JobContext(object):
+    """Progress and cancellation of a running job."""
+
+    def __init__(self, job):
+        self.job_id = job.id
+        self.progress_value = 0.0
+        self.message = ''
+        self.cancelled = threading.Event()
+        self._saved = time.monotonic()
+        self._connection = None
+
+    def progress(self, done, total, message=''):
+        """Record that ``done`` of ``total`` steps are done; raises ``JobCancelled`` once cancelled."""
+        self.progress_value = done / total if total else 1.0
+        self.message = message
+        if time.monotonic() - self._saved >= SAVE_INTERVAL:
+            self._saved = time.monotonic()
+            if not connection.in_atomic_block:
+                Job.objects.filter(id=self.job_id).update(progress=self.progress_value, message=message)
+            if self._cancel_requested():
+                self.cancelled.set()
+        if self.cancelled.is_set():
+            raise JobCancelled
+
+    def _cancel_requested(self):
+        if not connection.in_atomic_block:
+            return Job.objects.filter(id=self.job_id, cancel_requested=True).exists()
+        if self._connection is None:
+            self._connection = connection.copy()
+        qn = connection.ops.quote_name
+        try:
+            with self._connection.cursor() as cursor:
+                cursor.execute('SELECT 1 FROM {} WHERE {} = %s AND {} = %s'.format(
+                    qn(Job._meta.db_table), qn('id'), qn('cancel_requested')), [self.job_id, True])
+                return cursor.fetchone() is not None
+        except DatabaseError:
+            # Locked by a writer past the timeout: read it again at the next report.
+            return False
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+
+
+class JobRunner(object):
+    """Runs pending jobs in a pool of threads."""
+
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._claim_lock = threading.Lock()
+        self._threads = []
+        self._contexts = {}
+
+    def start(self):
+        """Start ``settings.CONSUMPTION_JOB_WORKERS`` threads, unless they run already."""
+        with self._lock:
+            if self._threads or not settings.CONSUMPTION_JOB_WORKERS:
+                return
+            requeue_interrupted()
+            for number in range(settings.CONSUMPTION_JOB_WORKERS):
+                thread = threading.Thread(target=self._work, name='consumption-job-{}'.format(number))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def wake(self):
+        self._wake.set()
+
+    def context(self, job_id):
+        """The ``JobContext`` of ``job_id`` if it runs in this process."""
+        return self._contexts.get(job_id)
+
+    def _work(self):
+        while True:
+            self._wake.clear()
+            try:
+                ran = self.run_next()
+            except Exception:
+                logger.exception('Job runner failed')
+                ran = False
+            finally:
+                connections.close_all()
+            if not ran:
+                self._wake.wait(self.poll_interval)
+
+    def _claim(self):
+        """The next pending job, now running, or ``None``."""
+        with self._claim_lock:
+            while True:
+                pending = Job.objects.filter(status=Job.PENDING).order_by('id')
+                if writing_job_runs():
+                    pending = pending.exclude(kind__in=Job.WRITING)
+                job = pending.first()
+                if job is None:
+                    return None
+                if claim(job, data_version() if job.kind in Job.WRITING else ''):
+                    return Job.objects.get(id=job.id)
+
+    def run_next(self):
+        """Run the next pending job in this thread; returns ``False`` if there was none."""
+        job = self._claim()
+        if job is None:
+            return False
+        context = self._contexts[job.id] = JobContext(job)
+        fields = {}
+        try:
+            result = FUNCTIONS[job.kind](job, json.loads(job.params), context)
+            fields.update(status=Job.DONE, progress=1.0, result=json.dumps(result))
+        except JobCancelled:
+            fields.update(status=Job.CANCELLED, progress=context.progress_value)
+        except Exception as e:
+            logger.exception('Job %s failed', job.id)
+            fields.update(status=Job.FAILED, progress=context.progress_value, message='{}: {}'.format(
+                type(e).__name__, e))
+        finally:
+            del self._contexts[job.id]
+            context.close()
+        Job.objects.filter(id=job.id).update(finished_at=timezone.now(), **fields)
+        return True
+
+    def run_pending(self):
+        """Run the pending jobs in this thread, one after the other; returns how many ran."""
+        count = 0
+        while self.run_next():
+            count += 1
+        return count
+
+
+def requeue_interrupted():
+    """Set the jobs left running by a process which is gone back to pending.
+
+    A job identical to one pending already is cancelled instead.
+    """
+    for job in Job.objects.filter(status=Job.RUNNING):
+        if _alive(job.worker):
+            continue
+        interrupted = Job.objects.filter(id=job.id, status=Job.RUNNING)
+        try:
+            with transaction.atomic():
+                interrupted.update(
+                    status=Job.PENDING, pending_key=F('key'), progress=0.0, message='', started_at=None,
+                    worker='', data_version='')
+        except IntegrityError:
+            interrupted.update(
+                status=Job.CANCELLED, message='An identical job is pending.', finished_at=timezone.now())
+
+
+_runner = JobRunner()
+
+
+def get_runner():
+    return _runner
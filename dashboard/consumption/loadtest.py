@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Read latency of the pages while ``manage.py import`` writes to the database.
+
+``run`` sends requests from ``readers`` threads for ``baseline`` seconds,
+then starts the import in another process, as it would run in production,
+and keeps sending requests until the import exits. Each thread has its own
+database connection, like the threads of a server. Requests failing with
+an error (e.g. ``database is locked``) count in the latencies, with the
+time they took to fail, and are listed in ``errors``.
+"""
+from __future__ import unicode_literals
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.test import Client
+
+from common.benchmark import percentile
+
+
+def _latencies(seconds):
+    seconds = sorted(seconds)
+    if not seconds:
+        return {'count': 0, 'p50': None, 'p90': None, 'p99': None, 'max': None}
+    return {
+        'count': len(seconds),
+        'p50': percentile(seconds, 0.5) * 1000,
+        'p90': percentile(seconds, 0.9) * 1000,
+        'p99': percentile(seconds, 0.99) * 1000,
+        'max': seconds[-1] * 1000,
+    }
+
+
+def _read(paths, until, seconds, errors):
+    client = Client(HTTP_HOST='localhost')
+    try:
+        while not until():
+            for path in paths:
+                started = time.perf_counter()
+                try:
+                    response = client.get(path)
+                    if response.status_code != 200:
+                        raise AssertionError('{} returned {}'.format(path, response.status_code))
+                except Exception as e:
+                    errors.append('{}: {}'.format(type(e).__name__, e))
+                seconds.append(time.perf_counter() - started)
+    finally:
+        connections.close_all()
+
+
+def _readers(paths, readers, until):
+    seconds, errors = [], []
+    threads = [threading.Thread(target=_read, args=(paths, until, seconds, errors)) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    return threads, seconds, errors
+
+
+def run(paths, readers=4, baseline=5.0, import_args=()):
+    """Latencies of ``paths`` before and during ``manage.py import *import_args``.
+
+    Returns ``{'baseline': ..., 'during_import': ..., 'errors': [...],
+    'import_seconds': ..., 'import_returncode': ...}``.
+    """
+    stop = time.perf_counter() + baseline
+    threads, seconds, errors = _readers(paths, readers, lambda: time.perf_counter() >= stop)
+    for thread in threads:
+        thread.join()
+    result = {'baseline': _latencies(seconds)}
+    errors = list(errors)
+
+    started = time.perf_counter()
+    command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'import'] + list(import_args)
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    threads, seconds, import_errors = _readers(paths, readers, lambda: process.poll() is not None)
+    process.wait()
+    result['import_seconds'] = time.perf_counter() - started
+    result['import_returncode'] = process.returncode
+    for thread in threads:
+        thread.join()
+    result['during_import'] = _latencies(seconds)
+    result['errors'] = errors + import_errors
+    return result
@@ -0,0 +1,24 @@
+from common.benchmark import BenchmarkCommand
+from consumption import benchmark
+
+
+class Command(BenchmarkCommand):
+    help = 'benchmark the import and the views on generated datasets'
+    project = 'dashboard'
+    default_sizes = benchmark.SIZES
+    sizes_help = 'Comma separated numbers of users of the generated datasets.'
+    run_options = ('days', 'repeat', 'workers')
+
+    def add_run_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='Number of days of readings per user.')
+        parser.add_argument(
+            '--repeat', type=int, default=10,
+            help='Number of requests per view (imports run a fifth as often).')
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Number of processes parsing CSV files during the import.')
+
+    def run(self, sizes, seed, log, **options):
+        return benchmark.run(sizes, seed=seed, log=log, **options)
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from consumption.billing import bill_users
+from consumption.models import MonthlyStatistics
+
+
+class Command(BaseCommand):
+    help = 'Price the monthly bills of every user from the stored readings, e.g. after a tariff change.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tariff', action='append', dest='tariffs',
+            help='Only bill the users of this tariff (repeatable).')
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Number of users priced at a time.')
+
+    def handle(self, *args, **options):
+        started = time.time()
+        with transaction.atomic():
+            unpriced = bill_users(tariffs=options['tariffs'], chunk_size=options['chunk_size'])
+        billed = MonthlyStatistics.objects.all()
+        if options['tariffs']:
+            billed = billed.filter(user__tariff__in=options['tariffs'])
+        count = billed.count()
+        self.stdout.write(self.style.SUCCESS('Billed {} user months in {:.2f}s'.format(count, time.time() - started)))
+        if unpriced:
+            self.stderr.write('{} users have a tariff which is not in CONSUMPTION_TARIFFS.'.format(len(unpriced)))
@@ -0,0 +1,60 @@
+import os
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from consumption.dataset import generate
+
+
+class Command(BaseCommand):
+    help = 'write synthetic user_data.csv and consumption/<user_id>.csv files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--data-dir', default=settings.SYNTHETIC_DATA_DIR,
+            help='Directory to write user_data.csv and consumption/<user_id>.csv to.')
+        parser.add_argument(
+            '--users', type=int, default=60,
+            help='Number of users.')
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='Number of days of half-hourly readings per user.')
+        parser.add_argument(
+            '--start', default='2016-01-01',
+            help='Date of the first reading (YYYY-MM-DD).')
+        parser.add_argument(
+            '--first-id', type=int, default=3000,
+            help='Id of the first user.')
+        parser.add_argument(
+            '--seed', type=int, default=None,
+            help='Seed of the random generator, for reproducible files.')
+        parser.add_argument(
+            '--yes', action='store_true',
+            help='Overwrite existing files without asking.')
+
+    def handle(self, *args, **options):
+        try:
+            start = datetime.strptime(options['start'], '%Y-%m-%d')
+        except ValueError:
+            raise CommandError('--start must be a YYYY-MM-DD date.')
+
+        data_dir = options['data_dir']
+        if os.path.exists(os.path.join(data_dir, 'user_data.csv')) and not options['yes']:
+            check = input('{} already contains a dataset, type "yes" to overwrite it: '.format(data_dir))
+            if check != 'yes':
+                return
+
+        result = generate(
+            data_dir,
+            users=options['users'],
+            days=options['days'],
+            start=start,
+            first_id=options['first_id'],
+            seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            'Wrote {} readings of {} users ({:.1f} MB) in {:.2f}s ({:.0f} rows/s)'.format(
+                result.rows, result.users, result.bytes / 1e6, result.seconds,
+                result.rows / max(result.seconds, 1e-6))))
+        self.stdout.write('Import it with: manage.py import --data-dir {}'.format(data_dir))
@@ -1,8 +1,88 @@
+import os
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
+from consumption.importer import run_import, run_validation
+from consumption.rollups import rebuild_rollups
+from consumption.storage import get_storage
+
 
 class Command(BaseCommand):
     help = 'import data'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--data-dir', default=settings.DATA_DIR,
+            help='Directory containing user_data.csv and consumption/<user_id>.csv.')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Number of processes parsing CSV files (1 parses in-process).')
+        parser.add_argument(
+            '--batch-size', type=int, default=50000,
+            help='Number of readings written per transaction.')
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='Only read what was appended to consumption files since the last import.')
+        parser.add_argument(
+            '--no-cache', action='store_false', dest='use_cache',
+            help='Parse every file, without reading or filling the parse cache.')
+        parser.add_argument(
+            '--fill-gaps', type=int, default=0, dest='max_gap', metavar='N',
+            help='Fill gaps of at most N missing readings by linear interpolation.')
+        parser.add_argument(
+            '--report-dir', default=settings.CONSUMPTION_QUALITY_DIR,
+            help='Directory the quality report of each file is written to (empty: none).')
+        parser.add_argument(
+            '--validate-only', action='store_true',
+            help='Do not import; check every consumption file and write the quality reports.')
+        parser.add_argument(
+            '--rebuild-rollups', action='store_true',
+            help='Do not import; recompute all rollups from the stored readings.')
+
     def handle(self, *args, **options):
-        print("Implement me!")
+        if options['rebuild_rollups']:
+            rebuild_rollups(get_storage())
+            self.stdout.write(self.style.SUCCESS('Rollups rebuilt.'))
+            return
+
+        if options['validate_only']:
+            result = run_validation(options['data_dir'], options['workers'], options['report_dir'])
+            self.stdout.write(self.style.SUCCESS(
+                'Validated {} rows from {} files in {:.2f}s ({:.0f} rows/s, {:.1f} MB/s)'.format(
+                    result.rows, result.files, result.seconds, result.rows_per_second,
+                    result.bytes / 1e6 / result.seconds if result.seconds else 0.0)))
+            self.write_quality(result)
+            return
+
+        result = run_import(
+            options['data_dir'],
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            incremental=options['incremental'],
+            use_cache=options['use_cache'],
+            max_gap=options['max_gap'],
+            report_dir=options['report_dir'],
+        )
+        for path in result.skipped:
+            self.stderr.write('Skipped {}: user is not in user_data.csv'.format(path))
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {} users and {} readings from {} files in {:.2f}s ({:.0f} rows/s)'.format(
+                result.users, result.rows, result.files, result.seconds, result.rows_per_second)))
+        if result.unchanged:
+            self.stdout.write('{} unchanged files were not read.'.format(result.unchanged))
+        if result.cached:
+            self.stdout.write('{} files read from the parse cache.'.format(result.cached))
+        self.write_quality(result)
+        if result.filled:
+            self.stdout.write('{} missing readings filled.'.format(result.filled))
+
+    def write_quality(self, result):
+        quality = result.quality
+        if not any(quality.values()):
+            return
+        self.stdout.write(
+            'Quality: {gaps} gaps ({missing} missing readings), {duplicates} duplicates, '
+            '{out_of_order} out of order, {unaligned} unaligned, {bad_rows} bad rows'.format(
+                **{name: quality[name] for name in (
+                    'gaps', 'missing', 'duplicates', 'out_of_order', 'unaligned', 'bad_rows')}))
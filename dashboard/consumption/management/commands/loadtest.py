@@ -0,0 +1,51 @@
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from consumption import loadtest
+from consumption.models import User
+
+
+class Command(BaseCommand):
+    help = 'measure the latency of the pages while manage.py import writes to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--readers', type=int, default=4,
+            help='Number of threads sending requests.')
+        parser.add_argument(
+            '--baseline', type=float, default=5.0,
+            help='Seconds of requests before the import starts.')
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help='Path to request (repeatable; default: the summary and the first detail page).')
+        parser.add_argument(
+            'import_args', nargs='*',
+            help='Arguments of the import command, after --, e.g. -- --no-cache.')
+
+    def handle(self, *args, **options):
+        paths = options['paths']
+        if not paths:
+            user_id = User.objects.order_by('id').values_list('id', flat=True).first()
+            paths = ['/summary/', '/detail/{}/'.format(user_id)]
+
+        result = loadtest.run(paths, options['readers'], options['baseline'], options['import_args'])
+
+        mode = 'production' if settings.DATABASES['default'].get('PRAGMAS') else 'default'
+        if settings.SQLITE_READ_ALIAS in settings.DATABASES:
+            mode += ', read-only alias'
+        self.stdout.write('SQLite {} mode; {} readers requesting {}'.format(
+            mode, options['readers'], ', '.join(paths)))
+        for name in ('baseline', 'during_import'):
+            latencies = result[name]
+            if not latencies['count']:
+                self.stdout.write('{:<14} no request'.format(name))
+                continue
+            self.stdout.write(
+                '{:<14} {count:>6} requests  p50 {p50:>8.1f} ms  p90 {p90:>8.1f} ms  '
+                'p99 {p99:>8.1f} ms  max {max:>8.1f} ms'.format(name, **latencies))
+        self.stdout.write('Import took {:.2f}s (exit status {}).'.format(
+            result['import_seconds'], result['import_returncode']))
+        for error, count in Counter(result['errors']).most_common():
+            self.stderr.write('{} x {}'.format(count, error))
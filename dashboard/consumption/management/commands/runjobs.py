@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from consumption import jobs
+
+
+class Command(BaseCommand):
+    help = 'run the pending background jobs, see consumption/jobs.py'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit when no job is pending instead of waiting for more.')
+
+    def handle(self, *args, **options):
+        jobs.requeue_interrupted()
+        runner = jobs.get_runner()
+        while True:
+            count = runner.run_pending()
+            if count:
+                self.stdout.write('Ran {} jobs.'.format(count))
+            if options['once']:
+                return
+            time.sleep(jobs.POLL_INTERVAL)
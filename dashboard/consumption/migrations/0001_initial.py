@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 20:44
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Consumption',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime', models.DateTimeField()),
+                ('consumption', models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='User',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('area', models.CharField(max_length=30)),
+                ('tariff', models.CharField(max_length=30)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='consumption',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumptions', to='consumption.User'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='consumption',
+            unique_together=set([('user', 'datetime')]),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 20:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='checkpoint', serialize=False, to='consumption.User')),
+                ('offset', models.BigIntegerField()),
+                ('size', models.BigIntegerField()),
+                ('mtime', models.BigIntegerField(help_text='st_mtime_ns of the file when it was read.')),
+                ('last_datetime', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 20:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0003_series'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('month', 'Month')], max_length=10)),
+                ('start', models.DateField()),
+                ('area', models.CharField(max_length=30)),
+                ('tariff', models.CharField(max_length=30)),
+                ('users', models.IntegerField(help_text='Number of users with at least one reading.')),
+                ('total', models.FloatField()),
+                ('count', models.IntegerField()),
+                ('min', models.FloatField()),
+                ('max', models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserDayRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('total', models.FloatField()),
+                ('count', models.IntegerField()),
+                ('min', models.FloatField()),
+                ('max', models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserRollup',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rollup', serialize=False, to='consumption.User')),
+                ('total', models.FloatField()),
+                ('count', models.IntegerField()),
+                ('min', models.FloatField()),
+                ('max', models.FloatField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='userdayrollup',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='day_rollups', to='consumption.User'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='rollup',
+            unique_together=set([('period', 'start', 'area', 'tariff')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='userdayrollup',
+            unique_together=set([('user', 'day')]),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 21:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0005_checkpoint_imported_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupProfile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('area', models.CharField(max_length=30)),
+                ('tariff', models.CharField(max_length=30)),
+                ('users', models.IntegerField(help_text='Number of users with at least one reading.')),
+                ('values', models.BinaryField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserProfile',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='profile', serialize=False, to='consumption.User')),
+                ('values', models.BinaryField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='groupprofile',
+            unique_together=set([('area', 'tariff')]),
+        ),
+    ]
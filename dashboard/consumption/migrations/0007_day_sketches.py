@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 21:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0006_profiles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userdayrollup',
+            name='sketch',
+            field=models.BinaryField(default=b'', help_text='Quantile sketch, see consumption.sketches.'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 21:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0007_day_sketches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyStatistics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month.')),
+                ('consumption', models.FloatField(help_text='kWh')),
+                ('total_bill', models.FloatField()),
+                ('total_cost', models.FloatField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_statistics', to='consumption.User')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlystatistics',
+            unique_together=set([('user', 'month')]),
+        ),
+    ]
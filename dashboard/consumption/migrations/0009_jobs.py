@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 22:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0008_monthly_statistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('import', 'Import'), ('rebuild_rollups', 'Rebuild rollups'), ('export', 'Export')], max_length=30)),
+                ('params', models.TextField(default='{}', help_text='JSON.')),
+                ('key', models.CharField(db_index=True, help_text='SHA-1 of the kind and parameters.', max_length=40)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], db_index=True, default='pending', max_length=10)),
+                ('progress', models.FloatField(default=0.0, help_text='From 0 to 1.')),
+                ('message', models.TextField(blank=True, default='')),
+                ('cancel_requested', models.BooleanField(default=False)),
+                ('result', models.TextField(blank=True, default='', help_text='JSON.')),
+                ('worker', models.CharField(blank=True, default='', help_text='host:pid running the job.', max_length=100)),
+                ('data_version', models.CharField(blank=True, default='', help_text='consumption.charts.data_version() when a writing job started.', max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
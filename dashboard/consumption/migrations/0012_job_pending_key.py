@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 23:33
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def set_pending_keys(apps, schema_editor):
+    Job = apps.get_model('consumption', 'Job')
+    for job in Job.objects.filter(status='pending').order_by('-id'):
+        # The oldest of identical pending jobs keeps the key.
+        Job.objects.filter(pending_key=job.key).update(pending_key=None)
+        Job.objects.filter(id=job.id).update(pending_key=job.key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0011_checkpoint_prefix_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='pending_key',
+            field=models.CharField(help_text='key while the job is pending: one pending job per key.', max_length=40, null=True, unique=True),
+        ),
+        migrations.RunPython(set_pending_keys, migrations.RunPython.noop),
+    ]
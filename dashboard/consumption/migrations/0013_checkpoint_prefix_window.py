@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.21 on 2026-10-18 23:51
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0012_job_pending_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='importcheckpoint',
+            name='prefix_hash',
+            field=models.CharField(blank=True, default='', help_text='BLAKE2b of the PREFIX_WINDOW bytes of the file before offset.', max_length=40),
+        ),
+    ]
@@ -2,5 +2,189 @@
 from __future__ import unicode_literals
 
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 
-# Create your models here.
+
+class User(models.Model):
+    id = models.IntegerField(primary_key=True)
+    area = models.CharField(max_length=30)
+    tariff = models.CharField(max_length=30)
+
+    def __str__(self):
+        return str(self.id)
+
+
+class Consumption(models.Model):
+    user = models.ForeignKey('User', on_delete=models.CASCADE, related_name='consumptions')
+    datetime = models.DateTimeField()
+    consumption = models.FloatField()
+
+    class Meta:
+        unique_together = ('user', 'datetime')
+
+
+class ImportCheckpoint(models.Model):
+    """How far ``manage.py import`` has read a user's consumption file."""
+    user = models.OneToOneField('User', on_delete=models.CASCADE, primary_key=True, related_name='checkpoint')
+    offset = models.BigIntegerField()
+    size = models.BigIntegerField()
+    mtime = models.BigIntegerField(help_text='st_mtime_ns of the file when it was read.')
+    prefix_hash = models.CharField(
+        max_length=40, blank=True, default='',
+        help_text='BLAKE2b of the PREFIX_WINDOW bytes of the file before offset.')
+    last_datetime = models.DateTimeField(blank=True, null=True)
+    imported_at = models.DateTimeField(auto_now=True)
+
+
+class Series(models.Model):
+    """A user's readings as one float32 array, see ``consumption.series``."""
+    user = models.OneToOneField('User', on_delete=models.CASCADE, primary_key=True, related_name='series')
+    start = models.DateTimeField()
+    values = models.BinaryField()
+
+
+class UserDayRollup(models.Model):
+    """Statistics of one user's readings on one (UTC) day."""
+    user = models.ForeignKey('User', on_delete=models.CASCADE, related_name='day_rollups')
+    day = models.DateField()
+    total = models.FloatField()
+    count = models.IntegerField()
+    min = models.FloatField()
+    max = models.FloatField()
+    sketch = models.BinaryField(default=b'', help_text='Quantile sketch, see consumption.sketches.')
+
+    class Meta:
+        unique_together = ('user', 'day')
+
+
+class UserRollup(models.Model):
+    """Statistics of all readings of one user."""
+    user = models.OneToOneField('User', on_delete=models.CASCADE, primary_key=True, related_name='rollup')
+    total = models.FloatField()
+    count = models.IntegerField()
+    min = models.FloatField()
+    max = models.FloatField()
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class Rollup(models.Model):
+    """Statistics of the readings of all users of an area and tariff over a day or a month."""
+    DAY = 'day'
+    MONTH = 'month'
+    PERIODS = (
+        (DAY, 'Day'),
+        (MONTH, 'Month'),
+    )
+
+    period = models.CharField(max_length=10, choices=PERIODS)
+    start = models.DateField()
+    area = models.CharField(max_length=30)
+    tariff = models.CharField(max_length=30)
+    users = models.IntegerField(help_text='Number of users with at least one reading.')
+    total = models.FloatField()
+    count = models.IntegerField()
+    min = models.FloatField()
+    max = models.FloatField()
+
+    class Meta:
+        unique_together = ('period', 'start', 'area', 'tariff')
+
+
+class UserProfile(models.Model):
+    """Load profile of one user's readings, see ``consumption.profiles``."""
+    user = models.OneToOneField('User', on_delete=models.CASCADE, primary_key=True, related_name='profile')
+    values = models.BinaryField()
+
+
+class GroupProfile(models.Model):
+    """Load profile of all users of an area and tariff, see ``consumption.profiles``."""
+    area = models.CharField(max_length=30)
+    tariff = models.CharField(max_length=30)
+    users = models.IntegerField(help_text='Number of users with at least one reading.')
+    values = models.BinaryField()
+
+    class Meta:
+        unique_together = ('area', 'tariff')
+
+
+class MonthlyStatistics(models.Model):
+    """Consumption and bill of one user over one month, see ``consumption.billing``."""
+    user = models.ForeignKey('User', on_delete=models.CASCADE, related_name='monthly_statistics')
+    month = models.DateField(help_text='First day of the month.')
+    consumption = models.FloatField(help_text='kWh')
+    total_bill = models.FloatField()
+    total_cost = models.FloatField()
+
+    class Meta:
+        unique_together = ('user', 'month')
+
+    @property
+    def margin(self):
+        return self.total_bill - self.total_cost
+
+
+class DataVersion(models.Model):
+    """The version of the stored data, see ``consumption.charts``: one row, bumped by every write."""
+    version = models.BigIntegerField(default=0)
+    changed_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def bump(cls):
+        """Bump the version; in the transaction of a write, it changes when the write commits."""
+        if not cls.objects.filter(pk=1).update(version=F('version') + 1, changed_at=timezone.now()):
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+
+    @classmethod
+    def current(cls):
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+
+class Job(models.Model):
+    """A background job run by ``consumption.jobs``."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    )
+    FINISHED = (DONE, FAILED, CANCELLED)
+
+    IMPORT = 'import'
+    REBUILD_ROLLUPS = 'rebuild_rollups'
+    EXPORT = 'export'
+    KINDS = (
+        (IMPORT, 'Import'),
+        (REBUILD_ROLLUPS, 'Rebuild rollups'),
+        (EXPORT, 'Export'),
+    )
+    # Kinds writing readings or rollups: one runs at a time, and the pages
+    # serve the data as it was before it started.
+    WRITING = (IMPORT, REBUILD_ROLLUPS)
+
+    kind = models.CharField(max_length=30, choices=KINDS)
+    params = models.TextField(default='{}', help_text='JSON.')
+    key = models.CharField(max_length=40, db_index=True, help_text='SHA-1 of the kind and parameters.')
+    pending_key = models.CharField(
+        max_length=40, null=True, unique=True, help_text='key while the job is pending: one pending job per key.')
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING, db_index=True)
+    progress = models.FloatField(default=0.0, help_text='From 0 to 1.')
+    message = models.TextField(blank=True, default='')
+    cancel_requested = models.BooleanField(default=False)
+    result = models.TextField(blank=True, default='', help_text='JSON.')
+    worker = models.CharField(max_length=100, blank=True, default='', help_text='host:pid running the job.')
+    data_version = models.CharField(
+        max_length=100, blank=True, default='',
+        help_text='consumption.charts.data_version() when a writing job started.')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
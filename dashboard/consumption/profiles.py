@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""Load profiles: the typical day of a user or of an area and tariff.
+
+A ``LoadProfile`` holds the sum and the number of readings for each half-hour
+slot of the day, by day of the week (48 x 7) and by month of the year
+(48 x 12), in UTC. Sums and counts add up, so the profile of an area and
+tariff is the sum of the profiles of its users and is kept current by adding
+the difference made by an import to the users it touched. An import which
+only appends readings adds the profile of the new readings alone; the
+series stored is read only for users whose readings were replaced. Reading
+a profile is one row and one small array, whatever the amount of history.
+"""
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+import numpy as np
+
+from consumption.models import GroupProfile, User, UserProfile
+from consumption.series import DAY, INTERVAL, TimeSeries, to_epoch
+from consumption.utils import chunks
+
+SLOTS = DAY // INTERVAL
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+# The epoch is a Thursday.
+EPOCH_WEEKDAY = 3
+
+_SHAPE = (4, SLOTS, max(len(WEEKDAYS), len(MONTHS)))
+
+
+class LoadProfile(object):
+    """Sums and counts of readings per slot, by weekday and by month.
+
+    The four arrays are float64: ``weekday_total`` and ``weekday_count`` are
+    48 x 7 (Monday first), ``month_total`` and ``month_count`` 48 x 12.
+    """
+
+    def __init__(self, weekday_total, weekday_count, month_total, month_count):
+        self.weekday_total = weekday_total
+        self.weekday_count = weekday_count
+        self.month_total = month_total
+        self.month_count = month_count
+
+    @classmethod
+    def empty(cls):
+        return cls.from_array(np.zeros(_SHAPE))
+
+    @classmethod
+    def from_series(cls, series):
+        mask = series.mask
+        epochs = series.timestamps()[mask]
+        values = series.values[mask].astype(np.float64)
+        slots = epochs % DAY // INTERVAL
+        weekdays = (epochs // DAY + EPOCH_WEEKDAY) % 7
+        months = epochs.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64) % 12
+
+        def matrix(columns, width, weights=None):
+            counts = np.bincount(slots * width + columns, weights=weights, minlength=SLOTS * width)
+            return counts.astype(np.float64).reshape(SLOTS, width)
+
+        return cls(
+            matrix(weekdays, len(WEEKDAYS), values), matrix(weekdays, len(WEEKDAYS)),
+            matrix(months, len(MONTHS), values), matrix(months, len(MONTHS)))
+
+    @classmethod
+    def from_array(cls, array):
+        weekdays, months = len(WEEKDAYS), len(MONTHS)
+        return cls(array[0, :, :weekdays], array[1, :, :weekdays], array[2, :, :months], array[3, :, :months])
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls.from_array(np.frombuffer(data, dtype=np.float64).reshape(_SHAPE))
+
+    def to_array(self):
+        array = np.zeros(_SHAPE)
+        weekdays, months = len(WEEKDAYS), len(MONTHS)
+        array[0, :, :weekdays] = self.weekday_total
+        array[1, :, :weekdays] = self.weekday_count
+        array[2, :, :months] = self.month_total
+        array[3, :, :months] = self.month_count
+        return array
+
+    def to_bytes(self):
+        return self.to_array().tobytes()
+
+    def __add__(self, other):
+        return LoadProfile.from_array(self.to_array() + other.to_array())
+
+    def __sub__(self, other):
+        return LoadProfile.from_array(self.to_array() - other.to_array())
+
+    @property
+    def count(self):
+        return int(round(self.weekday_count.sum()))
+
+    @staticmethod
+    def _mean(total, count):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / np.where(count > 0, count, 1), np.nan)
+
+    @property
+    def weekday_mean(self):
+        """Mean reading per slot (rows) and weekday (columns), NaN without readings."""
+        return self._mean(self.weekday_total, self.weekday_count)
+
+    @property
+    def month_mean(self):
+        """Mean reading per slot (rows) and month (columns), NaN without readings."""
+        return self._mean(self.month_total, self.month_count)
+
+    def daily_means(self):
+        """``(weekday, mean consumption of such a day)`` pairs, ``None`` without readings."""
+        days = np.nansum(self.weekday_mean, axis=0)
+        seen = self.weekday_count.sum(axis=0) > 0
+        return [(name, float(day) if has_readings else None)
+                for name, day, has_readings in zip(WEEKDAYS, days, seen)]
+
+    def as_json(self):
+        def columns(means, names):
+            return {
+                name: [None if np.isnan(value) else value for value in means[:, column].tolist()]
+                for column, name in enumerate(names)
+            }
+        return {
+            'slots': ['{:02d}:{:02d}'.format(*divmod(slot * INTERVAL // 60, 60)) for slot in range(SLOTS)],
+            'weekday': columns(self.weekday_mean, WEEKDAYS),
+            'month': columns(self.month_mean, MONTHS),
+            'count': self.count,
+        }
+
+
+def user_profile(user_id):
+    try:
+        return LoadProfile.from_bytes(UserProfile.objects.get(user_id=user_id).values)
+    except UserProfile.DoesNotExist:
+        return None
+
+
+def group_profile(area=None, tariff=None):
+    """Profile of the users of ``area`` and ``tariff`` (``None`` matches any), and their number."""
+    groups = GroupProfile.objects.all()
+    if area is not None:
+        groups = groups.filter(area=area)
+    if tariff is not None:
+        groups = groups.filter(tariff=tariff)
+    profile, users = LoadProfile.empty(), 0
+    for group in groups:
+        profile, users = profile + LoadProfile.from_bytes(group.values), users + group.users
+    return profile, users
+
+
+def _groups(user_ids):
+    groups = {}
+    for ids in chunks(user_ids):
+        groups.update((user.id, (user.area, user.tariff)) for user in User.objects.filter(id__in=ids))
+    return groups
+
+
+def appended_readings(files):
+    """``{user_id: TimeSeries}`` of the new readings of ``(ParsedFile, checkpoint)`` pairs.
+
+    Only users whose new readings all come after those stored are included:
+    the readings of the others replaced stored ones, which are gone by now.
+    """
+    appended, seen = {}, set()
+    for parsed, checkpoint in files:
+        if parsed.user_id in seen:
+            appended.pop(parsed.user_id, None)
+            continue
+        seen.add(parsed.user_id)
+        if checkpoint is None or not len(parsed.epochs):
+            continue
+        last = checkpoint.last_datetime
+        if last is None or parsed.epochs.min() > to_epoch(last):
+            appended[parsed.user_id] = TimeSeries.from_readings(parsed.epochs, parsed.values)
+    return appended
+
+
+def update_profiles(user_ids, storage, appended=None):
+    """Bring the profiles of ``user_ids`` up to date and add the difference to their groups'.
+
+    ``appended`` is ``appended_readings()`` of the files imported: these
+    users get the profile of their new readings added to the stored one,
+    the others have theirs computed again from their whole series.
+    """
+    appended = appended or {}
+    groups = _groups(user_ids)
+    previous = {}
+    for ids in chunks(user_ids):
+        previous.update(
+            (profile.user_id, LoadProfile.from_bytes(profile.values))
+            for profile in UserProfile.objects.filter(user_id__in=ids))
+        UserProfile.objects.filter(user_id__in=ids).delete()
+
+    deltas = defaultdict(lambda: [LoadProfile.empty(), 0])
+    profiles = []
+    for user_id, series in appended.items():
+        if user_id not in groups:
+            continue
+        added = LoadProfile.from_series(series)
+        before = previous.pop(user_id, None)
+        profile = added if before is None else before + added
+        profiles.append(UserProfile(user_id=user_id, values=profile.to_bytes()))
+        delta = deltas[groups[user_id]]
+        delta[0] += added
+        delta[1] += before is None
+    recomputed = [user_id for user_id in user_ids if user_id not in appended]
+    for user_id, series in storage.all_series(recomputed).items():
+        if not len(series) or user_id not in groups:
+            continue
+        profile = LoadProfile.from_series(series)
+        profiles.append(UserProfile(user_id=user_id, values=profile.to_bytes()))
+        delta = deltas[groups[user_id]]
+        delta[0] += profile
+        delta[1] += 1
+    for user_id, profile in previous.items():
+        delta = deltas[groups[user_id]]
+        delta[0] -= profile
+        delta[1] -= 1
+    UserProfile.objects.bulk_create(profiles)
+
+    for (area, tariff), (delta, users) in deltas.items():
+        group, created = GroupProfile.objects.get_or_create(
+            area=area, tariff=tariff, defaults={'users': 0, 'values': LoadProfile.empty().to_bytes()})
+        group.users += users
+        if group.users <= 0:
+            group.delete()
+            continue
+        group.values = (LoadProfile.from_bytes(group.values) + delta).to_bytes()
+        group.save()
+
+
+def rebuild_group_profiles():
+    """Sum the profiles of every area and tariff again, after users changed group."""
+    totals = defaultdict(lambda: [LoadProfile.empty(), 0])
+    for user_id, area, tariff, values in UserProfile.objects.values_list(
+            'user_id', 'user__area', 'user__tariff', 'values').iterator():
+        total = totals[area, tariff]
+        total[0] += LoadProfile.from_bytes(values)
+        total[1] += 1
+    GroupProfile.objects.all().delete()
+    GroupProfile.objects.bulk_create([
+        GroupProfile(area=area, tariff=tariff, users=users, values=profile.to_bytes())
+        for (area, tariff), (profile, users) in totals.items()
+    ])
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""Pre-aggregated statistics of the readings, maintained by the import.
+
+``UserDayRollup`` rows are computed from the stored series, and only for the
+days an import touched. ``Rollup`` (per day and per month, for each area and
+tariff) and ``UserRollup`` are then re-aggregated in SQL from the
+``UserDayRollup`` rows of the touched days, months and users, so the cost of
+keeping them current does not depend on how much history is stored. Load
+profiles (``consumption.profiles``) are updated along with them, and each
+``UserDayRollup`` carries the day's quantile sketch
+(``consumption.sketches``). The bills of the touched users
+(``consumption.billing``) are priced again from the first month touched.
+"""
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from datetime import date
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+
+from consumption.aggregation import bucket_of
+from consumption.billing import bill_users
+from consumption.models import DataVersion, GroupProfile, Rollup, User, UserDayRollup, UserProfile, UserRollup
+from consumption.profiles import appended_readings, rebuild_group_profiles, update_profiles
+from consumption.series import DAY, TimeSeries, from_epoch
+from consumption.sketches import sketches_by_day
+from consumption.utils import chunks
+
+
+def _day(epoch):
+    return from_epoch(epoch).date()
+
+
+def _next_month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def _statistics(queryset):
+    return queryset.annotate(
+        sum_total=Sum('total'),
+        sum_count=Sum('count'),
+        min_min=Min('min'),
+        max_max=Max('max'),
+    )
+
+
+def touched_windows(files):
+    """Map the users of ``(ParsedFile, checkpoint)`` pairs to the epochs they touched.
+
+    The window is ``None`` for a file read from the start, whose readings
+    replaced everything stored for the user; otherwise it is the range of
+    whole days covering the new readings.
+    """
+    windows = {}
+    for parsed, checkpoint in files:
+        if checkpoint is None:
+            windows[parsed.user_id] = None
+            continue
+        epochs = parsed.epochs
+        if not len(epochs):
+            continue
+        window = (int(epochs.min()) // DAY * DAY, int(epochs.max()) // DAY * DAY + DAY)
+        if parsed.user_id in windows:
+            previous = windows[parsed.user_id]
+            if previous is None:
+                continue
+            window = (min(previous[0], window[0]), max(previous[1], window[1]))
+        windows[parsed.user_id] = window
+    return windows
+
+
+def update_user_days(windows, storage):
+    """Recompute ``UserDayRollup`` for ``{user_id: window}``; returns the days changed."""
+    bounded = [window for window in windows.values() if window is not None]
+    start = end = None
+    if len(bounded) == len(windows):
+        start = min(window[0] for window in bounded)
+        end = max(window[1] for window in bounded)
+    all_series = storage.all_series(list(windows), start, end)
+
+    by_window = defaultdict(list)
+    for user_id, window in windows.items():
+        by_window[window].append(user_id)
+
+    days = set()
+    for window, user_ids in by_window.items():
+        for ids in chunks(user_ids):
+            stale = UserDayRollup.objects.filter(user_id__in=ids)
+            if window is None:
+                days.update(stale.values_list('day', flat=True).distinct())
+            else:
+                stale = stale.filter(day__gte=_day(window[0]), day__lt=_day(window[1]))
+            stale.delete()
+
+    rollups = []
+    for user_id, window in windows.items():
+        series = all_series.get(user_id, TimeSeries.empty())
+        if window is not None:
+            series = series.slice(*window)
+        sketches = sketches_by_day(series)
+        for epoch, total, count, minimum, maximum in zip(*(a.tolist() for a in series.stats_by(DAY))):
+            day = _day(epoch)
+            days.add(day)
+            rollups.append(UserDayRollup(
+                user_id=user_id, day=day, total=total, count=count, min=minimum, max=maximum,
+                sketch=sketches[epoch]))
+    UserDayRollup.objects.bulk_create(rollups)
+    return days
+
+
+def update_group_rollups(days):
+    """Recompute the daily and monthly ``Rollup`` rows covering ``days``."""
+    days = sorted(days)
+    for chunk in chunks(days):
+        Rollup.objects.filter(period=Rollup.DAY, start__in=chunk).delete()
+        rows = UserDayRollup.objects.filter(day__in=chunk).values('day', 'user__area', 'user__tariff')
+        Rollup.objects.bulk_create([
+            Rollup(
+                period=Rollup.DAY, start=row['day'], area=row['user__area'], tariff=row['user__tariff'],
+                users=row['users'], total=row['sum_total'], count=row['sum_count'],
+                min=row['min_min'], max=row['max_max'])
+            for row in _statistics(rows.annotate(users=Count('user')))
+        ])
+
+    for month in sorted({day.replace(day=1) for day in days}):
+        Rollup.objects.filter(period=Rollup.MONTH, start=month).delete()
+        rows = UserDayRollup.objects.filter(day__gte=month, day__lt=_next_month(month))
+        rows = rows.values('user__area', 'user__tariff').annotate(users=Count('user', distinct=True))
+        Rollup.objects.bulk_create([
+            Rollup(
+                period=Rollup.MONTH, start=month, area=row['user__area'], tariff=row['user__tariff'],
+                users=row['users'], total=row['sum_total'], count=row['sum_count'],
+                min=row['min_min'], max=row['max_max'])
+            for row in _statistics(rows)
+        ])
+
+
+def update_user_rollups(user_ids):
+    for ids in chunks(user_ids):
+        UserRollup.objects.filter(user_id__in=ids).delete()
+        rows = UserDayRollup.objects.filter(user_id__in=ids).values('user')
+        UserRollup.objects.bulk_create([
+            UserRollup(
+                user_id=row['user'], total=row['sum_total'], count=row['sum_count'],
+                min=row['min_min'], max=row['max_max'])
+            for row in _statistics(rows)
+        ])
+
+
+def update_rollups(files, storage):
+    """Bring the rollups up to date with ``(ParsedFile, checkpoint)`` pairs just written."""
+    windows = touched_windows(files)
+    if not windows:
+        return
+    days = update_user_days(windows, storage)
+    update_group_rollups(days)
+    update_user_rollups(list(windows))
+    update_profiles(list(windows), storage, appended_readings(files))
+    by_month = defaultdict(list)
+    for user_id, window in windows.items():
+        by_month[None if window is None else int(bucket_of(window[0], 'month'))].append(user_id)
+    for since, user_ids in by_month.items():
+        bill_users(user_ids, storage=storage, since=since)
+
+
+def rebuild_rollups(storage, batch_size=500, progress=None):
+    """Recompute every rollup from the stored readings.
+
+    ``progress(done, total)`` is called after each batch of users. It runs
+    within the transaction, so an exception it raises rolls everything back.
+    """
+    with transaction.atomic():
+        UserDayRollup.objects.all().delete()
+        UserRollup.objects.all().delete()
+        Rollup.objects.all().delete()
+        UserProfile.objects.all().delete()
+        GroupProfile.objects.all().delete()
+        user_ids = list(User.objects.values_list('id', flat=True))
+        days = set()
+        done = 0
+        for ids in chunks(user_ids, batch_size):
+            days.update(update_user_days(dict.fromkeys(ids), storage))
+            update_profiles(ids, storage)
+            done += len(ids)
+            if progress is not None:
+                progress(done, len(user_ids))
+        update_group_rollups(days)
+        update_user_rollups(user_ids)
+        bill_users(storage=storage)
+        DataVersion.bump()
+
+
+def update_changed_groups(user_ids):
+    """Re-aggregate the group rollups and profiles of users moved to another area or tariff."""
+    days = set()
+    for ids in chunks(user_ids):
+        days.update(UserDayRollup.objects.filter(user_id__in=ids).values_list('day', flat=True).distinct())
+    update_group_rollups(days)
+    rebuild_group_profiles()
+    DataVersion.bump()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Fixed-interval consumption series backed by a float32 array."""
+from __future__ import unicode_literals
+
+import calendar
+from datetime import datetime
+
+import numpy as np
+from django.utils import timezone
+
+INTERVAL = 30 * 60
+DAY = 24 * 60 * 60
+
+DTYPE = np.dtype('<f4')
+# A series covers at most a century of slots (7 MB): the import rejects
+# readings outside CONSUMPTION_READING_RANGE, and this guards the rest.
+MAX_SLOTS = 100 * 366 * DAY // INTERVAL
+
+
+def to_epoch(value):
+    """Seconds since the epoch of an aware (or UTC naive) datetime."""
+    if timezone.is_aware(value):
+        value = timezone.make_naive(value, timezone.utc)
+    return calendar.timegm(value.timetuple())
+
+
+def from_epoch(seconds):
+    return datetime.fromtimestamp(int(seconds), timezone.utc)
+
+
+def parse_epochs(moments):
+    """Convert ``YYYY-MM-DD HH:MM:SS`` strings to an int64 array of epochs."""
+    return np.array(moments, dtype='datetime64[s]').astype(np.int64)
+
+
+def _check_span(slots):
+    if slots > MAX_SLOTS:
+        raise ValueError('Readings span {} slots, more than {}.'.format(slots, MAX_SLOTS))
+
+
+def format_epochs(epochs):
+    """Convert an array of epochs back to ``YYYY-MM-DD HH:MM:SS`` strings."""
+    moments = np.asarray(epochs, dtype=np.int64).astype('datetime64[s]').astype(str)
+    return [moment.replace('T', ' ') for moment in moments]
+
+
+class TimeSeries(object):
+    """Readings of one user, one slot every ``INTERVAL`` seconds.
+
+    ``start`` is the epoch of the first slot and ``values`` holds one float32
+    per slot, NaN where there is no reading. Slicing returns views of the same
+    array, so a range scan never copies or converts readings.
+    """
+
+    def __init__(self, start, values):
+        self.start = int(start)
+        self.values = values
+
+    @classmethod
+    def empty(cls):
+        return cls(0, np.empty(0, dtype=DTYPE))
+
+    @classmethod
+    def from_readings(cls, epochs, values):
+        """Build a series from unordered readings; a repeated epoch keeps its last value.
+
+        Raises ``ValueError`` for readings off the interval or spanning more than ``MAX_SLOTS``.
+        """
+        epochs = np.asarray(epochs, dtype=np.int64)
+        if not len(epochs):
+            return cls.empty()
+        if np.any(epochs % INTERVAL):
+            raise ValueError('Readings must be aligned to {} seconds.'.format(INTERVAL))
+        start = int(epochs.min())
+        slots = (epochs - start) // INTERVAL
+        _check_span(int(slots.max()) + 1)
+        array = np.full(int(slots.max()) + 1, np.nan, dtype=DTYPE)
+        array[slots] = values
+        return cls(start, array)
+
+    @classmethod
+    def from_bytes(cls, start, data):
+        return cls(start, np.frombuffer(data, dtype=DTYPE))
+
+    def to_bytes(self):
+        return self.values.astype(DTYPE, copy=False).tobytes()
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def end(self):
+        """Epoch just after the last slot."""
+        return self.start + len(self.values) * INTERVAL
+
+    def timestamps(self):
+        return self.start + np.arange(len(self.values), dtype=np.int64) * INTERVAL
+
+    @property
+    def mask(self):
+        """True for slots which hold a reading."""
+        return ~np.isnan(self.values)
+
+    def merge(self, other):
+        """A new series with the readings of ``other`` written over this one."""
+        if not len(other):
+            return self
+        if not len(self):
+            return other
+        start = min(self.start, other.start)
+        end = max(self.end, other.end)
+        _check_span((end - start) // INTERVAL)
+        array = np.full((end - start) // INTERVAL, np.nan, dtype=DTYPE)
+        offset = (self.start - start) // INTERVAL
+        array[offset:offset + len(self)] = self.values
+        offset = (other.start - start) // INTERVAL
+        readings = other.mask
+        array[offset:offset + len(other)][readings] = other.values[readings]
+        return TimeSeries(start, array)
+
+    def slice(self, start=None, end=None):
+        """Slots in ``[start, end)``; bounds are epochs rounded up to a slot."""
+        first = 0 if start is None else self._slot(start)
+        last = len(self.values) if end is None else self._slot(end)
+        first = min(max(first, 0), len(self.values))
+        last = min(max(last, first), len(self.values))
+        return TimeSeries(self.start + first * INTERVAL, self.values[first:last])
+
+    def _slot(self, epoch):
+        return -((self.start - epoch) // INTERVAL)
+
+    def count(self):
+        return int(np.count_nonzero(self.mask))
+
+    def total(self):
+        return float(np.nansum(self.values, dtype=np.float64))
+
+    def mean(self):
+        return self.total() / self.count() if self.count() else None
+
+    def min(self):
+        return float(np.nanmin(self.values)) if self.count() else None
+
+    def max(self):
+        return float(np.nanmax(self.values)) if self.count() else None
+
+    def stats_by(self, seconds):
+        """Statistics per ``seconds``-long bucket aligned to the epoch.
+
+        Returns ``(bucket_epochs, totals, counts, mins, maxs)`` for the buckets
+        with at least one reading.
+        """
+        readings = self.mask
+        buckets = self.timestamps()[readings] // seconds
+        values = self.values[readings].astype(np.float64)
+        if not len(buckets):
+            empty = np.empty(0)
+            return np.empty(0, dtype=np.int64), empty, np.empty(0, dtype=np.int64), empty, empty
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+        counts = np.diff(np.concatenate((starts, [len(values)])))
+        return (
+            buckets[starts] * seconds,
+            np.add.reduceat(values, starts),
+            counts,
+            np.minimum.reduceat(values, starts),
+            np.maximum.reduceat(values, starts),
+        )
+
+    def sum_by(self, seconds):
+        """Totals per ``seconds``-long bucket aligned to the epoch.
+
+        Returns ``(bucket_epochs, totals)`` for buckets with at least one
+        reading.
+        """
+        return self.stats_by(seconds)[:2]
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Mergeable quantile sketches of readings.
+
+A sketch counts readings in logarithmic buckets, as in DDSketch: bucket
+``k`` holds the values in ``(GAMMA ** (k - 1), GAMMA ** k]`` and a quantile
+is answered with the middle of its bucket, within ``RELATIVE_ACCURACY`` of
+a reading that is actually at that rank. Values at or below ``MIN_VALUE``
+(including zero and negative readings) share bucket 0 and are answered as
+0; values above ``MAX_VALUE`` fall in the last bucket. Sketches merge by
+adding counts, so the sketch of any set of users and days is the sum of
+their daily sketches, in at most ``BUCKETS`` counters whatever the number of
+readings.
+
+Daily sketches are stored sparse, as the ``(key, count)`` pairs of their
+non-empty buckets.
+"""
+from __future__ import unicode_literals
+
+import math
+
+import numpy as np
+
+from consumption.models import UserDayRollup
+from consumption.series import DAY, from_epoch
+from consumption.utils import chunks
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+MIN_VALUE = 1e-3
+MAX_VALUE = 1e7
+# Bucket 0 is for values up to MIN_VALUE, bucket 1 starts just above it.
+_OFFSET = int(math.ceil(math.log(MIN_VALUE) / math.log(GAMMA))) - 1
+BUCKETS = int(math.ceil(math.log(MAX_VALUE) / math.log(GAMMA))) - _OFFSET + 1
+
+ENTRY_DTYPE = np.dtype([('key', '<u2'), ('count', '<u4')])
+# Number of stored sketches merged at a time.
+MERGE_BATCH = 5000
+
+
+def bucket_keys(values):
+    """The bucket of each of ``values``."""
+    values = np.asarray(values, dtype=np.float64)
+    keys = np.zeros(len(values), dtype=np.int64)
+    positive = values > MIN_VALUE
+    keys[positive] = np.ceil(np.log(values[positive]) / math.log(GAMMA)).astype(np.int64) - _OFFSET
+    return np.minimum(keys, BUCKETS - 1)
+
+
+def _bucket_values():
+    keys = np.arange(BUCKETS) + _OFFSET
+    values = 2 * GAMMA ** keys / (GAMMA + 1)
+    values[0] = 0.0
+    return values
+
+
+BUCKET_VALUES = _bucket_values()
+
+
+class QuantileSketch(object):
+    """Counts of readings per bucket, dense."""
+
+    def __init__(self, counts=None):
+        self.counts = np.zeros(BUCKETS, dtype=np.int64) if counts is None else counts
+
+    @classmethod
+    def from_values(cls, values):
+        return cls(np.bincount(bucket_keys(values), minlength=BUCKETS).astype(np.int64))
+
+    @classmethod
+    def from_bytes(cls, data):
+        sketch = cls()
+        sketch.add_bytes(data)
+        return sketch
+
+    @classmethod
+    def merge_bytes(cls, blobs):
+        """Merge many stored sketches at once."""
+        entries = [np.frombuffer(data, dtype=ENTRY_DTYPE) for data in blobs if data]
+        if not entries:
+            return cls()
+        entries = np.concatenate(entries)
+        return cls(np.bincount(entries['key'], weights=entries['count'], minlength=BUCKETS).astype(np.int64))
+
+    def add_bytes(self, data):
+        entries = np.frombuffer(data, dtype=ENTRY_DTYPE)
+        np.add.at(self.counts, entries['key'], entries['count'])
+
+    def to_bytes(self):
+        keys = np.flatnonzero(self.counts)
+        entries = np.empty(len(keys), dtype=ENTRY_DTYPE)
+        entries['key'] = keys
+        entries['count'] = self.counts[keys]
+        return entries.tobytes()
+
+    def merge(self, other):
+        return QuantileSketch(self.counts + other.counts)
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def quantile(self, q):
+        """The value at quantile ``q`` (0 to 1), ``None`` for an empty sketch."""
+        if not 0 <= q <= 1:
+            raise ValueError('Quantiles must be between 0 and 1.')
+        count = self.count
+        if not count:
+            return None
+        rank = q * (count - 1)
+        key = int(np.searchsorted(np.cumsum(self.counts), rank, side='right'))
+        return float(BUCKET_VALUES[key])
+
+
+def sketches_by_day(series):
+    """``{day_epoch: bytes}`` of the daily sketches of ``series``."""
+    readings = series.mask
+    days = series.timestamps()[readings] // DAY
+    if not len(days):
+        return {}
+    keys = bucket_keys(series.values[readings])
+    pairs, counts = np.unique(days * BUCKETS + keys, return_counts=True)
+    pair_days = pairs // BUCKETS
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(pair_days)) + 1, [len(pairs)]))
+    sketches = {}
+    for start, end in zip(starts[:-1], starts[1:]):
+        entries = np.empty(end - start, dtype=ENTRY_DTYPE)
+        entries['key'] = pairs[start:end] % BUCKETS
+        entries['count'] = counts[start:end]
+        sketches[int(pair_days[start]) * DAY] = entries.tobytes()
+    return sketches
+
+
+def merged_sketch(user_ids=None, start=None, end=None):
+    """Sketch of the readings of ``user_ids`` (default: all users) between the epochs ``start`` and ``end``.
+
+    ``start`` and ``end`` (excluded) are rounded to whole UTC days, the
+    resolution of the stored sketches.
+    """
+    rollups = UserDayRollup.objects.all()
+    if start is not None:
+        rollups = rollups.filter(day__gte=from_epoch(start).date())
+    if end is not None:
+        rollups = rollups.filter(day__lt=from_epoch(end).date())
+    if user_ids is None:
+        querysets = [rollups]
+    else:
+        querysets = [rollups.filter(user_id__in=ids) for ids in chunks(user_ids)]
+
+    sketch = QuantileSketch()
+    for queryset in querysets:
+        for batch in chunks(queryset.values_list('sketch', flat=True).iterator(), MERGE_BATCH):
+            sketch.counts += QuantileSketch.merge_bytes(batch).counts
+    return sketch
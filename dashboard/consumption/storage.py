@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""Storage backends for consumption readings.
+
+``settings.CONSUMPTION_STORAGE`` selects the backend used by the import and
+the views:
+
+* ``RowStorage`` stores one ``Consumption`` row per reading.
+* ``ArrayStorage`` stores one ``Series`` row per user, the whole series being
+  a float32 blob (see ``consumption.series``). Readings after the end of
+  the blob are appended to it in SQL, without reading it back.
+
+Both backends write the files handed to them by the importer as
+``(ParsedFile, checkpoint)`` pairs, where ``checkpoint`` is ``None`` when the
+file was read from the start and the user's readings are to be replaced.
+They are called inside the importer's transaction.
+"""
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models.functions import Length
+from django.utils.module_loading import import_string
+
+from consumption.models import Consumption, Series
+from consumption.series import DTYPE, INTERVAL, TimeSeries, _check_span, format_epochs, from_epoch, to_epoch
+from consumption.utils import chunks
+
+
+def get_storage():
+    return import_string(settings.CONSUMPTION_STORAGE)()
+
+
+def _bounds(start, end):
+    filters = {}
+    if start is not None:
+        filters['datetime__gte'] = from_epoch(start)
+    if end is not None:
+        filters['datetime__lt'] = from_epoch(end)
+    return filters
+
+
+class RowStorage(object):
+
+    def __init__(self):
+        qn = connection.ops.quote_name
+        table = qn(Consumption._meta.db_table)
+        user, moment, value = (
+            qn(Consumption._meta.get_field(name).column) for name in ('user', 'datetime', 'consumption'))
+        self.insert_sql = 'INSERT INTO {} ({}, {}, {}) VALUES (%s, %s, %s)'.format(table, user, moment, value)
+        self.delete_sql = 'DELETE FROM {} WHERE {} = %s AND {} = %s'.format(table, user, moment)
+
+    def write(self, files):
+        """Insert the rows of ``files``.
+
+        Rows read after a checkpoint are plain inserts unless they are not
+        newer than the checkpoint, in which case the stored reading of the
+        same timestamp is deleted first.
+        """
+        replaced = []
+        overwritten = []
+        rows = []
+        for parsed, checkpoint in files:
+            last_epoch = None
+            if checkpoint is None:
+                replaced.append(parsed.user_id)
+            elif checkpoint.last_datetime is not None:
+                last_epoch = to_epoch(checkpoint.last_datetime)
+            moments = format_epochs(parsed.epochs)
+            if last_epoch is not None:
+                for index in np.flatnonzero(parsed.epochs <= last_epoch):
+                    overwritten.append((parsed.user_id, moments[index]))
+            rows.extend(zip([parsed.user_id] * len(moments), moments, parsed.values.tolist()))
+
+        for user_ids in chunks(replaced):
+            Consumption.objects.filter(user_id__in=user_ids).delete()
+        with connection.cursor() as cursor:
+            if overwritten:
+                cursor.executemany(self.delete_sql, overwritten)
+            cursor.executemany(self.insert_sql, rows)
+
+    def series(self, user_id, start=None, end=None):
+        readings = Consumption.objects.filter(user_id=user_id, **_bounds(start, end))
+        return self._to_series(readings.values_list('datetime', 'consumption'))
+
+    def all_series(self, user_ids=None, start=None, end=None):
+        """``{user_id: TimeSeries}`` for ``user_ids`` (default: every user with readings)."""
+        readings = Consumption.objects.filter(**_bounds(start, end))
+        if user_ids is not None:
+            result = {}
+            for ids in chunks(user_ids):
+                result.update(self._group(readings.filter(user_id__in=ids)))
+            return result
+        return self._group(readings)
+
+    def _group(self, readings):
+        grouped = defaultdict(list)
+        for user_id, moment, value in readings.values_list('user_id', 'datetime', 'consumption').iterator():
+            grouped[user_id].append((moment, value))
+        return {user_id: self._to_series(rows) for user_id, rows in grouped.items()}
+
+    def _to_series(self, rows):
+        epochs = [to_epoch(moment) for moment, value in rows]
+        return TimeSeries.from_readings(epochs, [value for moment, value in rows])
+
+
+class ArrayStorage(object):
+
+    def __init__(self):
+        qn = connection.ops.quote_name
+        self.append_sql = 'UPDATE {} SET {values} = CAST({values} || %s AS BLOB) WHERE {} = %s'.format(
+            qn(Series._meta.db_table), qn(Series._meta.get_field('user').column),
+            values=qn(Series._meta.get_field('values').column))
+
+    def write(self, files):
+        """Merge the rows of ``files`` into each user's stored series.
+
+        Readings of a resumed file which all come after the stored series
+        are appended to its blob, NaN-padded from its end; only the start
+        and length of the blob are read. Any other series is read, merged
+        and written back whole.
+        """
+        stored = {}
+        resumed = [parsed.user_id for parsed, checkpoint in files if checkpoint is not None]
+        for user_ids in chunks(resumed):
+            rows = Series.objects.filter(user_id__in=user_ids).annotate(size=Length('values'))
+            for user_id, start, size in rows.values_list('user_id', 'start', 'size'):
+                stored[user_id] = (to_epoch(start), to_epoch(start) + size // DTYPE.itemsize * INTERVAL)
+
+        appended = {}
+        updated = {}
+        for parsed, checkpoint in files:
+            new = TimeSeries.from_readings(parsed.epochs, parsed.values)
+            user_id = parsed.user_id
+            if checkpoint is not None and user_id in stored:
+                start, end = stored[user_id]
+                if not len(new):
+                    continue
+                if new.start >= end:
+                    _check_span((new.end - start) // INTERVAL)
+                    gap = np.full((new.start - end) // INTERVAL, np.nan, dtype=DTYPE)
+                    tail = TimeSeries(end, np.concatenate((gap, new.values)))
+                    appended[user_id] = appended[user_id].merge(tail) if user_id in appended else tail
+                    stored[user_id] = start, new.end
+                    continue
+                updated[user_id] = self.series(user_id).merge(appended.pop(user_id, TimeSeries.empty()))
+                del stored[user_id]
+            if checkpoint is not None:
+                new = updated.get(user_id, TimeSeries.empty()).merge(new)
+            updated[user_id] = new
+
+        if appended:
+            with connection.cursor() as cursor:
+                cursor.executemany(self.append_sql, [
+                    (tail.to_bytes(), user_id) for user_id, tail in appended.items()])
+        for user_ids in chunks(updated):
+            Series.objects.filter(user_id__in=user_ids).delete()
+        Series.objects.bulk_create([
+            Series(user_id=user_id, start=from_epoch(series.start), values=series.to_bytes())
+            for user_id, series in updated.items() if len(series)
+        ])
+
+    def series(self, user_id, start=None, end=None):
+        try:
+            series = Series.objects.get(user_id=user_id)
+        except Series.DoesNotExist:
+            return TimeSeries.empty()
+        return self._to_series(series).slice(start, end)
+
+    def all_series(self, user_ids=None, start=None, end=None):
+        """``{user_id: TimeSeries}`` for ``user_ids`` (default: every user with readings)."""
+        if user_ids is None:
+            querysets = [Series.objects.all()]
+        else:
+            querysets = [Series.objects.filter(user_id__in=ids) for ids in chunks(user_ids)]
+        return {
+            series.user_id: self._to_series(series).slice(start, end)
+            for queryset in querysets for series in queryset.iterator()
+        }
+
+    def _to_series(self, series):
+        return TimeSeries.from_bytes(to_epoch(series.start), series.values)
@@ -1,6 +1,1464 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+import gzip
+import hashlib
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import json
+from datetime import date, datetime, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.cache import cache, caches
+from django.db import IntegrityError, connection, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from common import profiling
+from common.benchmark import compare
+from common.sqlite import ReadReplicaRouter
+from consumption import benchmark, jobs, loadtest
+from consumption.aggregation import Matrix, aggregate_users, bucket_of, summarize
+from consumption.charts import data_version
+from consumption.billing import FlatTariff, TieredTariff, TimeOfUseTariff
+from consumption.csvcache import ParseCache
+from consumption.downsampling import downsample, lttb, minmax
+from consumption.importer import parse_datetime, read_consumption
+from consumption.validation import QualityReport, parse_lines, validate_file
+from consumption.models import (
+    Consumption, GroupProfile, ImportCheckpoint, Job, MonthlyStatistics, Rollup, Series, User, UserDayRollup, UserProfile,
+    UserRollup)
+from consumption.profiles import LoadProfile, group_profile, user_profile
+from consumption.series import DAY, INTERVAL, TimeSeries, format_epochs, from_epoch, to_epoch
+from consumption.sketches import BUCKETS, ENTRY_DTYPE, RELATIVE_ACCURACY, QuantileSketch, sketches_by_day
+from consumption.storage import ArrayStorage, get_storage
+from consumption.utils import chunks
+
+
+def write_dataset(data_dir, users, readings):
+    """Write a small challenge-shaped dataset into ``data_dir``.
+
+    ``users`` is a list of ``(id, area, tariff)``; ``readings`` maps a user id
+    to a list of ``(datetime, consumption)`` string pairs.
+    """
+    os.makedirs(os.path.join(data_dir, 'consumption'), exist_ok=True)
+    with open(os.path.join(data_dir, 'user_data.csv'), 'w', newline='') as f:
+        f.write('id,area,tariff\r\n')
+        for user in users:
+            f.write('{},{},{}\r\n'.format(*user))
+    for user_id, rows in readings.items():
+        with open(os.path.join(data_dir, 'consumption', '{}.csv'.format(user_id)), 'w', newline='') as f:
+            f.write('datetime,consumption\r\n')
+            for row in rows:
+                f.write('{},{}\r\n'.format(*row))
+
+
+def rows(parsed):
+    """``(datetime, consumption)`` string and float pairs of a ``ParsedFile``."""
+    return list(zip(format_epochs(parsed.epochs), parsed.values.tolist()))
+
+
+class DatasetTestCase(TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        self.addCleanup(cache.clear)
+        self.cache_dir = os.path.join(self.data_dir, 'cache')
+        self.quality_dir = os.path.join(self.data_dir, 'quality')
+        snapshots = dict(settings.CACHES['snapshots'], LOCATION=os.path.join(self.data_dir, 'snapshots'))
+        parse_cache = self.settings(
+            CONSUMPTION_CACHE_DIR=self.cache_dir, CONSUMPTION_QUALITY_DIR=self.quality_dir,
+            CACHES=dict(settings.CACHES, snapshots=snapshots))
+        parse_cache.enable()
+        self.addCleanup(parse_cache.disable)
+
+    def run_import(self, **options):
+        options.setdefault('workers', 1)
+        out = StringIO()
+        call_command('import', data_dir=self.data_dir, stdout=out, stderr=StringIO(), **options)
+        return out.getvalue()
+
+    def append(self, user_id, rows):
+        with open(os.path.join(self.data_dir, 'consumption', '{}.csv'.format(user_id)), 'a', newline='') as f:
+            for row in rows:
+                f.write('{},{}\r\n'.format(*row))
+
+    def readings(self, user_id):
+        """``(HH:MM, consumption)`` of every stored reading of ``user_id``."""
+        series = get_storage().series(user_id)
+        return [
+            (from_epoch(epoch).strftime('%H:%M'), float(value))
+            for epoch, value in zip(series.timestamps()[series.mask], series.values[series.mask])
+        ]
+
+
+class ParseTest(TestCase):
+
+    def test_parse_datetime(self):
+        self.assertEqual(parse_datetime('2016-07-15 00:30:00').minute, 30)
+        with self.assertRaises(ValueError):
+            parse_datetime('2016/07/15 00:30:00')
+        with self.assertRaises(ValueError):
+            parse_datetime('2016-13-15 00:30:00')
+
+    def test_duplicate_timestamp_keeps_last_reading(self):
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir)
+        write_dataset(data_dir, [], {3000: [
+            ('2016-10-26 01:00:00', '113.0'),
+            ('2016-10-26 01:00:00', '39.0'),
+            ('2016-10-26 01:30:00', '147.0'),
+        ]})
+        parsed = read_consumption(os.path.join(data_dir, 'consumption', '3000.csv'))
+        self.assertEqual(parsed.user_id, 3000)
+        self.assertEqual(rows(parsed), [('2016-10-26 01:00:00', 39.0), ('2016-10-26 01:30:00', 147.0)])
+
+    def test_partial_last_line_is_left_for_next_read(self):
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir)
+        path = os.path.join(data_dir, '1.csv')
+        with open(path, 'wb') as f:
+            f.write(b'datetime,consumption\r\n2016-07-15 00:00:00,39.0\r\n2016-07-15 00:3')
+        parsed = read_consumption(path)
+        self.assertEqual(rows(parsed), [('2016-07-15 00:00:00', 39.0)])
+        with open(path, 'ab') as f:
+            f.write(b'0:00,147.0\r\n')
+        self.assertEqual(rows(read_consumption(path, parsed.offset)), [('2016-07-15 00:30:00', 147.0)])
+
+
+class ImportCommandTest(DatasetTestCase):
+
+    def setUp(self):
+        super(ImportCommandTest, self).setUp()
+        write_dataset(self.data_dir, [(1, 'a1', 't1'), (2, 'a2', 't3')], {
+            1: [('2016-07-15 00:00:00', '39.0'), ('2016-07-15 00:30:00', '147.0')],
+            2: [('2016-07-15 00:00:00', '10.0')],
+            3: [('2016-07-15 00:00:00', '10.0')],
+        })
+
+    def test_import(self):
+        out = self.run_import(batch_size=2)
+        self.assertIn('3 readings from 2 files', out)
+        self.assertIn('rows/s', out)
+        self.assertEqual(User.objects.get(pk=2).tariff, 't3')
+        self.assertEqual(self.readings(1), [('00:00', 39.0), ('00:30', 147.0)])
+        self.assertEqual(self.readings(3), [])
+
+    def test_reimport_replaces_readings(self):
+        self.run_import()
+        write_dataset(self.data_dir, [(1, 'a1', 't2'), (2, 'a2', 't3')], {
+            1: [('2016-07-15 00:00:00', '40.0')],
+        })
+        self.run_import()
+        self.assertEqual(User.objects.get(pk=1).tariff, 't2')
+        self.assertEqual(self.readings(1), [('00:00', 40.0)])
+        self.assertEqual(self.readings(2), [('00:00', 10.0)])
+
+    def test_import_with_process_pool(self):
+        self.run_import(workers=2)
+        self.assertEqual(len(self.readings(1)), 2)
+
+
+class IncrementalImportTest(DatasetTestCase):
+
+    def setUp(self):
+        super(IncrementalImportTest, self).setUp()
+        write_dataset(self.data_dir, [(1, 'a1', 't1'), (2, 'a2', 't3')], {
+            1: [('2016-07-15 00:00:00', '39.0'), ('2016-07-15 00:30:00', '147.0')],
+            2: [('2016-07-15 00:00:00', '10.0')],
+        })
+        self.run_import()
+
+    def test_checkpoint(self):
+        checkpoint = ImportCheckpoint.objects.get(user=1)
+        path = os.path.join(self.data_dir, 'consumption', '1.csv')
+        self.assertEqual(checkpoint.offset, os.path.getsize(path))
+        self.assertEqual((checkpoint.last_datetime.hour, checkpoint.last_datetime.minute), (0, 30))
+
+    def test_unchanged_files_are_not_opened(self):
+        with mock.patch('consumption.importer.read_consumption') as read:
+            out = self.run_import(incremental=True)
+        read.assert_not_called()
+        self.assertIn('2 unchanged files', out)
+
+    def test_only_appended_rows_are_inserted(self):
+        self.append(1, [('2016-07-15 01:00:00', '50.0')])
+        out = self.run_import(incremental=True)
+        self.assertIn('1 readings from 1 files', out)
+        self.assertEqual(self.readings(1), [('00:00', 39.0), ('00:30', 147.0), ('01:00', 50.0)])
+        self.assertEqual(ImportCheckpoint.objects.get(user=1).last_datetime.hour, 1)
+
+    def test_appended_duplicate_replaces_reading(self):
+        self.append(1, [('2016-07-15 00:30:00', '140.0')])
+        self.run_import(incremental=True)
+        self.assertEqual(self.readings(1), [('00:00', 39.0), ('00:30', 140.0)])
+
+    def test_rewritten_file_is_read_again(self):
+        write_dataset(self.data_dir, [(1, 'a1', 't1'), (2, 'a2', 't3')], {
+            1: [('2016-07-16 00:00:00', '1.0')],
+        })
+        self.run_import(incremental=True)
+        self.assertEqual(self.readings(1), [('00:00', 1.0)])
+
+    def test_file_rewritten_in_place_and_grown_is_read_again(self):
+        # Same length up to the checkpoint, on a line boundary: only the hash tells.
+        write_dataset(self.data_dir, [(1, 'a1', 't1'), (2, 'a2', 't3')], {
+            1: [('2016-07-16 00:00:00', '39.0'), ('2016-07-16 00:30:00', '147.0')],
+        })
+        self.append(1, [('2016-07-16 01:00:00', '50.0')])
+        out = self.run_import(incremental=True)
+        self.assertIn('3 readings from 1 files', out)
+        self.assertEqual(self.readings(1), [('00:00', 39.0), ('00:30', 147.0), ('01:00', 50.0)])
+        self.assertEqual(ImportCheckpoint.objects.get(user=1).last_datetime.day, 16)
+        self.assertIn('2 unchanged files', self.run_import(incremental=True))
+
+    def test_only_a_window_before_the_checkpoint_is_hashed(self):
+        path = os.path.join(self.data_dir, 'consumption', '1.csv')
+        with mock.patch('consumption.importer.PREFIX_WINDOW', 30):
+            self.run_import()
+            # The header is outside the window: the change goes unseen.
+            with open(path, 'r+b') as f:
+                f.write(b'DATETIME')
+            self.append(1, [('2016-07-15 01:00:00', '50.0')])
+            out = self.run_import(incremental=True)
+        self.assertIn('1 readings from 1 files', out)
+        with open(path, 'rb') as f:
+            data = f.read()
+        checkpoint = ImportCheckpoint.objects.get(user=1)
+        self.assertEqual(checkpoint.prefix_hash, hashlib.blake2b(data[-30:], digest_size=20).hexdigest())
+
+    def test_readings_appended_after_a_gap(self):
+        self.append(1, [('2016-07-15 02:00:00', '50.0')])
+        self.run_import(incremental=True)
+        self.assertEqual(self.readings(1), [('00:00', 39.0), ('00:30', 147.0), ('02:00', 50.0)])
+
+
+class ParseCacheTest(DatasetTestCase):
+
+    def setUp(self):
+        super(ParseCacheTest, self).setUp()
+        write_dataset(self.data_dir, [(1, 'a1', 't1'), (2, 'a2', 't3')], {
+            1: [('2016-07-15 00:00:00', '39.0'), ('2016-07-15 00:30:00', '147.0')],
+            2: [('2016-07-15 00:00:00', '10.0')],
+        })
+
+    def test_cached_files_are_not_parsed(self):
+        self.assertNotIn('parse cache', self.run_import())
+        with mock.patch('consumption.importer.parse_file', side_effect=AssertionError) as parse:
+            out = self.run_import()
+        parse.assert_not_called()
+        self.assertIn('2 files read from the parse cache', out)
+        self.assertEqual(self.readings(1), [('00:00', 39.0), ('00:30', 147.0)])
+
+    def test_rewritten_file_is_parsed_again(self):
+        self.run_import()
+        write_dataset(self.data_dir, [(1, 'a1', 't1'), (2, 'a2', 't3')], {
+            1: [('2016-07-15 00:00:00', '40.0')],
+        })
+        out = self.run_import()
+        self.assertIn('1 files read from the parse cache', out)
+        self.assertEqual(self.readings(1), [('00:00', 40.0)])
+
+    def test_no_cache(self):
+        self.run_import(use_cache=False)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_partial_file_is_not_cached(self):
+        path = os.path.join(self.data_dir, 'consumption', '1.csv')
+        with open(path, 'ab') as f:
+            f.write(b'2016-07-15 01:')
+        parse_cache = ParseCache(self.cache_dir, 1024 * 1024)
+        read_consumption(path, cache=parse_cache)
+        self.assertEqual(parse_cache.size(), 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        parse_cache = ParseCache(self.cache_dir, 1024 * 1024)
+        epochs = np.arange(100, dtype=np.int64) * INTERVAL
+        values = np.ones(100, dtype=np.float32)
+        for age, key in enumerate(['c', 'b', 'a']):
+            parse_cache.put(key, epochs, values)
+            os.utime(os.path.join(self.cache_dir, key + '.npy'), (1000 - age, 1000 - age))
+        self.assertIsNotNone(parse_cache.get('a'))
+        parse_cache.max_size = parse_cache.size() * 2 // 3
+        parse_cache.evict()
+        self.assertIsNone(parse_cache.get('b'))
+        cached = parse_cache.get('a')
+        self.assertEqual(cached[0].tolist(), epochs.tolist())
+        self.assertEqual(cached[1].tolist(), values.tolist())
+        self.assertIsNotNone(parse_cache.get('c'))
+
+
+class ValidationTest(DatasetTestCase):
+
+    def setUp(self):
+        super(ValidationTest, self).setUp()
+        write_dataset(self.data_dir, [(1, 'a1', 't1')], {1: [
+            ('2016-07-15 00:00:00', '39.0'),
+            ('2016-07-15 00:30:00', '147.0'),
+            ('2016-07-15 00:30:00', '140.0'),
+            ('2016-07-15 02:00:00', '20.0'),
+            ('2016-07-15 01:30:00', '30.0'),
+            ('2016-07-15 02:10:00', '5.0'),
+            ('2016-07-15 03:00:00', 'n/a'),
+            ('2016-07-15 03:30:00', '-1.5'),
+        ]})
+        self.path = os.path.join(self.data_dir, 'consumption', '1.csv')
+
+    def report(self):
+        with open(os.path.join(self.quality_dir, '1.json')) as f:
+            return json.load(f)
+
+    def test_import_skips_bad_rows_and_reports(self):
+        out = self.run_import()
+        self.assertIn('5 readings', out)
+        self.assertIn('Quality: 2 gaps (3 missing readings), 1 duplicates, 1 out of order, 1 unaligned, 1 bad rows',
+                      out)
+        self.assertEqual(self.readings(1), [
+            ('00:00', 39.0), ('00:30', 140.0), ('01:30', 30.0), ('02:00', 20.0), ('03:30', -1.5)])
+        report = self.report()
+        self.assertEqual((report['rows'], report['readings'], report['missing']), (8, 5, 3))
+        self.assertEqual((report['first'], report['last']), ('2016-07-15 00:00:00', '2016-07-15 03:30:00'))
+        self.assertEqual(report['gaps']['list'], [
+            {'start': '2016-07-15 01:00:00', 'missing': 1}, {'start': '2016-07-15 02:30:00', 'missing': 2}])
+        self.assertEqual(report['gaps']['longest'], 2)
+        self.assertEqual(report['negative'], 1)
+        self.assertEqual([example['line'] for example in report['bad_rows']['examples']], [7, 8])
+
+    def test_fill_gaps(self):
+        out = self.run_import(max_gap=1)
+        self.assertIn('1 missing readings filled', out)
+        self.assertEqual(self.readings(1)[1:3], [('00:30', 140.0), ('01:00', 85.0)])
+        self.assertEqual(self.report()['filled'], 1)
+        self.run_import(max_gap=2)
+        self.assertEqual(len(self.readings(1)), 8)
+
+    def test_validate_only(self):
+        out = self.run_import(validate_only=True)
+        self.assertIn('Validated 8 rows from 1 files', out)
+        self.assertIn('2 gaps (3 missing readings)', out)
+        self.assertFalse(User.objects.exists())
+        self.assertEqual(self.report()['readings'], 5)
+
+    def test_blocks_give_the_same_report(self):
+        whole = validate_file(self.path, 1).as_json()
+        self.assertEqual(validate_file(self.path, 1, block_size=7).as_json(), whole)
+
+    def test_import_parses_in_blocks(self):
+        whole = read_consumption(self.path)
+        parsed = read_consumption(self.path, block_size=7)
+        self.assertEqual(rows(parsed), rows(whole))
+        self.assertEqual((parsed.offset, parsed.prefix_hash), (whole.offset, whole.prefix_hash))
+        self.assertEqual(parsed.report.as_json(), whole.report.as_json())
+
+    def test_incremental_report_starts_after_previous_reading(self):
+        self.run_import()
+        with open(self.path, 'a', newline='') as f:
+            f.write('2016-07-15 05:00:00,1.0\r\n2016-07-15 03:00:00,2.0\r\n')
+        self.run_import(incremental=True)
+        report = self.report()
+        self.assertEqual((report['rows'], report['out_of_order']), (2, 1))
+        self.assertEqual(report['gaps']['list'], [{'start': '2016-07-15 04:00:00', 'missing': 2}])
+        self.assertEqual(self.readings(1)[-3:], [('03:00', 2.0), ('03:30', -1.5), ('05:00', 1.0)])
+
+    def test_fast_path_matches_float(self):
+        values = ['39.0', '0.125', '-1.5', '1e3', ' 7.25', '12345678.9012345', '.5', '3.', '0.1']
+        data = ''.join('2016-07-15 00:00:00,{}\r\n'.format(value) for value in values).encode('ascii')
+        epochs, parsed, line_numbers, bad_rows = parse_lines(data)
+        self.assertEqual(bad_rows, [])
+        self.assertEqual(parsed.tolist(), [float(value) for value in values])
+        self.assertEqual(set(epochs.tolist()), {to_epoch(datetime(2016, 7, 15))})
+
+    def test_bad_dates_are_reported(self):
+        data = b'2016-02-30 00:00:00,1.0\n2016-07-15 00:00,1.0\n2016-07-15 00:00:00;1.0\n'
+        epochs, values, line_numbers, bad_rows = parse_lines(data)
+        self.assertEqual(len(epochs), 0)
+        self.assertEqual([line for line, error in bad_rows], [1, 2, 3])
+        report = QualityReport(1)
+        report.add(epochs, values, line_numbers, bad_rows)
+        self.assertEqual(report.as_json()['first'], None)
+
+    def test_implausible_dates_are_bad_rows(self):
+        with open(self.path, 'a', newline='') as f:
+            f.write('9999-12-31 23:30:00,1.0\r\n1970-01-01 00:00:00,1.0\r\n')
+        report = validate_file(self.path, 1)
+        self.assertEqual(report.issues()['bad_rows'], 3)
+        self.assertEqual(report.as_json()['last'], '2016-07-15 03:30:00')
+        self.assertLess(len(report._seen), 100)
+        self.assertIn('not between 2000-01-01 and 2100-01-01', report.examples[-1]['error'])
+
+
+@override_settings(CONSUMPTION_STORAGE='consumption.storage.RowStorage')
+class RowStorageImportCommandTest(ImportCommandTest):
+
+    def test_one_row_per_reading(self):
+        self.run_import()
+        self.assertEqual(Consumption.objects.count(), 3)
+        self.assertFalse(Series.objects.exists())
+
+
+@override_settings(CONSUMPTION_STORAGE='consumption.storage.RowStorage')
+class RowStorageIncrementalImportTest(IncrementalImportTest):
+    pass
+
+
+class ArrayStorageTest(DatasetTestCase):
+
+    def setUp(self):
+        super(ArrayStorageTest, self).setUp()
+        write_dataset(self.data_dir, [(1, 'a1', 't1')], {
+            1: [('2016-07-15 00:00:00', '39.0'), ('2016-07-15 00:30:00', '147.0')],
+        })
+        self.run_import()
+
+    def test_appended_readings_are_not_read_back(self):
+        self.append(1, [('2016-07-15 02:00:00', '50.0')])
+        checkpoint = ImportCheckpoint.objects.get(user=1)
+        parsed = read_consumption(
+            os.path.join(self.data_dir, 'consumption', '1.csv'), checkpoint.offset,
+            checkpoint_hash=checkpoint.prefix_hash)
+        with mock.patch.object(ArrayStorage, '_to_series', side_effect=AssertionError):
+            ArrayStorage().write([(parsed, checkpoint)])
+        series = Series.objects.get(user=1)
+        self.assertEqual(len(series.values), 5 * 4)
+        self.assertEqual(self.readings(1), [('00:00', 39.0), ('00:30', 147.0), ('02:00', 50.0)])
+
+    def test_readings_before_the_end_are_merged(self):
+        self.append(1, [('2016-07-15 00:30:00', '140.0'), ('2016-07-15 01:00:00', '50.0')])
+        self.run_import(incremental=True)
+        self.assertEqual(self.readings(1), [('00:00', 39.0), ('00:30', 140.0), ('01:00', 50.0)])
+        self.assertEqual(len(Series.objects.get(user=1).values), 3 * 4)
+
+
+class TimeSeriesTest(TestCase):
+
+    def setUp(self):
+        day = to_epoch(datetime(2016, 7, 15))
+        self.day = day
+        self.series = TimeSeries.from_readings(
+            [day + INTERVAL, day, day + 3 * INTERVAL, day + DAY], [2, 1, 4, 8])
+
+    def test_from_readings(self):
+        self.assertEqual(self.series.start, self.day)
+        self.assertEqual(len(self.series), 49)
+        self.assertEqual(self.series.count(), 4)
+        self.assertTrue(np.isnan(self.series.values[2]))
+        with self.assertRaises(ValueError):
+            TimeSeries.from_readings([self.day + 60], [1])
+        # An outlier would allocate a slot for every half hour up to it.
+        with self.assertRaises(ValueError):
+            TimeSeries.from_readings([self.day, to_epoch(datetime(9999, 12, 31))], [1, 2])
+        with self.assertRaises(ValueError):
+            self.series.merge(TimeSeries.from_readings([to_epoch(datetime(9999, 12, 31))], [1]))
+
+    def test_aggregates(self):
+        self.assertEqual(self.series.total(), 15)
+        self.assertEqual(self.series.mean(), 3.75)
+        self.assertEqual((self.series.min(), self.series.max()), (1, 8))
+        self.assertIsNone(TimeSeries.empty().mean())
+
+    def test_slice(self):
+        part = self.series.slice(self.day + 1, self.day + 4 * INTERVAL)
+        self.assertEqual(part.start, self.day + INTERVAL)
+        self.assertEqual(part.total(), 6)
+        self.assertEqual(len(self.series.slice(self.day + 2 * DAY)), 0)
+
+    def test_merge(self):
+        other = TimeSeries.from_readings([self.day - INTERVAL, self.day + INTERVAL], [16, 32])
+        merged = self.series.merge(other)
+        self.assertEqual(merged.start, self.day - INTERVAL)
+        self.assertEqual(merged.total(), 16 + 1 + 32 + 4 + 8)
+
+    def test_bytes_round_trip(self):
+        copy = TimeSeries.from_bytes(self.series.start, self.series.to_bytes())
+        np.testing.assert_array_equal(copy.values, self.series.values)
+
+    def test_sum_by(self):
+        days, totals = self.series.sum_by(DAY)
+        self.assertEqual(days.tolist(), [self.day, self.day + DAY])
+        self.assertEqual(totals.tolist(), [7, 8])
+
+
+class RollupTest(DatasetTestCase):
+
+    def setUp(self):
+        super(RollupTest, self).setUp()
+        self.users = [(1, 'a1', 't1'), (2, 'a1', 't1'), (3, 'a2', 't3')]
+        write_dataset(self.data_dir, self.users, {
+            1: [('2016-07-31 23:30:00', '10.0'), ('2016-08-01 00:00:00', '20.0')],
+            2: [('2016-07-31 00:00:00', '5.0')],
+            3: [('2016-07-31 00:00:00', '7.0')],
+        })
+        self.run_import()
+
+    def rollups(self, period):
+        return {
+            (r.start.isoformat(), r.area, r.tariff): (r.users, r.total, r.count, r.min, r.max)
+            for r in Rollup.objects.filter(period=period)
+        }
+
+    def test_rollups_after_import(self):
+        self.assertEqual(self.rollups(Rollup.DAY), {
+            ('2016-07-31', 'a1', 't1'): (2, 15.0, 2, 5.0, 10.0),
+            ('2016-07-31', 'a2', 't3'): (1, 7.0, 1, 7.0, 7.0),
+            ('2016-08-01', 'a1', 't1'): (1, 20.0, 1, 20.0, 20.0),
+        })
+        self.assertEqual(self.rollups(Rollup.MONTH), {
+            ('2016-07-01', 'a1', 't1'): (2, 15.0, 2, 5.0, 10.0),
+            ('2016-07-01', 'a2', 't3'): (1, 7.0, 1, 7.0, 7.0),
+            ('2016-08-01', 'a1', 't1'): (1, 20.0, 1, 20.0, 20.0),
+        })
+        rollup = UserRollup.objects.get(user=1)
+        self.assertEqual((rollup.total, rollup.count, rollup.min, rollup.max, rollup.mean), (30.0, 2, 10.0, 20.0, 15.0))
+
+    def test_incremental_import_updates_touched_days(self):
+        with open(os.path.join(self.data_dir, 'consumption', '2.csv'), 'a', newline='') as f:
+            f.write('2016-08-01 00:30:00,40.0\r\n2016-07-31 00:00:00,6.0\r\n')
+        self.run_import(incremental=True)
+        self.assertEqual(self.rollups(Rollup.DAY)[('2016-07-31', 'a1', 't1')], (2, 16.0, 2, 6.0, 10.0))
+        self.assertEqual(self.rollups(Rollup.DAY)[('2016-08-01', 'a1', 't1')], (2, 60.0, 2, 20.0, 40.0))
+        self.assertEqual(self.rollups(Rollup.MONTH)[('2016-08-01', 'a1', 't1')], (2, 60.0, 2, 20.0, 40.0))
+        self.assertEqual(UserRollup.objects.get(user=2).total, 46.0)
+
+    def test_tariff_change_moves_user_to_new_group(self):
+        self.users[1] = (2, 'a2', 't3')
+        write_dataset(self.data_dir, self.users, {})
+        self.run_import(incremental=True)
+        self.assertEqual(self.rollups(Rollup.DAY)[('2016-07-31', 'a2', 't3')], (2, 12.0, 2, 5.0, 7.0))
+
+    def test_rebuild_rollups(self):
+        expected = self.rollups(Rollup.MONTH)
+        Rollup.objects.all().delete()
+        UserDayRollup.objects.filter(user=1).delete()
+        out = StringIO()
+        call_command('import', rebuild_rollups=True, stdout=out)
+        self.assertIn('Rollups rebuilt', out.getvalue())
+        self.assertEqual(self.rollups(Rollup.MONTH), expected)
+        self.assertEqual(UserDayRollup.objects.filter(user=1).count(), 2)
+
+
+@override_settings(CONSUMPTION_STORAGE='consumption.storage.RowStorage')
+class RowStorageRollupTest(RollupTest):
+    pass
+
+
+class ProfileTest(DatasetTestCase):
+
+    def setUp(self):
+        super(ProfileTest, self).setUp()
+        self.users = [(1, 'a1', 't1'), (2, 'a1', 't1'), (3, 'a2', 't3')]
+        write_dataset(self.data_dir, self.users, {
+            # Sunday, then two Mondays.
+            1: [('2016-07-31 23:30:00', '10.0'), ('2016-08-01 00:00:00', '20.0'), ('2016-08-08 00:00:00', '40.0')],
+            2: [('2016-08-01 00:00:00', '6.0')],
+            3: [('2016-07-31 00:00:00', '7.0')],
+        })
+        self.run_import()
+
+    def group(self, area, tariff):
+        profile, users = group_profile(area, tariff)
+        return users, profile.weekday_mean[0, 0], profile.count
+
+    def test_from_series(self):
+        series = TimeSeries.from_readings(
+            [to_epoch(datetime(2016, 7, 18, 0, 30)), to_epoch(datetime(2016, 7, 25, 0, 30)),
+             to_epoch(datetime(2016, 12, 3, 23, 30))],
+            [10.0, 30.0, 5.0])
+        profile = LoadProfile.from_series(series)
+        self.assertEqual(profile.weekday_mean.shape, (48, 7))
+        self.assertEqual(profile.month_mean.shape, (48, 12))
+        self.assertEqual(profile.weekday_mean[1, 0], 20.0)
+        self.assertEqual(profile.weekday_mean[47, 5], 5.0)
+        self.assertEqual(profile.month_mean[1, 6], 20.0)
+        self.assertEqual(profile.month_mean[47, 11], 5.0)
+        self.assertEqual(np.count_nonzero(~np.isnan(profile.weekday_mean)), 2)
+        self.assertEqual(profile.count, 3)
+        self.assertEqual(LoadProfile.from_bytes(profile.to_bytes()).month_total.tolist(), profile.month_total.tolist())
+        self.assertEqual(profile.daily_means()[0], ('Mon', 20.0))
+        self.assertEqual(profile.daily_means()[1], ('Tue', None))
+
+    def test_profiles_after_import(self):
+        profile = user_profile(1)
+        self.assertEqual(profile.weekday_mean[0, 0], 30.0)
+        self.assertEqual(profile.weekday_mean[47, 6], 10.0)
+        self.assertEqual(self.group('a1', 't1'), (2, 22.0, 4))
+        self.assertEqual(self.group(None, None)[0], 3)
+
+    def test_incremental_import_updates_groups(self):
+        with open(os.path.join(self.data_dir, 'consumption', '2.csv'), 'a', newline='') as f:
+            f.write('2016-08-01 00:00:00,2.0\r\n2016-08-15 00:00:00,8.0\r\n')
+        self.run_import(incremental=True)
+        self.assertEqual(user_profile(2).weekday_mean[0, 0], 5.0)
+        self.assertEqual(self.group('a1', 't1'), (2, 17.5, 5))
+        self.assertEqual(self.group('a2', 't3')[0], 1)
+
+    def test_appended_readings_are_added_to_the_profile(self):
+        with open(os.path.join(self.data_dir, 'consumption', '1.csv'), 'a', newline='') as f:
+            f.write('2016-08-15 00:00:00,60.0\r\n2016-08-16 00:30:00,5.0\r\n')
+        with mock.patch('consumption.profiles.LoadProfile.from_series',
+                        side_effect=LoadProfile.from_series) as from_series:
+            self.run_import(incremental=True)
+        # Only the new readings are read and added.
+        self.assertEqual([call[0][0].count() for call in from_series.call_args_list], [2])
+        self.assertEqual(user_profile(1).to_bytes(), LoadProfile.from_series(get_storage().series(1)).to_bytes())
+        self.assertEqual(user_profile(1).weekday_mean[0, 0], 40.0)
+        self.assertEqual(self.group('a1', 't1'), (2, 31.5, 6))
+
+    def test_tariff_change_moves_user_to_new_group(self):
+        self.users[1] = (2, 'a2', 't3')
+        write_dataset(self.data_dir, self.users, {})
+        self.run_import(incremental=True)
+        self.assertEqual(self.group('a1', 't1'), (1, 30.0, 3))
+        self.assertEqual(self.group('a2', 't3'), (2, 6.0, 2))
+
+    def test_rebuild_rollups(self):
+        expected = user_profile(1).to_bytes(), self.group('a1', 't1')
+        UserProfile.objects.all().delete()
+        GroupProfile.objects.all().delete()
+        call_command('import', rebuild_rollups=True, stdout=StringIO())
+        self.assertEqual((user_profile(1).to_bytes(), self.group('a1', 't1')), expected)
+
+    def test_views(self):
+        data = self.client.get('/detail/1/profile/').json()
+        self.assertEqual(len(data['slots']), 48)
+        self.assertEqual(data['slots'][47], '23:30')
+        self.assertEqual(data['weekday']['Mon'][0], 30.0)
+        self.assertIsNone(data['weekday']['Tue'][0])
+        self.assertEqual(data['month']['Aug'][0], 30.0)
+        self.assertEqual(self.client.get('/detail/4/profile/').status_code, 404)
+
+        data = self.client.get('/summary/profile/', {'area': 'a1', 'tariff': 't1'}).json()
+        self.assertEqual((data['users'], data['weekday']['Mon'][0]), (2, 22.0))
+        self.assertEqual(self.client.get('/summary/profile/').json()['users'], 3)
+
+        response = self.client.get('/detail/1/')
+        self.assertEqual(response.context['daily_means'][0], ('Mon', 30.0))
+        self.assertContains(response, '/detail/1/profile/')
+
+
+@override_settings(CONSUMPTION_STORAGE='consumption.storage.RowStorage')
+class RowStorageProfileTest(ProfileTest):
+    pass
+
+
+class SketchTest(TestCase):
+
+    def test_relative_accuracy(self):
+        values = np.random.RandomState(0).lognormal(4, 1.5, 100000)
+        sketch = QuantileSketch.from_values(values)
+        ordered = np.sort(values)
+        for q in (0, 0.01, 0.5, 0.9, 0.95, 0.99, 0.999, 1):
+            expected = ordered[int(q * (len(values) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(q) - expected) / expected, RELATIVE_ACCURACY + 1e-9)
+        self.assertEqual(sketch.count, len(values))
+        self.assertLess(len(sketch.to_bytes()), BUCKETS * ENTRY_DTYPE.itemsize)
+
+    def test_merge(self):
+        a, b = np.arange(1, 100, dtype=np.float64), np.array([0.0, 0.0, 5.0, 1e9])
+        merged = QuantileSketch.from_values(a).merge(QuantileSketch.from_values(b))
+        self.assertEqual(merged.counts.tolist(), QuantileSketch.from_values(np.concatenate((a, b))).counts.tolist())
+        stored = QuantileSketch.merge_bytes([QuantileSketch.from_values(a).to_bytes(), b'',
+                                             QuantileSketch.from_values(b).to_bytes()])
+        self.assertEqual(stored.counts.tolist(), merged.counts.tolist())
+        self.assertEqual(QuantileSketch.from_bytes(merged.to_bytes()).counts.tolist(), merged.counts.tolist())
+        self.assertEqual(merged.quantile(0), 0.0)
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+        with self.assertRaises(ValueError):
+            merged.quantile(1.5)
+
+    def test_sketches_by_day(self):
+        epochs = np.array([to_epoch(datetime(2016, 7, 15, 0, 0)), to_epoch(datetime(2016, 7, 15, 23, 30)),
+                           to_epoch(datetime(2016, 7, 17, 12, 0))])
+        sketches = sketches_by_day(TimeSeries.from_readings(epochs, [10.0, 20.0, 30.0]))
+        self.assertEqual(sorted(sketches), [self.day(15), self.day(17)])
+        self.assertEqual(QuantileSketch.from_bytes(sketches[self.day(15)]).counts.tolist(),
+                         QuantileSketch.from_values([10.0, 20.0]).counts.tolist())
+        self.assertEqual(sketches_by_day(TimeSeries.empty()), {})
+
+    def test_chunks_are_lazy(self):
+        # The merged sketches are read in batches from an iterator that must not be materialized.
+        self.assertEqual(next(chunks(itertools.count(), 3)), [0, 1, 2])
+        self.assertEqual(list(chunks(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(chunks([])), [])
+
+    def day(self, day):
+        return to_epoch(datetime(2016, 7, day))
+
+
+class QuantileViewTest(DatasetTestCase):
+
+    def setUp(self):
+        super(QuantileViewTest, self).setUp()
+        write_dataset(self.data_dir, [(1, 'a1', 't1'), (2, 'a2', 't3')], {
+            1: [('2016-07-15 {:02d}:00:00'.format(hour), str(float(hour + 1))) for hour in range(24)],
+            2: [('2016-07-16 00:00:00', '1000.0')],
+        })
+        self.run_import()
+
+    def quantiles(self, **query):
+        response = self.client.get('/quantiles/', query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_quantiles(self):
+        data = self.quantiles(q='0,0.5,1')
+        self.assertEqual(data['count'], 25)
+        self.assertEqual(data['relative_accuracy'], RELATIVE_ACCURACY)
+        self.assertAlmostEqual(data['quantiles']['0.5'], 13.0, delta=13.0 * RELATIVE_ACCURACY)
+        self.assertAlmostEqual(data['quantiles']['1.0'], 1000.0, delta=1000.0 * RELATIVE_ACCURACY)
+        self.assertEqual(set(self.quantiles()['quantiles']), {'0.5', '0.9', '0.95', '0.99'})
+
+    def test_filters(self):
+        self.assertEqual(self.quantiles(area='a1')['count'], 24)
+        self.assertEqual(self.quantiles(user='2')['count'], 1)
+        self.assertEqual(self.quantiles(area='a3')['count'], 0)
+        self.assertIsNone(self.quantiles(area='a3')['quantiles']['0.5'])
+        self.assertEqual(self.quantiles(start='2016-07-16')['count'], 1)
+        self.assertEqual(self.quantiles(end='2016-07-16', q='1')['quantiles']['1.0'],
+                         self.quantiles(area='a1', q='1')['quantiles']['1.0'])
+        for query in ({'q': '2'}, {'q': 'median'}, {'user': 'x'}, {'start': '2016'}):
+            self.assertEqual(self.client.get('/quantiles/', query).status_code, 400)
+
+    def test_incremental_import_updates_sketches(self):
+        self.quantiles()
+        with open(os.path.join(self.data_dir, 'consumption', '2.csv'), 'a', newline='') as f:
+            f.write('2016-07-16 00:30:00,2000.0\r\n')
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=1)):
+            self.run_import(incremental=True)
+        self.assertEqual(self.quantiles(user='2')['count'], 2)
+
+
+TARIFFS = {
+    't1': {'class': 'consumption.billing.FlatTariff', 'rate': 0.5, 'standing_charge': 1.0},
+    't2': {'class': 'consumption.billing.TimeOfUseTariff', 'bands': [['07:00', '23:00', 2.0], ['23:00', '07:00', 1.0]]},
+}
+SUPPLY_COST = {'class': 'consumption.billing.FlatTariff', 'rate': 0.1}
+
+
+class TariffTest(TestCase):
+
+    def matrix(self, readings):
+        """A ``Matrix`` of ``{user_id: [(datetime, Wh)]}``."""
+        return Matrix.from_series({
+            user_id: TimeSeries.from_readings([to_epoch(moment) for moment, value in rows],
+                                              [value for moment, value in rows])
+            for user_id, rows in readings.items()
+        })
+
+    def setUp(self):
+        self.readings = self.matrix({
+            1: [(datetime(2016, 7, 15, 6, 30), 1000.0), (datetime(2016, 7, 15, 17, 0), 3000.0),
+                (datetime(2016, 8, 1, 0, 0), 500.0)],
+            2: [(datetime(2016, 8, 2, 23, 30), 2000.0)],
+        })
+
+    def test_flat(self):
+        months, kwh, charges, present = FlatTariff(0.5, standing_charge=1.0).price(self.readings)
+        self.assertEqual(months.tolist(), [to_epoch(datetime(2016, 7, 1)), to_epoch(datetime(2016, 8, 1))])
+        self.assertEqual(kwh.tolist(), [[4.0, 0.5], [0.0, 2.0]])
+        self.assertEqual(present.tolist(), [[True, True], [False, True]])
+        self.assertEqual(charges.tolist(), [[3.0, 1.25], [0.0, 2.0]])
+
+    def test_time_of_use(self):
+        tariff = TimeOfUseTariff([['07:00', '16:00', 0.2], ['16:00', '19:00', 0.4], ['19:00', '07:00', 0.1]])
+        charges = tariff.price(self.readings)[2]
+        np.testing.assert_allclose(charges, [[0.1 + 1.2, 0.05], [0.0, 0.2]])
+        with self.assertRaises(ValueError):
+            TimeOfUseTariff([['07:00', '16:00', 0.2]])
+        with self.assertRaises(ValueError):
+            TimeOfUseTariff([['07:15', '07:00', 0.2]])
+
+    def test_tiered(self):
+        tariff = TieredTariff([[1, 1.0], [3, 0.5], [None, 0.1]])
+        np.testing.assert_allclose(tariff.price(self.readings)[2], [[1.0 + 1.0 + 0.1, 0.5], [0.0, 1.5]])
+        with self.assertRaises(ValueError):
+            TieredTariff([[1, 1.0]])
+
+
+@override_settings(CONSUMPTION_TARIFFS=TARIFFS, CONSUMPTION_SUPPLY_COST=SUPPLY_COST)
+class BillingTest(DatasetTestCase):
+
+    def setUp(self):
+        super(BillingTest, self).setUp()
+        self.users = [(1, 'a1', 't1'), (2, 'a1', 't2'), (3, 'a2', 't9')]
+        write_dataset(self.data_dir, self.users, {
+            1: [('2016-07-31 23:30:00', '1000.0'), ('2016-08-01 00:00:00', '2000.0')],
+            2: [('2016-07-31 06:30:00', '1000.0'), ('2016-07-31 12:00:00', '1000.0')],
+            3: [('2016-07-31 00:00:00', '7.0')],
+        })
+        self.run_import()
+
+    def bills(self):
+        return {
+            (bill.user_id, bill.month.isoformat()): tuple(
+                round(value, 6) for value in (bill.consumption, bill.total_bill, bill.total_cost))
+            for bill in MonthlyStatistics.objects.all()
+        }
+
+    def test_import_bills_users(self):
+        self.assertEqual(self.bills(), {
+            (1, '2016-07-01'): (1.0, 1.5, 0.1),
+            (1, '2016-08-01'): (2.0, 2.0, 0.2),
+            (2, '2016-07-01'): (2.0, 3.0, 0.2),
+        })
+        response = self.client.get('/detail/1/')
+        self.assertEqual([bill.month.month for bill in response.context['bills']], [7, 8])
+        self.assertContains(response, 'Monthly bills')
+
+    def test_incremental_import_and_tariff_change(self):
+        with open(os.path.join(self.data_dir, 'consumption', '1.csv'), 'a', newline='') as f:
+            f.write('2016-08-01 00:30:00,4000.0\r\n')
+        self.users[1] = (2, 'a1', 't1')
+        write_dataset(self.data_dir, self.users, {})
+        self.run_import(incremental=True)
+        self.assertEqual(self.bills()[1, '2016-08-01'], (6.0, 4.0, 0.6))
+        self.assertEqual(self.bills()[2, '2016-07-01'], (2.0, 2.0, 0.2))
+
+    def test_appended_readings_bill_only_their_months(self):
+        july = MonthlyStatistics.objects.get(user=1, month=date(2016, 7, 1)).pk
+        self.append(1, [('2016-08-01 00:30:00', '4000.0')])
+        self.run_import(incremental=True)
+        self.assertEqual(MonthlyStatistics.objects.get(user=1, month=date(2016, 7, 1)).pk, july)
+        self.assertEqual(self.bills()[1, '2016-08-01'], (6.0, 4.0, 0.6))
+
+    def test_change_to_undefined_tariff_drops_bills(self):
+        self.users[0] = (1, 'a1', 't9')
+        write_dataset(self.data_dir, self.users, {})
+        self.run_import(incremental=True)
+        self.assertEqual(sorted(self.bills()), [(2, '2016-07-01')])
+        self.assertFalse(self.client.get('/detail/1/').context['bills'])
+
+    def test_bill_command(self):
+        tariffs = dict(TARIFFS, t2={'class': 'consumption.billing.FlatTariff', 'rate': 1.0})
+        with self.settings(CONSUMPTION_TARIFFS=tariffs):
+            out, err = StringIO(), StringIO()
+            call_command('bill', tariffs=['t2', 't9'], stdout=out, stderr=err)
+        self.assertIn('Billed 1 user months', out.getvalue())
+        self.assertIn('1 users have a tariff which is not in CONSUMPTION_TARIFFS', err.getvalue())
+        self.assertEqual(self.bills()[2, '2016-07-01'], (2.0, 2.0, 0.2))
+        self.assertEqual(self.bills()[1, '2016-07-01'], (1.0, 1.5, 0.1))
+
+    def test_writes_change_the_data_version(self):
+        versions = [data_version()]
+        call_command('bill', stdout=StringIO(), stderr=StringIO())
+        versions.append(data_version())
+        call_command('import', data_dir=self.data_dir, rebuild_rollups=True, stdout=StringIO())
+        versions.append(data_version())
+        self.users[1] = (2, 'a2', 't1')
+        write_dataset(self.data_dir, self.users, {})
+        self.run_import(incremental=True)
+        versions.append(data_version())
+        self.run_import(incremental=True)
+        versions.append(data_version())
+        self.assertEqual(len(set(versions)), 4)
+        self.assertEqual(versions[-1], versions[-2])
+
+
+class AggregationTest(DatasetTestCase):
+
+    def setUp(self):
+        super(AggregationTest, self).setUp()
+        write_dataset(self.data_dir, [(1, 'a1', 't1'), (2, 'a1', 't1'), (3, 'a2', 't3')], {
+            1: [('2016-07-31 23:30:00', '10.0'), ('2016-08-01 00:00:00', '20.0'), ('2016-08-01 00:30:00', '1.0')],
+            2: [('2016-07-31 00:00:00', '5.0')],
+            3: [('2016-07-31 00:00:00', '7.0')],
+        })
+        self.run_import()
+
+    def test_bucket_of(self):
+        monday = to_epoch(datetime(2016, 8, 1))
+        self.assertEqual(bucket_of([monday + 6 * DAY + 1], 'week').tolist(), [monday])
+        self.assertEqual(bucket_of([monday - 1], 'week').tolist(), [monday - 7 * DAY])
+        self.assertEqual(bucket_of([monday + 20 * DAY], 'month').tolist(), [monday])
+        self.assertEqual(bucket_of([monday + 5400], 'hour').tolist(), [monday + 3600])
+        with self.assertRaises(ValueError):
+            bucket_of([monday], 'year')
+
+    def test_matrix_resample(self):
+        matrix = Matrix.from_series(get_storage().all_series([1, 2]))
+        self.assertEqual(matrix.values.shape, (2, 50))
+        buckets, totals, counts = matrix.resample('day')
+        self.assertEqual([from_epoch(b).day for b in buckets], [31, 1])
+        self.assertEqual(totals.tolist(), [[10.0, 21.0], [5.0, 0.0]])
+        self.assertEqual(counts.tolist(), [[1, 2], [1, 0]])
+
+    def test_aggregate_users(self):
+        aggregate = aggregate_users(User.objects.all(), 'hour', chunk_size=2)
+        self.assertEqual(aggregate.total.tolist(), [12.0, 10.0, 21.0])
+        self.assertEqual(aggregate.users.tolist(), [2, 1, 1])
+        self.assertEqual(aggregate.groups[('a2', 't3')].total.tolist(), [7.0])
+        self.assertEqual(aggregate.groups[('a1', 't1')].count.tolist(), [1, 1, 2])
+
+    def test_rollups_match_series(self):
+        for period in ('day', 'month'):
+            expected = aggregate_users(User.objects.all(), period)
+            aggregate = summarize(period)
+            for name in ('buckets', 'total', 'count', 'users'):
+                self.assertEqual(getattr(aggregate, name).tolist(), getattr(expected, name).tolist())
+            self.assertEqual(set(aggregate.groups), set(expected.groups))
+            self.assertEqual(
+                aggregate.groups[('a1', 't1')].total.tolist(), expected.groups[('a1', 't1')].total.tolist())
+
+    def test_summarize_unknown_period(self):
+        with self.assertRaises(ValueError):
+            summarize('year')
+
+
+class ViewTest(DatasetTestCase):
+
+    def setUp(self):
+        super(ViewTest, self).setUp()
+        write_dataset(self.data_dir, [(1, 'a1', 't1'), (2, 'a2', 't3')], {
+            1: [('2016-07-15 00:00:00', '39.0'), ('2016-07-16 00:30:00', '147.0')],
+            2: [('2016-07-15 00:00:00', '11.0')],
+        })
+        self.run_import()
+
+    def day(self, value):
+        return to_epoch(datetime.strptime(value, '%Y-%m-%d'))
+
+    def test_summary(self):
+        response = self.client.get('/summary/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([group['total'] for group in response.context['groups']], [186.0, 11.0])
+        self.assertContains(response, '/detail/2/')
+        self.assertContains(response, '/summary/chart/')
+        self.assertEqual(self.client.get('/summary/', {'period': 'year'}).status_code, 400)
+
+    def test_summary_chart(self):
+        chart = self.client.get('/summary/chart/').json()
+        self.assertEqual(chart['x'], [self.day('2016-07-15'), self.day('2016-07-16')])
+        self.assertEqual(chart['series'], {'total': [50.0, 147.0], 'average': [25.0, 147.0]})
+
+    def test_summary_chart_period_and_range(self):
+        chart = self.client.get('/summary/chart/', {'period': 'hour', 'start': '2016-07-16'}).json()
+        self.assertEqual(chart['x'], [self.day('2016-07-16')])
+        self.assertEqual(chart['series']['total'], [147.0])
+        chart = self.client.get('/summary/chart/', {'end': '2016-07-16'}).json()
+        self.assertEqual(chart['series']['total'], [50.0])
+        for query in ({'period': 'year'}, {'points': 'many'}, {'method': 'random'}, {'start': '2016-07'}):
+            self.assertEqual(self.client.get('/summary/chart/', query).status_code, 400)
+
+    def test_chart_is_cached_until_next_import(self):
+        self.client.get('/summary/chart/')
+        with mock.patch('consumption.views.summarize') as summarize:
+            self.client.get('/summary/chart/')
+            summarize.assert_not_called()
+            with open(os.path.join(self.data_dir, 'consumption', '2.csv'), 'a', newline='') as f:
+                f.write('2016-07-17 00:00:00,1.0\r\n')
+            with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=1)):
+                self.run_import(incremental=True)
+            self.client.get('/summary/chart/')
+            summarize.assert_called_once_with('day', None, None)
+
+    def test_detail(self):
+        response = self.client.get('/detail/1/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['series'].total(), 186.0)
+        self.assertContains(response, 't1')
+        self.assertContains(response, '/detail/1/chart/')
+        self.assertEqual(self.client.get('/detail/3/').status_code, 404)
+
+    def test_detail_chart(self):
+        chart = self.client.get('/detail/1/chart/', {'period': 'month'}).json()
+        self.assertEqual(chart, {'x': [self.day('2016-07-01')], 'series': {'total': [186.0]}, 'size': 1})
+        chart = self.client.get('/detail/1/chart/', {'period': 'half_hour', 'points': 3}).json()
+        self.assertEqual(chart['series']['total'], [39.0, 147.0])
+        self.assertEqual(self.client.get('/detail/3/chart/').status_code, 404)
+
+
+class ExportTest(DatasetTestCase):
+
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        write_dataset(self.data_dir, [(1, 'a1', 't1'), (2, 'a2', 't3'), (3, 'a2', 't3')], {
+            1: [('2016-07-15 00:00:00', '39.0'), ('2016-07-16 00:30:00', '147.5')],
+            2: [('2016-07-15 00:00:00', '11.0')],
+        })
+        self.run_import()
+
+    def export(self, **query):
+        response = self.client.get('/export/', query)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        self.assertEqual(self.export().decode('utf-8').splitlines(), [
+            'user_id,datetime,consumption',
+            '1,2016-07-15 00:00:00,39.0',
+            '1,2016-07-16 00:30:00,147.5',
+            '2,2016-07-15 00:00:00,11.0',
+        ])
+
+    def test_ndjson(self):
+        lines = self.export(format='ndjson').decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines][1],
+                         {'user_id': 1, 'datetime': '2016-07-16 00:30:00', 'consumption': 147.5})
+        self.assertEqual(len(lines), 3)
+
+    def test_filters(self):
+        def rows(**query):
+            return [line.split(',')[:2] for line in self.export(**query).decode('utf-8').splitlines()[1:]]
+        self.assertEqual(rows(user='2,3'), [['2', '2016-07-15 00:00:00']])
+        self.assertEqual(rows(area='a1', tariff='t1'), [['1', '2016-07-15 00:00:00'], ['1', '2016-07-16 00:30:00']])
+        self.assertEqual(rows(area='a1', tariff='t3'), [])
+        self.assertEqual(rows(start='2016-07-16'), [['1', '2016-07-16 00:30:00']])
+        self.assertEqual(rows(end='2016-07-16'), [['1', '2016-07-15 00:00:00'], ['2', '2016-07-15 00:00:00']])
+        for query in ({'format': 'xml'}, {'user': 'one'}, {'start': '2016-07'}):
+            self.assertEqual(self.client.get('/export/', query).status_code, 400)
+
+    def test_gzip(self):
+        response = self.client.get('/export/', {'gzip': '1'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.export())
+
+    def test_users_are_read_in_batches(self):
+        with mock.patch('consumption.export.USERS_PER_QUERY', 1), \
+                mock.patch.object(get_storage().__class__, 'all_series', autospec=True,
+                                  side_effect=get_storage().__class__.all_series) as all_series:
+            self.export()
+        self.assertEqual([call[0][1] for call in all_series.call_args_list], [[1], [2], [3]])
+
+
+@override_settings(CONSUMPTION_STORAGE='consumption.storage.RowStorage')
+class RowStorageExportTest(ExportTest):
+    pass
+
+
+class DownsamplingTest(TestCase):
+
+    def setUp(self):
+        self.x = np.arange(1000)
+        self.y = np.sin(self.x / 50.0)
+        self.y[321] = 5
+        self.y[654] = -5
+
+    def test_lttb_keeps_ends_and_peaks(self):
+        kept = lttb(self.x, self.y, 50)
+        self.assertEqual(len(kept), 50)
+        self.assertEqual((kept[0], kept[-1]), (0, 999))
+        self.assertIn(321, kept)
+        self.assertIn(654, kept)
+        self.assertTrue(np.all(np.diff(kept) > 0))
+
+    def test_minmax_keeps_extremes(self):
+        kept = minmax(self.y, 50)
+        self.assertLessEqual(len(kept), 50)
+        self.assertIn(321, kept)
+        self.assertIn(654, kept)
+
+    def test_short_series_is_unchanged(self):
+        self.assertEqual(downsample(self.x[:10], self.y[:10], 50).tolist(), list(range(10)))
+        with self.assertRaises(ValueError):
+            downsample(self.x, self.y, 50, method='random')
+
+
+class CreateDatasetTest(DatasetTestCase):
+
+    def create_dataset(self, **options):
+        out = StringIO()
+        call_command('create_dataset', data_dir=self.data_dir, yes=True, stdout=out, **options)
+        return out.getvalue()
+
+    def test_generated_files_import(self):
+        out = self.create_dataset(users=3, days=2, start='2016-03-01', first_id=10, seed=1)
+        self.assertIn('Wrote 288 readings of 3 users', out)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.data_dir, 'consumption'))),
+                         ['10.csv', '11.csv', '12.csv'])
+        self.assertIn('288 readings from 3 files', self.run_import())
+        readings = self.readings(11)
+        self.assertEqual(len(readings), 96)
+        self.assertEqual(readings[0][0], '00:00')
+        self.assertTrue(all(value >= 0 for moment, value in readings))
+
+    def test_seed_is_reproducible(self):
+        contents = []
+        for _ in range(2):
+            self.create_dataset(users=2, days=1, seed=7)
+            with open(os.path.join(self.data_dir, 'consumption', '3001.csv')) as f:
+                contents.append(f.read())
+        self.assertEqual(contents[0], contents[1])
+
+    def test_existing_dataset_is_kept_unless_confirmed(self):
+        self.create_dataset(users=1, days=1)
+        with mock.patch('builtins.input', return_value='no'):
+            call_command('create_dataset', data_dir=self.data_dir, users=2, days=1, stdout=StringIO())
+        self.assertEqual(os.listdir(os.path.join(self.data_dir, 'consumption')), ['3000.csv'])
+
+    def test_default_dir_is_not_the_data_dir(self):
+        synthetic_dir = os.path.join(self.data_dir, 'synthetic')
+        with self.settings(DATA_DIR=self.data_dir, SYNTHETIC_DATA_DIR=synthetic_dir):
+            out = StringIO()
+            call_command('create_dataset', users=1, days=1, yes=True, stdout=out)
+        self.assertIn('manage.py import --data-dir {}'.format(synthetic_dir), out.getvalue())
+        self.assertEqual(sorted(os.listdir(self.data_dir)), ['synthetic'])
+        self.assertEqual(os.listdir(os.path.join(synthetic_dir, 'consumption')), ['3000.csv'])
+
+
+class BenchmarkTest(TestCase):
+
+    def test_run(self):
+        results = benchmark.run(sizes=[2], days=2, repeat=2)
+        by_name = {result['name']: result for result in results}
+        self.assertEqual(by_name['import']['rows'], 2 * 96)
+        self.assertIn('summary chart half_hour', by_name)
+        self.assertIn('detail chart month', by_name)
+        for result in results:
+            self.assertEqual(result['size'], 2)
+            self.assertLessEqual(result['p50'], result['p99'])
+            self.assertGreater(result['peak_memory'], 0)
+        # The data version (2 queries), then the rollups, users and group rollups.
+        self.assertEqual(by_name['summary']['queries'], 5)
+
+    def test_compare(self):
+        baseline = [
+            {'name': 'summary', 'size': 10, 'p50': 10.0, 'queries': 3},
+            {'name': 'detail', 'size': 10, 'p50': 10.0, 'queries': 2},
+            {'name': 'import', 'size': 10, 'p50': 1000.0, 'queries': 20},
+        ]
+        results = [
+            {'name': 'summary', 'size': 10, 'p50': 11.0, 'queries': 3},
+            {'name': 'detail', 'size': 10, 'p50': 9.0, 'queries': 3},
+            {'name': 'import', 'size': 10, 'p50': 1500.0, 'queries': 20},
+            {'name': 'import', 'size': 100, 'p50': 9000.0, 'queries': 20},
+        ]
+        rows = compare(baseline, results)
+        self.assertEqual([(row[0]['name'], row[3]) for row in rows],
+                         [('summary', False), ('detail', True), ('import', True)])
+        self.assertAlmostEqual(rows[2][2], 1.5)
+
+
+class ProfilingTest(DatasetTestCase):
+
+    def setUp(self):
+        super(ProfilingTest, self).setUp()
+        write_dataset(self.data_dir, [(1, 'a1', 't1')], {1: [('2016-07-15 00:00:00', '39.0')]})
+        self.run_import()
+        profiling.STATS.clear()
+        self.addCleanup(profiling.STATS.clear)
+        self.staff = get_user_model().objects.create_user('staff', is_staff=True)
+
+    def stats(self):
+        self.client.force_login(self.staff)
+        return self.client.get('/profiling/').json()
+
+    def server_timing(self, response):
+        return dict(
+            (metric.split(';')[0], metric.split(';')[1]) for metric in response['Server-Timing'].split(', '))
+
+    def test_disabled_by_default(self):
+        self.assertNotIn('Server-Timing', self.client.get('/summary/'))
+        self.assertEqual(self.stats()['views'], {})
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_server_timing(self):
+        response = self.client.get('/summary/')
+        timing = self.server_timing(response)
+        self.assertEqual(set(timing), {'total', 'sql', 'template', 'render'})
+        self.assertIn('desc="5 queries"', response['Server-Timing'])
+        self.assertNotEqual(timing['template'], 'dur=0.0')
+
+        timing = self.server_timing(self.client.get('/summary/chart/'))
+        self.assertEqual(timing['template'], 'dur=0.0')
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_stats(self):
+        for _ in range(3):
+            self.client.get('/summary/')
+        self.client.get('/detail/1/')
+        views = self.stats()['views']
+        summary = views['summary']
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(sum(summary['histogram'].values()), 3)
+        # 5 queries, then 2 for the data version once the page data is cached.
+        self.assertEqual(summary['mean']['queries'], 3)
+        self.assertLessEqual(summary['p50'], summary['max'])
+        self.assertEqual(len(summary['slowest_queries']), 5)
+        self.assertIn('SELECT', summary['slowest_queries'][0]['sql'])
+        self.assertEqual(views['detail']['count'], 1)
+
+    @override_settings(PROFILING_SAMPLE_RATE=0.5)
+    def test_sampling(self):
+        with mock.patch('common.profiling.random.random', side_effect=[0.2, 0.7]):
+            self.assertIn('Server-Timing', self.client.get('/summary/'))
+            self.assertNotIn('Server-Timing', self.client.get('/summary/'))
+
+    def test_stats_require_staff(self):
+        self.assertEqual(self.client.get('/profiling/').status_code, 404)
+
+
+class JobTest(DatasetTestCase):
+
+    def setUp(self):
+        super(JobTest, self).setUp()
+        write_dataset(self.data_dir, [(1, 'a1', 't1'), (2, 'a2', 't3')], {
+            1: [('2016-07-15 00:00:00', '39.0'), ('2016-07-16 00:30:00', '147.5')],
+            2: [('2016-07-15 00:00:00', '11.0')],
+        })
+        job_settings = self.settings(
+            DATA_DIR=self.data_dir, CONSUMPTION_JOB_WORKERS=0,
+            CONSUMPTION_EXPORT_DIR=os.path.join(self.data_dir, 'exports'))
+        job_settings.enable()
+        self.addCleanup(job_settings.disable)
+        self.client.force_login(get_user_model().objects.create_user('staff', is_staff=True))
+
+    def submit(self, kind, **params):
+        return self.client.post('/jobs/', dict(params, kind=kind))
+
+    def run_jobs(self):
+        return jobs.get_runner().run_pending()
+
+    def job(self, job_id):
+        return self.client.get('/jobs/{}/'.format(job_id)).json()
+
+    def test_import(self):
+        response = self.submit('import')
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertEqual((job['kind'], job['status'], job['params']), ('import', 'pending', {'incremental': False}))
+        self.assertEqual(self.run_jobs(), 1)
+        job = self.job(job['id'])
+        self.assertEqual((job['status'], job['progress']), ('done', 1.0))
+        self.assertEqual(job['result']['rows'], 3)
+        self.assertEqual(self.readings(2), [('00:00', 11.0)])
+        self.assertEqual(UserRollup.objects.get(user_id=1).total, 186.5)
+
+    def test_identical_pending_jobs_are_not_duplicated(self):
+        first = self.submit('import', incremental='1').json()
+        response = self.submit('import', incremental='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], first['id'])
+        self.assertEqual(self.submit('import').status_code, 202)
+        self.assertEqual(self.run_jobs(), 2)
+        self.assertEqual(self.submit('import', incremental='1').status_code, 202)
+
+    def test_only_one_identical_job_can_be_pending(self):
+        job, created = jobs.submit('import')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Job.objects.create(kind=Job.IMPORT, key=job.key, pending_key=job.key)
+        # A request which missed the pending job still gets it back.
+        self.assertEqual(jobs.submit('import'), (job, False))
+        jobs.cancel(job)
+        self.assertTrue(jobs.submit('import')[1])
+
+    def test_list(self):
+        self.submit('import')
+        self.submit('rebuild_rollups')
+        self.run_jobs()
+        self.submit('import')
+        listed = self.client.get('/jobs/').json()['jobs']
+        self.assertEqual([(job['kind'], job['status']) for job in listed],
+                         [('import', 'pending'), ('rebuild_rollups', 'done'), ('import', 'done')])
+        listed = self.client.get('/jobs/', {'status': 'done', 'limit': 1}).json()['jobs']
+        self.assertEqual([job['kind'] for job in listed], ['rebuild_rollups'])
+
+    def test_invalid_jobs(self):
+        self.assertEqual(self.submit('delete').status_code, 400)
+        self.assertEqual(self.submit('export', format='xml').status_code, 400)
+        self.assertEqual(self.client.get('/jobs/', {'limit': 'all'}).status_code, 400)
+        self.assertEqual(self.client.get('/jobs/1/').status_code, 404)
+        self.assertFalse(Job.objects.exists())
+
+    def test_staff_only(self):
+        self.client.logout()
+        self.assertEqual(self.submit('import').status_code, 404)
+        self.assertEqual(self.client.get('/jobs/').status_code, 404)
+
+    def test_export(self):
+        self.run_import()
+        job = self.submit('export', format='csv', user='2', gzip='1').json()
+        self.assertEqual(self.client.get('/jobs/{}/download/'.format(job['id'])).status_code, 404)
+        self.run_jobs()
+        self.assertEqual(self.job(job['id'])['result'], {'users': 1, 'size': mock.ANY})
+        response = self.client.get('/jobs/{}/download/'.format(job['id']))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)).decode('utf-8').splitlines(),
+                         ['user_id,datetime,consumption', '2,2016-07-15 00:00:00,11.0'])
+
+    def test_cancel_pending(self):
+        job = self.submit('import').json()
+        response = self.client.post('/jobs/{}/cancel/'.format(job['id']))
+        self.assertEqual(response.json()['status'], 'cancelled')
+        self.assertEqual(self.run_jobs(), 0)
+        self.assertEqual(self.client.post('/jobs/{}/cancel/'.format(job['id'])).status_code, 409)
+        self.assertEqual(self.client.get('/jobs/{}/cancel/'.format(job['id'])).status_code, 405)
+
+    def test_cancel_running_rebuild_rolls_back(self):
+        self.run_import()
+        job = self.submit('rebuild_rollups').json()
+        rebuild = jobs.rebuild_rollups
+
+        def cancelled_rebuild(storage, progress):
+            def cancel(done, total):
+                self.assertEqual(self.job(job['id'])['status'], 'running')
+                self.client.post('/jobs/{}/cancel/'.format(job['id']))
+                progress(done, total)
+            rebuild(storage, batch_size=1, progress=cancel)
+
+        with mock.patch('consumption.jobs.rebuild_rollups', side_effect=cancelled_rebuild):
+            self.run_jobs()
+        self.assertEqual(self.job(job['id'])['status'], 'cancelled')
+        self.assertEqual(UserRollup.objects.count(), 2)
+        self.assertEqual(UserDayRollup.objects.filter(user_id=2).count(), 1)
+
+    def test_failed_job(self):
+        with mock.patch('consumption.jobs.run_import', side_effect=OSError('No such file')):
+            job = self.submit('import').json()
+            self.run_jobs()
+        job = self.job(job['id'])
+        self.assertEqual((job['status'], job['message']), ('failed', 'OSError: No such file'))
+
+    def test_one_writing_job_at_a_time(self):
+        Job.objects.create(kind=Job.IMPORT, key='other', status=Job.RUNNING, worker='elsewhere:1')
+        self.submit('rebuild_rollups')
+        export = self.submit('export').json()
+        self.assertEqual(self.run_jobs(), 1)
+        self.assertEqual(self.job(export['id'])['status'], 'done')
+        self.assertTrue(Job.objects.filter(kind=Job.REBUILD_ROLLUPS, status=Job.PENDING).exists())
+
+    def test_interrupted_jobs_are_requeued(self):
+        job = Job.objects.create(kind=Job.IMPORT, params='{"incremental": false}', key='k', status=Job.RUNNING,
+                                 started_at=timezone.now(), worker='elsewhere:1')
+        self.assertTrue(jobs._alive(jobs._worker_name()))
+        with mock.patch('consumption.jobs._alive', return_value=False):
+            call_command('runjobs', once=True, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+
+    def test_interrupted_job_identical_to_a_pending_one_is_cancelled(self):
+        pending, created = jobs.submit('import')
+        job = Job.objects.create(kind=Job.IMPORT, params=pending.params, key=pending.key, status=Job.RUNNING,
+                                 started_at=timezone.now(), worker='elsewhere:1')
+        with mock.patch('consumption.jobs._alive', return_value=False):
+            jobs.requeue_interrupted()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.CANCELLED)
+        self.assertEqual(Job.objects.filter(status=Job.PENDING).get(), pending)
+
+    def test_jobs_of_a_dead_process_do_not_block_writing_jobs(self):
+        job = Job.objects.create(kind=Job.IMPORT, params='{"incremental": false}', key='k', status=Job.RUNNING,
+                                 started_at=timezone.now(), worker='elsewhere:1')
+        self.submit('rebuild_rollups')
+        with mock.patch('consumption.jobs._alive', return_value=False):
+            self.assertEqual(self.run_jobs(), 2)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+
+    def test_summary_serves_the_last_snapshot(self):
+        self.run_import()
+        self.assertEqual(self.client.get('/summary/').context['rows'][0]['total'], 186.5)
+        Job.objects.create(kind=Job.IMPORT, key='k', status=Job.RUNNING, started_at=timezone.now(),
+                           data_version=data_version())
+        UserRollup.objects.filter(user_id=1).update(total=1.0)
+        self.assertEqual(self.client.get('/summary/').context['rows'][0]['total'], 186.5)
+
+        # A cold cache serves the last result built from complete data.
+        cache.clear()
+        self.assertEqual(self.client.get('/summary/').context['rows'][0]['total'], 186.5)
+
+        # What is built while the job writes is not cached.
+        caches['snapshots'].clear()
+        self.assertEqual(self.client.get('/summary/').context['rows'][0]['total'], 1.0)
+        UserRollup.objects.filter(user_id=1).update(total=2.0)
+        self.assertEqual(self.client.get('/summary/').context['rows'][0]['total'], 2.0)
+
+        Job.objects.filter(status=Job.RUNNING).update(status=Job.DONE, finished_at=timezone.now())
+        self.assertEqual(self.client.get('/summary/').context['rows'][0]['total'], 2.0)
+        UserRollup.objects.filter(user_id=1).update(total=3.0)
+        self.assertEqual(self.client.get('/summary/').context['rows'][0]['total'], 2.0)
+
+
+class CrossProcessJobTest(TransactionTestCase):
+    # Other connections stand for other processes, and only see committed data.
+
+    def claim_in_thread(self, claimed):
+        def run():
+            try:
+                claimed.append(jobs.JobRunner()._claim())
+            finally:
+                connection.close()
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+
+    def test_one_writing_job_runs_across_processes(self):
+        for kind in (Job.IMPORT, Job.REBUILD_ROLLUPS):
+            Job.objects.create(kind=kind, key=kind, pending_key=kind)
+        claimed = []
+        writing_job_runs = jobs.writing_job_runs
+        checks = []
+
+        def stale_check():
+            # Another runner claims a job between this runner's check and its claim.
+            checks.append(None)
+            if len(checks) == 1:
+                self.claim_in_thread(claimed)
+                return False
+            return writing_job_runs()
+        with mock.patch('consumption.jobs.writing_job_runs', side_effect=stale_check):
+            claimed.append(jobs.JobRunner()._claim())
+        self.assertEqual([job.kind if job else None for job in claimed], [Job.IMPORT, None])
+        self.assertEqual(Job.objects.filter(status=Job.RUNNING).count(), 1)
+        self.assertTrue(Job.objects.filter(kind=Job.REBUILD_ROLLUPS, status=Job.PENDING).exists())
+
+    def test_rebuild_sees_cancellation_from_another_process(self):
+        User.objects.create(id=1, area='a1', tariff='t1')
+        job, created = jobs.submit('rebuild_rollups')
+        Job.objects.filter(id=job.id).update(cancel_requested=True)
+        with mock.patch('consumption.jobs.SAVE_INTERVAL', 0):
+            self.assertTrue(jobs.JobRunner().run_next())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.CANCELLED)
+
+
+class SQLiteTest(TestCase):
+
+    def test_pragmas_on_new_connections(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        wrapper = DatabaseWrapper(dict(
+            connection.settings_dict, NAME=os.path.join(directory, 'db.sqlite3'),
+            PRAGMAS=[('journal_mode', 'wal'), ('synchronous', 'normal'), ('temp_store', 'memory')]))
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            values = []
+            for name in ('journal_mode', 'synchronous', 'temp_store'):
+                cursor.execute('PRAGMA {}'.format(name))
+                values.append(cursor.fetchone()[0])
+        self.assertEqual(values, ['wal', 1, 2])
+
+    def test_router(self):
+        router = ReadReplicaRouter()
+        with override_settings(SQLITE_READ_ALIAS='replica'):
+            # Test cases run in a transaction, which must see its own writes.
+            self.assertEqual(router.db_for_read(User), 'default')
+            with mock.patch.object(connection, 'in_atomic_block', False):
+                self.assertEqual(router.db_for_read(User), 'replica')
+        self.assertEqual(router.db_for_write(User), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'consumption'))
+
+    def test_loadtest(self):
+        process = mock.Mock(returncode=0)
+        process.poll.side_effect = [None, None, 0, 0, 0, 0, 0]
+        with mock.patch('consumption.loadtest.subprocess.Popen', return_value=process) as popen, \
+                mock.patch('consumption.loadtest._read', side_effect=self.fake_read):
+            result = loadtest.run(['/summary/'], readers=1, baseline=0.01, import_args=['--workers', '1'])
+        self.assertEqual(popen.call_args[0][0][-3:], ['import', '--workers', '1'])
+        self.assertEqual(result['during_import']['count'], 2)
+        self.assertEqual(result['errors'], ['OperationalError: database is locked'] * 2)
+        self.assertEqual(result['import_returncode'], 0)
+
+    @staticmethod
+    def fake_read(paths, until, seconds, errors):
+        while not until():
+            seconds.append(0.01)
+        errors.append('OperationalError: database is locked')
@@ -3,6 +3,16 @@ from . import views
 
 urlpatterns = [
     url(r'^$', views.summary),
-    url(r'^summary/', views.summary),
-    url(r'^detail/', views.detail),
+    url(r'^summary/$', views.summary, name='summary'),
+    url(r'^summary/chart/$', views.summary_chart, name='summary_chart'),
+    url(r'^summary/profile/$', views.summary_profile, name='summary_profile'),
+    url(r'^detail/(?P<user_id>[0-9]+)/$', views.detail, name='detail'),
+    url(r'^detail/(?P<user_id>[0-9]+)/chart/$', views.detail_chart, name='detail_chart'),
+    url(r'^detail/(?P<user_id>[0-9]+)/profile/$', views.detail_profile, name='detail_profile'),
+    url(r'^quantiles/$', views.quantiles, name='quantiles'),
+    url(r'^export/$', views.export, name='export'),
+    url(r'^jobs/$', views.job_list, name='job_list'),
+    url(r'^jobs/(?P<job_id>[0-9]+)/$', views.job_detail, name='job_detail'),
+    url(r'^jobs/(?P<job_id>[0-9]+)/cancel/$', views.job_cancel, name='job_cancel'),
+    url(r'^jobs/(?P<job_id>[0-9]+)/download/$', views.job_download, name='job_download'),
 ]
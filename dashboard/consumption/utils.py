@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from itertools import islice
+
+# SQLite refuses queries with more than 999 parameters.
+MAX_IN_PARAMS = 500
+
+
+def chunks(items, size=MAX_IN_PARAMS):
+    """Split ``items`` into lists of at most ``size`` elements.
+
+    ``items`` is consumed lazily, so an iterator is never held in memory at once.
+    """
+    items = iter(items)
+    chunk = list(islice(items, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(items, size))
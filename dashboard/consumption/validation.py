@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+"""Parsing and validation of the consumption files in one pass.
+
+``parse_lines`` turns a block of complete lines into arrays with numpy: the
+fixed-width datetimes and the values are decoded from the bytes directly,
+for every line at once. Lines which do not have the usual shape (no
+``\\r``, an exponent, surrounding spaces...) go through ``parse_datetime``
+and ``float`` one by one, and lines which fail there are reported and
+skipped rather than failing the import. So are readings dated outside
+``settings.CONSUMPTION_READING_RANGE``: one row in year 9999 would
+otherwise stretch the series and the report over millions of slots.
+
+A ``QualityReport`` is updated block after block and keeps a few counters
+and one flag per 30 minute slot between the first and the last reading,
+whatever the number of rows. It finds:
+
+* bad rows, which are skipped;
+* readings off the 30 minute cadence, which are skipped too;
+* duplicates, of which the last reading is kept;
+* rows out of order (earlier than a row above them);
+* gaps: runs of missing slots between the first and the last reading.
+
+``parse_file`` reads a file in blocks of ``BLOCK_SIZE`` bytes, so the bytes
+held at once do not grow with the file; ``validate_file`` does the same and
+only keeps the report, for ``manage.py import --validate-only``.
+``fill_gaps`` interpolates the readings of short gaps.
+"""
+from __future__ import unicode_literals
+
+import calendar
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+
+from consumption.series import DTYPE, INTERVAL, format_epochs
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+BLOCK_SIZE = 1024 * 1024
+MAX_EXAMPLES = 10
+# Longest value decoded by the vectorized path; a float64 holds 15 digits exactly.
+MAX_VALUE_WIDTH = 17
+MAX_DIGITS = 15
+
+_DIGITS = np.array([0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18])
+_SEPARATORS = np.array([4, 7, 10, 13, 16, 19])
+_SEPARATOR_BYTES = np.frombuffer(b'-- ::,', dtype=np.uint8)
+_MONTH_DAYS = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+def parse_datetime(value):
+    """Parse a ``DATETIME_FORMAT`` string.
+
+    ``datetime.strptime`` dominates the import time, so the fixed-width
+    fields are sliced out directly; the constructor still rejects
+    out-of-range values.
+    """
+    if len(value) != 19 or value[4] != '-' or value[7] != '-' or value[10] != ' ':
+        raise ValueError('{!r} does not match {!r}'.format(value, DATETIME_FORMAT))
+    return datetime(
+        int(value[0:4]), int(value[5:7]), int(value[8:10]),
+        int(value[11:13]), int(value[14:16]), int(value[17:19]))
+
+
+def reading_range():
+    """Epochs ``(lowest, highest)``, from the first day of ``settings.CONSUMPTION_READING_RANGE`` to before the last."""
+    return tuple(
+        calendar.timegm(datetime.strptime(day, '%Y-%m-%d').timetuple())
+        for day in settings.CONSUMPTION_READING_RANGE)
+
+
+def _number(digits, columns):
+    """The integer written in the ``columns`` of ``digits`` (a rows x 19 array of digit values)."""
+    number = np.zeros(len(digits), dtype=np.int64)
+    for column in columns:
+        number = number * 10 + digits[:, column]
+    return number
+
+
+def _epochs(year, month, day, hour, minute, second):
+    """Epochs of UTC dates and times, with the days-from-civil algorithm."""
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    days = era * 146097 + day_of_era - 719468
+    return days * 86400 + hour * 3600 + minute * 60 + second
+
+
+def _parse_fast(buf, starts, stops):
+    """``(epochs, values, ok)`` of the lines ``buf[starts:stops]`` of the usual shape, decoded at once.
+
+    The bytes stay ``uint8``: subtracting ``'0'`` wraps anything below it
+    around, so ``<= 9`` alone tells digits apart.
+    """
+    lengths = stops - starts
+    ok = (lengths >= 21) & (lengths <= 20 + MAX_VALUE_WIDTH)
+    last = len(buf) - 1
+
+    chars = buf[np.minimum(starts[:, None] + np.arange(20), last)]
+    digits = chars - np.uint8(48)
+    ok &= (digits[:, _DIGITS] <= 9).all(axis=1)
+    ok &= (chars[:, _SEPARATORS] == _SEPARATOR_BYTES).all(axis=1)
+    year, month, day = _number(digits, (0, 1, 2, 3)), _number(digits, (5, 6)), _number(digits, (8, 9))
+    hour, minute, second = _number(digits, (11, 12)), _number(digits, (14, 15)), _number(digits, (17, 18))
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    month_days = _MONTH_DAYS[np.clip(month - 1, 0, 11)] + ((month == 2) & leap)
+    ok &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= month_days) & (year >= 1)
+    ok &= (hour < 24) & (minute < 60) & (second < 60)
+    epochs = _epochs(year, month, day, hour, minute, second)
+
+    # The digits form an integer mantissa, built column by column; dividing
+    # it by a power of ten rounds once, like float() does.
+    width = np.where(ok, lengths - 20, 0)
+    chars = buf[np.minimum(starts[:, None] + 20 + np.arange(MAX_VALUE_WIDTH), last)]
+    negative = chars[:, 0] == ord('-')
+    mantissa = np.zeros(len(chars), dtype=np.int64)
+    digit_count = np.zeros(len(chars), dtype=np.int64)
+    decimals = np.zeros(len(chars), dtype=np.int64)
+    dots = np.zeros(len(chars), dtype=np.int64)
+    for column in range(MAX_VALUE_WIDTH):
+        inside = column < width
+        if not inside.any():
+            break
+        digit = chars[:, column] - np.uint8(48)
+        is_digit = inside & (digit <= 9)
+        is_dot = inside & (chars[:, column] == ord('.'))
+        ok &= is_digit | is_dot | ~inside | (negative if column == 0 else False)
+        mantissa = np.where(is_digit, mantissa * 10 + digit, mantissa)
+        digit_count += is_digit
+        decimals += is_digit & (dots > 0)
+        dots += is_dot
+    ok &= (dots <= 1) & (digit_count >= 1) & (digit_count <= MAX_DIGITS)
+    values = mantissa / 10.0 ** decimals
+    values[negative] *= -1
+    return epochs, values, ok
+
+
+def _parse_slow(line):
+    """``(epoch, value)`` of one line, like the import always parsed it; raises ``ValueError``."""
+    try:
+        text = line.decode('ascii')
+    except UnicodeDecodeError:
+        raise ValueError('not ASCII')
+    moment, value = text.split(',')
+    return calendar.timegm(parse_datetime(moment).timetuple()), float(value)
+
+
+def parse_lines(data, first_line=1):
+    """Parse ``data``, complete lines of ``datetime,consumption`` without the header.
+
+    Returns ``(epochs, values, line_numbers, bad_rows)`` in file order;
+    ``bad_rows`` lists ``(line number, error)`` of the lines skipped. Blank
+    lines are ignored. Values which are not finite and datetimes outside
+    ``reading_range()`` count as bad rows.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(buf == ord('\n'))
+    if not len(ends):
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.int64), []
+    starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.int64)
+    stops = ends - ((ends > starts) & (buf[np.maximum(ends - 1, 0)] == ord('\r')))
+    line_numbers = first_line + np.arange(len(ends))
+
+    epochs, values, ok = _parse_fast(buf, starts, stops)
+    bad_rows = []
+    for index in np.flatnonzero(~ok).tolist():
+        line = data[starts[index]:stops[index]].strip()
+        if not line:
+            continue
+        try:
+            epochs[index], values[index] = _parse_slow(line)
+        except (ValueError, OverflowError) as e:
+            bad_rows.append((int(line_numbers[index]), str(e)))
+            continue
+        if not np.isfinite(values[index]):
+            bad_rows.append((int(line_numbers[index]), 'not a finite number'))
+            continue
+        ok[index] = True
+
+    lowest, highest = reading_range()
+    outside = ok & ((epochs < lowest) | (epochs >= highest))
+    if outside.any():
+        error = 'not between {} and {}'.format(*settings.CONSUMPTION_READING_RANGE)
+        bad_rows = sorted(bad_rows + [(line, error) for line in line_numbers[outside].tolist()])
+        ok &= ~outside
+    return epochs[ok], values[ok], line_numbers[ok], bad_rows
+
+
+def fill_gaps(epochs, values, max_slots):
+    """Sorted unique ``(epochs, values)`` with the gaps of at most ``max_slots`` interpolated.
+
+    Returns ``(epochs, values, filled)``. A gap is filled linearly between
+    the readings around it.
+    """
+    if max_slots <= 0 or len(epochs) < 2:
+        return epochs, values, 0
+    slots = (epochs - epochs[0]) // INTERVAL
+    steps = np.diff(slots)
+    short = (steps > 1) & (steps <= max_slots + 1)
+    if not short.any():
+        return epochs, values, 0
+    missing = np.concatenate([
+        np.arange(start + 1, start + step) for start, step in zip(slots[:-1][short].tolist(), steps[short].tolist())])
+    filled = np.interp(missing, slots, values).astype(values.dtype)
+    order = np.argsort(np.concatenate((slots, missing)), kind='mergesort')
+    all_slots = np.concatenate((slots, missing))[order]
+    return epochs[0] + all_slots * INTERVAL, np.concatenate((values, filled))[order], len(missing)
+
+
+class QualityReport(object):
+    """Quality of the rows read from one consumption file, updated block by block.
+
+    ``previous`` is the epoch of the last reading imported from the file
+    before ``offset``, when only what was appended is read: rows up to it
+    are out of order, and a gap after it is counted.
+    """
+
+    def __init__(self, user_id, offset=0, previous=None):
+        self.user_id = user_id
+        self.offset = offset
+        self.previous = previous
+        self.rows = 0
+        self.duplicates = 0
+        self.out_of_order = 0
+        self.unaligned = 0
+        self.negative = 0
+        self.bad_rows = 0
+        self.examples = []
+        self.filled = 0
+        self._latest = previous
+        self._base = None
+        self._seen = np.zeros(0, dtype=bool)
+        self._first = self._last = None
+        if previous is not None:
+            self._mark(np.array([previous // INTERVAL]))
+
+    def _mark(self, slots):
+        """Flag ``slots`` as seen; returns how many already were."""
+        low, high = int(slots.min()), int(slots.max())
+        if self._base is None:
+            self._base = low
+        if low < self._base:
+            self._seen = np.concatenate((np.zeros(self._base - low, dtype=bool), self._seen))
+            self._base = low
+        if high - self._base >= len(self._seen):
+            grown = np.zeros(max(high - self._base + 1, 2 * len(self._seen)), dtype=bool)
+            grown[:len(self._seen)] = self._seen
+            self._seen = grown
+        indices = slots - self._base
+        unique = np.unique(indices)
+        already = len(indices) - len(unique) + int(self._seen[unique].sum())
+        self._seen[unique] = True
+        return already
+
+    def add(self, epochs, values, line_numbers, bad_rows):
+        """Account for a block from ``parse_lines``; returns its ``(epochs, values)`` on the cadence."""
+        self.rows += len(epochs) + len(bad_rows)
+        self.bad_rows += len(bad_rows)
+        aligned = epochs % INTERVAL == 0
+        self.unaligned += int((~aligned).sum())
+        if len(self.examples) < MAX_EXAMPLES:
+            cadence = 'not on the {} minute cadence'.format(INTERVAL // 60)
+            examples = bad_rows + [(line, cadence) for line in line_numbers[~aligned][:MAX_EXAMPLES].tolist()]
+            for line, error in sorted(examples)[:MAX_EXAMPLES - len(self.examples)]:
+                self.examples.append({'line': line, 'error': error})
+
+        epochs, values = epochs[aligned], values[aligned]
+        if not len(epochs):
+            return epochs, values
+
+        latest = np.maximum.accumulate(epochs)
+        before = np.concatenate(([self._latest if self._latest is not None else epochs[0]], latest[:-1]))
+        self.out_of_order += int((epochs < before).sum())
+        self._latest = int(latest[-1]) if self._latest is None else max(self._latest, int(latest[-1]))
+        self.duplicates += self._mark(epochs // INTERVAL)
+        self.negative += int((values < 0).sum())
+        low, high = int(epochs.min()), int(epochs.max())
+        self._first = low if self._first is None else min(self._first, low)
+        self._last = high if self._last is None else max(self._last, high)
+        return epochs, values
+
+    def gaps(self):
+        """``(start epoch, missing slots)`` of each run of missing slots, after ``previous`` if any."""
+        if self._first is None:
+            return []
+        first = self._first if self.previous is None else self.previous
+        seen = self._seen[first // INTERVAL - self._base:self._last // INTERVAL - self._base + 1]
+        # Both ends are seen, so the flag changes at the start and at the end of each gap in turn.
+        edges = (np.flatnonzero(seen[1:] != seen[:-1]) + 1).tolist()
+        return [(first + start * INTERVAL, stop - start) for start, stop in zip(edges[0::2], edges[1::2])]
+
+    def issues(self):
+        """The counters of the problems found, for totals over many files."""
+        gaps = self.gaps()
+        return {
+            'bad_rows': self.bad_rows,
+            'unaligned': self.unaligned,
+            'duplicates': self.duplicates,
+            'out_of_order': self.out_of_order,
+            'gaps': len(gaps),
+            'missing': sum(missing for start, missing in gaps),
+        }
+
+    def as_json(self):
+        gaps = self.gaps()
+        readings = int(self._seen.sum()) - (self.previous is not None)
+        first, last = format_epochs([self._first, self._last]) if self._first is not None else (None, None)
+        return {
+            'user_id': self.user_id,
+            'offset': self.offset,
+            'rows': self.rows,
+            'readings': readings,
+            'first': first,
+            'last': last,
+            'missing': sum(missing for start, missing in gaps),
+            'gaps': {
+                'count': len(gaps),
+                'longest': max([missing for start, missing in gaps] or [0]),
+                'list': [
+                    {'start': start, 'missing': missing}
+                    for start, missing in zip(format_epochs([start for start, missing in gaps[:MAX_EXAMPLES]]),
+                                              [missing for start, missing in gaps[:MAX_EXAMPLES]])],
+            },
+            'duplicates': self.duplicates,
+            'out_of_order': self.out_of_order,
+            'unaligned': self.unaligned,
+            'negative': self.negative,
+            'bad_rows': {'count': self.bad_rows, 'examples': self.examples},
+            'filled': self.filled,
+        }
+
+
+def last_readings(epochs, values):
+    """Sorted unique epochs, each with its last value."""
+    unique, index = np.unique(epochs[::-1], return_index=True)
+    return unique, values[::-1][index]
+
+
+def read_blocks(f, block_size=BLOCK_SIZE):
+    """Yield the complete lines of ``f`` from its position, about ``block_size`` bytes at a time.
+
+    A partial last line is left out.
+    """
+    rest = b''
+    for block in iter(lambda: f.read(block_size), b''):
+        block = rest + block
+        end = block.rfind(b'\n') + 1
+        block, rest = block[:end], block[end:]
+        if block:
+            yield block
+
+
+def parse_file(f, report, header=True, block_size=BLOCK_SIZE):
+    """``(epochs, values, length)`` of the complete lines of ``f`` from its position, updating ``report``.
+
+    The readings are sorted and unique; ``length`` is the number of bytes
+    of complete lines read, header included. Only one block of bytes is held
+    at a time.
+    """
+    line, length = 1, 0
+    if header:
+        first = f.readline()
+        if not first.endswith(b'\n'):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=DTYPE), 0
+        line, length = 2, len(first)
+    all_epochs, all_values = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=DTYPE)]
+    for block in read_blocks(f, block_size):
+        epochs, values, line_numbers, bad_rows = parse_lines(block, line)
+        epochs, values = report.add(epochs, values, line_numbers, bad_rows)
+        all_epochs.append(epochs)
+        all_values.append(values.astype(DTYPE))
+        line += block.count(b'\n')
+        length += len(block)
+    epochs, values = last_readings(np.concatenate(all_epochs), np.concatenate(all_values))
+    return epochs, values, length
+
+
+def validate_file(path, user_id, report_dir=None, block_size=BLOCK_SIZE):
+    """The report of a whole file, read ``block_size`` bytes at a time without keeping the readings.
+
+    The report is also written to ``report_dir``, if given, and a partial
+    last line is left out like the import does.
+    """
+    report = QualityReport(user_id)
+    with open(path, 'rb') as f:
+        f.readline()
+        line = 2
+        for block in read_blocks(f, block_size):
+            epochs, values, line_numbers, bad_rows = parse_lines(block, line)
+            report.add(epochs, values, line_numbers, bad_rows)
+            line += block.count(b'\n')
+    if report_dir:
+        write_report(report_dir, report)
+    return report
+
+
+def write_report(report_dir, report):
+    os.makedirs(report_dir, exist_ok=True)
+    path = os.path.join(report_dir, '{}.json'.format(report.user_id))
+    with open(path + '.tmp', 'w') as f:
+        json.dump(report.as_json(), f, indent=1)
+    os.replace(path + '.tmp', path)
@@ -1,19 +1,278 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.shortcuts import render
+import functools
+import hashlib
+import json
+import os
+from datetime import datetime
 
-# Create your views here.
+from django.conf import settings
+from django.db import OperationalError
+from django.http import FileResponse, Http404, HttpResponseBadRequest, JsonResponse
+from django.shortcuts import get_object_or_404, render
+from django.views.decorators.http import require_http_methods, require_POST
+
+from consumption import export as exports
+from consumption import jobs
+from consumption.aggregation import PERIODS, Matrix, summarize
+from consumption.charts import DEFAULT_POINTS, MAX_POINTS, cached, cached_chart, chart_data
+from consumption.downsampling import METHODS
+from consumption.models import Job, User, UserRollup
+from consumption.profiles import LoadProfile, group_profile, user_profile
+from consumption.series import INTERVAL, from_epoch, to_epoch
+from consumption.sketches import RELATIVE_ACCURACY, merged_sketch
+from consumption.storage import get_storage
+
+
+def _period(request):
+    return request.GET.get('period', 'day')
+
+
+def _chart_parameters(request):
+    """``(period, start, end, points, method)`` from the query string.
+
+    ``start`` and ``end`` are ``YYYY-MM-DD`` dates (end excluded), returned as
+    epochs. Raises ``ValueError`` for invalid values.
+    """
+    period = _period(request)
+    if period not in PERIODS:
+        raise ValueError('Unknown period.')
+    start, end = (
+        to_epoch(datetime.strptime(request.GET[name], '%Y-%m-%d')) if request.GET.get(name) else None
+        for name in ('start', 'end'))
+    points = min(max(int(request.GET.get('points', DEFAULT_POINTS)), 3), MAX_POINTS)
+    method = request.GET.get('method', 'lttb')
+    if method not in METHODS:
+        raise ValueError('Unknown method.')
+    return period, start, end, points, method
 
 
 def summary(request):
+    """Users and groups as of the last completed import or rebuild, see ``consumption.charts.snapshot``."""
+    period = _period(request)
+    if period not in PERIODS:
+        return HttpResponseBadRequest('Unknown period.')
+
+    def build():
+        rollups = {rollup.user_id: rollup for rollup in UserRollup.objects.all()}
+        rows = []
+        for user in User.objects.order_by('id'):
+            rollup = rollups.get(user.id)
+            rows.append({
+                'id': user.id,
+                'area': user.area,
+                'tariff': user.tariff,
+                'total': rollup and rollup.total,
+                'mean': rollup and rollup.mean,
+            })
+
+        groups = []
+        for (area, tariff), group in sorted(summarize('month').groups.items()):
+            total = float(group.total.sum())
+            groups.append({'area': area, 'tariff': tariff, 'total': total, 'mean': total / group.count.sum()})
+        return {'rows': rows, 'groups': groups}
+
     context = {
-        'message': 'Hello!',
+        'period': period,
+        'periods': PERIODS,
+        'jobs': settings.DEBUG or request.user.is_staff,
     }
+    context.update(cached('summary', (), build))
     return render(request, 'consumption/summary.html', context)
 
 
-def detail(request):
+def summary_chart(request):
+    """Total consumption and average consumption per user, downsampled."""
+    try:
+        period, start, end, points, method = _chart_parameters(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    def build():
+        aggregate = summarize(period, start, end)
+        return chart_data(
+            aggregate.buckets, [('total', aggregate.total), ('average', aggregate.user_mean)], points, method)
+
+    return JsonResponse(cached_chart('summary', period, start, end, points, method, build))
+
+
+def detail(request, user_id):
+    user = get_object_or_404(User, pk=user_id)
+    period = _period(request)
+    if period not in PERIODS:
+        return HttpResponseBadRequest('Unknown period.')
+    series = get_storage().series(user.id)
+    profile = user_profile(user.id)
+
     context = {
+        'user': user,
+        'period': period,
+        'periods': PERIODS,
+        'series': series,
+        'daily_means': profile.daily_means() if profile else [],
+        'bills': user.monthly_statistics.order_by('month'),
+        'first': from_epoch(series.start) if len(series) else None,
+        'last': from_epoch(series.end - INTERVAL) if len(series) else None,
     }
     return render(request, 'consumption/detail.html', context)
+
+
+def detail_chart(request, user_id):
+    """Consumption of one user, downsampled."""
+    user = get_object_or_404(User, pk=user_id)
+    try:
+        period, start, end, points, method = _chart_parameters(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    def build():
+        series = get_storage().series(user.id, start, end)
+        aggregate = Matrix.from_series({user.id: series}).aggregate(period)
+        return chart_data(aggregate.buckets, [('total', aggregate.total)], points, method)
+
+    name = 'user-{}'.format(user.id)
+    return JsonResponse(cached_chart(name, period, start, end, points, method, build))
+
+
+def detail_profile(request, user_id):
+    """Mean reading per half hour of the day, by weekday and by month, of one user."""
+    user = get_object_or_404(User, pk=user_id)
+    profile = user_profile(user.id) or LoadProfile.empty()
+    return JsonResponse(profile.as_json())
+
+
+def summary_profile(request):
+    """Mean reading per half hour of the day of the users of ``area`` and ``tariff`` (default: all)."""
+    profile, users = group_profile(request.GET.get('area') or None, request.GET.get('tariff') or None)
+    data = profile.as_json()
+    data['users'] = users
+    return JsonResponse(data)
+
+
+def quantiles(request):
+    """Approximate quantiles of the half-hourly readings, see ``consumption.sketches``.
+
+    ``q`` lists the quantiles (default ``0.5,0.9,0.95,0.99``); users and
+    dates are selected like for an export, by whole days.
+    """
+    try:
+        fractions = [float(q) for q in request.GET.get('q', '0.5,0.9,0.95,0.99').split(',') if q]
+        if not fractions or not all(0 <= q <= 1 for q in fractions):
+            raise ValueError
+    except ValueError:
+        return HttpResponseBadRequest('q must be comma separated numbers between 0 and 1.')
+    try:
+        user_ids = None
+        if any(request.GET.get(name) for name in ('user', 'area', 'tariff')):
+            user_ids = list(exports.selected_users(request.GET).values_list('id', flat=True))
+        start, end = exports.date_range(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    def build():
+        sketch = merged_sketch(user_ids, start, end)
+        return {
+            'count': sketch.count,
+            'relative_accuracy': RELATIVE_ACCURACY,
+            'quantiles': {repr(q): sketch.quantile(q) for q in fractions},
+        }
+
+    users = hashlib.md5(repr(user_ids).encode('utf-8')).hexdigest()
+    return JsonResponse(cached('quantiles', (users, start, end, ','.join(repr(q) for q in fractions)), build))
+
+
+def export(request):
+    """Readings of the selected users as streamed CSV or NDJSON, see ``consumption.export``."""
+    try:
+        params = exports.parameters(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return exports.export_response(params)
+
+
+def _staff_or_debug(view):
+    """404 unless the user is staff or ``DEBUG`` is on, like ``common.profiling.stats``."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.DEBUG and not request.user.is_staff:
+            raise Http404
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def _busy_database(view):
+    """503 instead of a server error while a job holds the SQLite write lock for too long."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except OperationalError as e:
+            if 'database is locked' not in str(e):
+                raise
+            response = JsonResponse({'error': 'The database is busy, retry later.'}, status=503)
+            response['Retry-After'] = '5'
+            return response
+    return wrapper
+
+
+@_staff_or_debug
+@_busy_database
+@require_http_methods(['GET', 'POST'])
+def job_list(request):
+    """The latest jobs, or a new job from ``kind`` and its parameters (POST), see ``consumption.jobs``.
+
+    ``status`` filters the list and ``limit`` (default 20) caps it. A job
+    identical to a pending one is not added; the pending one is returned,
+    with 200 instead of 202.
+    """
+    jobs.get_runner().start()
+    if request.method == 'POST':
+        try:
+            job, created = jobs.submit(request.POST.get('kind'), request.POST)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        return JsonResponse(jobs.as_json(job), status=202 if created else 200)
+
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+    except ValueError:
+        return HttpResponseBadRequest('limit must be a number.')
+    queryset = Job.objects.order_by('-id')
+    if request.GET.get('status'):
+        queryset = queryset.filter(status=request.GET['status'])
+    return JsonResponse({'jobs': [jobs.as_json(job) for job in queryset[:limit]]})
+
+
+@_staff_or_debug
+@_busy_database
+def job_detail(request, job_id):
+    jobs.get_runner().start()
+    return JsonResponse(jobs.as_json(get_object_or_404(Job, pk=job_id)))
+
+
+@_staff_or_debug
+@_busy_database
+@require_POST
+def job_cancel(request, job_id):
+    """Cancel a job; 409 if it had already finished."""
+    job = get_object_or_404(Job, pk=job_id)
+    cancelled = jobs.cancel(job)
+    job.refresh_from_db()
+    return JsonResponse(jobs.as_json(job), status=200 if cancelled else 409)
+
+
+@_staff_or_debug
+def job_download(request, job_id):
+    """The file written by a finished export job."""
+    job = get_object_or_404(Job, pk=job_id, kind=Job.EXPORT, status=Job.DONE)
+    path = jobs.export_path(job)
+    if not os.path.exists(path):
+        raise Http404
+    params = json.loads(job.params)
+    fmt = params.get('format', 'csv')
+    response = FileResponse(open(path, 'rb'), content_type=exports.FORMATS[fmt])
+    if path.endswith('.gz'):
+        response['Content-Encoding'] = 'gzip'
+    response['Content-Disposition'] = 'attachment; filename="consumption.{}"'.format(fmt)
+    return response
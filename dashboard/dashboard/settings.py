@@ -11,10 +11,18 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 """
 
 import os
+import sys
+from urllib.request import pathname2url
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# The code shared by the dashboard and the frontend (common/) is at the root
+# of the repository.
+ROOT_DIR = os.path.dirname(BASE_DIR)
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/1.11/howto/deployment/checklist/
@@ -37,10 +45,11 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'consumption',
+    'consumption.apps.ConsumptionConfig',
 ]
 
 MIDDLEWARE = [
+    'common.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,6 +59,10 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Fraction of the requests profiled by ProfilingMiddleware, 0 disables it.
+# See common/profiling.py; the summary is served at /profiling/.
+PROFILING_SAMPLE_RATE = 0
+
 ROOT_URLCONF = 'dashboard.urls'
 
 TEMPLATES = [
@@ -81,6 +94,38 @@ DATABASES = {
     }
 }
 
+# Production SQLite, see common/sqlite.py. SQLITE_PRODUCTION=1 in the
+# environment runs the PRAGMAS below on every connection and keeps
+# connections open between requests; SQLITE_READ_REPLICA=1 also sends reads
+# outside of transactions to a read-only connection.
+
+SQLITE_PRODUCTION = os.environ.get('SQLITE_PRODUCTION') == '1'
+SQLITE_READ_ALIAS = 'replica'
+
+if SQLITE_PRODUCTION:
+    DATABASES['default'].update(
+        CONN_MAX_AGE=600,
+        PRAGMAS=[
+            ('journal_mode', 'wal'),
+            # Durable at each checkpoint rather than each commit; never corrupts in WAL mode.
+            ('synchronous', 'normal'),
+            ('cache_size', -64 * 1024),  # KiB
+            ('mmap_size', 256 * 1024 * 1024),
+            ('temp_store', 'memory'),
+        ],
+    )
+
+    if os.environ.get('SQLITE_READ_REPLICA') == '1':
+        DATABASES[SQLITE_READ_ALIAS] = dict(
+            DATABASES['default'],
+            NAME='file:{}?mode=ro'.format(pathname2url(DATABASES['default']['NAME'])),
+            OPTIONS={'uri': True},
+            # The journal mode is stored in the file, and set by the writable connection.
+            PRAGMAS=DATABASES['default']['PRAGMAS'][1:],
+            TEST={'MIRROR': 'default'},
+        )
+        DATABASE_ROUTERS = ['common.sqlite.ReadReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
@@ -119,3 +164,78 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.11/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Challenge data (user_data.csv and consumption/<user_id>.csv)
+
+DATA_DIR = os.path.join(ROOT_DIR, 'data')
+
+# Where manage.py create_dataset writes synthetic data, apart from DATA_DIR.
+
+SYNTHETIC_DATA_DIR = os.path.join(DATA_DIR, 'synthetic')
+
+# Where readings are stored, see consumption/storage.py
+
+CONSUMPTION_STORAGE = 'consumption.storage.ArrayStorage'
+
+# Parsed consumption files, see consumption/csvcache.py. None disables the
+# cache; least recently used entries are evicted over CONSUMPTION_CACHE_SIZE bytes.
+
+CONSUMPTION_CACHE_DIR = os.path.join(BASE_DIR, 'cache')
+CONSUMPTION_CACHE_SIZE = 256 * 1024 * 1024
+
+# Where the import writes the quality report of each consumption file, see
+# consumption/validation.py. None writes no report.
+
+CONSUMPTION_QUALITY_DIR = os.path.join(BASE_DIR, 'quality')
+
+# Readings dated outside these days (the last one excluded) are bad rows.
+
+CONSUMPTION_READING_RANGE = ('2000-01-01', '2100-01-01')
+
+# Tariffs of user_data.csv and the cost of the supplied energy, see
+# consumption/billing.py. Rates are per kWh and standing charges per month.
+
+CONSUMPTION_TARIFFS = {
+    't1': {'class': 'consumption.billing.FlatTariff', 'rate': 0.25, 'standing_charge': 8.0},
+    't2': {
+        'class': 'consumption.billing.TimeOfUseTariff',
+        'bands': [['00:00', '07:00', 0.12], ['07:00', '16:00', 0.24], ['16:00', '19:00', 0.38],
+                  ['19:00', '00:00', 0.24]],
+        'standing_charge': 8.0,
+    },
+    't3': {
+        'class': 'consumption.billing.TieredTariff',
+        'tiers': [[100, 0.18], [400, 0.26], [None, 0.32]],
+        'standing_charge': 5.0,
+    },
+}
+CONSUMPTION_SUPPLY_COST = {
+    'class': 'consumption.billing.TimeOfUseTariff',
+    'bands': [['00:00', '07:00', 0.06], ['07:00', '16:00', 0.14], ['16:00', '19:00', 0.22],
+              ['19:00', '00:00', 0.14]],
+    'standing_charge': 3.0,
+}
+
+# Background jobs, see consumption/jobs.py: threads running them in each
+# process (0 leaves them to manage.py runjobs), and where exports are written.
+
+CONSUMPTION_JOB_WORKERS = 2
+CONSUMPTION_EXPORT_DIR = os.path.join(BASE_DIR, 'exports')
+
+# The last result of each chart built from complete data, served while a job
+# writes, see consumption/charts.py. It is kept on disk, so it outlives a
+# restart and is shared by the processes of one host.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'snapshots': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'snapshots'),
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+CONSUMPTION_SNAPSHOT_CACHE = 'snapshots'
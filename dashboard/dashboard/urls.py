@@ -16,7 +16,10 @@ Including another URLconf
 from django.conf.urls import url, include
 from django.contrib import admin
 
+from common import profiling
+
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
+    url(r'^profiling/$', profiling.stats),
     url(r'^', include('consumption.urls'))
 ]
@@ -0,0 +1,104 @@
+"""Benchmarks of the ``api/`` endpoints on generated datasets.
+
+Every benchmark is measured by ``common.benchmark.measure``, which also
+counts its SQL queries and the peak memory allocated by Python. The
+simulated delay of the statistics endpoints is patched out. The renderers
+of ``api.renderers`` are benchmarked on their own, encoding the same
+responses, with the size of what they produce.
+"""
+import gzip
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework.renderers import JSONRenderer
+
+from api.cache import get_cache
+from api.models import Consumer, MonthlyStatistics
+from api.renderers import (
+    ColumnarJSONRenderer, ColumnarMessagePackRenderer, FastJSONRenderer, MessagePackRenderer)
+from api.views import aggregate_statistics, filter_statistics, statistics_rows
+from common.benchmark import measure
+
+SIZES = (100, 1000)
+RENDERERS = (
+    ('json', JSONRenderer),
+    ('fast json', FastJSONRenderer),
+    ('msgpack', MessagePackRenderer),
+    ('columnar', ColumnarJSONRenderer),
+    ('columnar msgpack', ColumnarMessagePackRenderer),
+)
+
+
+def endpoints():
+    """``(name, url)`` of every ``GET`` endpoint, for the consumers in the database."""
+    ids = list(Consumer.objects.order_by('id').values_list('id', flat=True)[:50])
+    return [
+        ('consumer_types', '/api/consumer_types/'),
+        ('consumers', '/api/consumers/'),
+        ('consumers high', '/api/consumers/high'),
+        ('consumer', '/api/consumer/{}'.format(ids[0])),
+        ('monthly_statistics', '/api/monthly_statistics/{}'.format(ids[0])),
+        ('monthly_statistics year', '/api/monthly_statistics/{}?year=2017'.format(ids[0])),
+        ('monthly_statistics batch 50', '/api/monthly_statistics/?consumers={}'.format(
+            ','.join(str(i) for i in ids))),
+        ('monthly_statistics batch high', '/api/monthly_statistics/?consumer_type=high&year=2017'),
+        ('monthly_statistics batch high normalized',
+         '/api/monthly_statistics/?consumer_type=high&year=2017&shape=normalized'),
+        ('aggregate consumer_type month', '/api/aggregate/monthly_statistics/?group_by=consumer_type,year,month'),
+        ('aggregate consumer 50', '/api/aggregate/monthly_statistics/?group_by=consumer&consumers={}'.format(
+            ','.join(str(i) for i in ids))),
+    ]
+
+
+def benchmark_endpoints(size, repeat):
+    """Every endpoint with an empty response cache, and the cached ones warm."""
+    client = Client()
+    results = []
+    for name, url in endpoints():
+        def get(url=url):
+            response = client.get(url)
+            if response.status_code != 200:
+                raise AssertionError('{} returned {}'.format(url, response.status_code))
+        results.append(measure(name, size, get, repeat, before=get_cache().clear))
+        if name.startswith('consumers'):
+            results.append(measure(name + ' (cached)', size, get, repeat))
+    return results
+
+
+def payloads():
+    """``(name, data)`` of the responses the renderers encode."""
+    return [
+        ('statistics high', statistics_rows(filter_statistics({'consumer_type': Consumer.HIGH_VOLTAGE}))),
+        ('aggregate consumer', aggregate_statistics(MonthlyStatistics.objects.all(), ['consumer'])),
+    ]
+
+
+def benchmark_renderers(size, repeat):
+    """Encoding time of ``payloads`` by every renderer, with the ``bytes`` and ``gzip_bytes`` they produce."""
+    results = []
+    for payload, data in payloads():
+        for name, renderer_class in RENDERERS:
+            renderer = renderer_class()
+            result = measure('render {} {}'.format(payload, name), size, lambda: renderer.render(data), repeat)
+            content = renderer.render(data)
+            result.update(bytes=len(content), gzip_bytes=len(gzip.compress(content)))
+            results.append(result)
+    return results
+
+
+def run(sizes=SIZES, years=2, repeat=10, seed=0, log=None):
+    """Benchmark datasets of ``sizes`` consumers, each on an empty database."""
+    results = []
+    for size in sizes:
+        call_command('flush', interactive=False, verbosity=0)
+        call_command('create_dataset', consumers=size, years=years, seed=seed, yes=True, stdout=StringIO())
+        with override_settings(DEBUG=False, ALLOWED_HOSTS=['testserver']), \
+                mock.patch('api.views.time.sleep'):
+            for result in benchmark_endpoints(size, repeat) + benchmark_renderers(size, repeat):
+                results.append(result)
+                if log:
+                    log(result)
+    return results
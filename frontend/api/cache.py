@@ -0,0 +1,180 @@
+"""Response cache for read-heavy API views.
+
+Rendered responses are stored in the cache named by ``settings.API_CACHE``
+(an ``LRUCache`` in local memory unless configured otherwise). Every write to
+``Consumer`` or ``MonthlyStatistics`` replaces the data generation (see
+``api.signals``); cache keys and ETags contain the generation, so stale
+entries are never served and simply fall out of the cache.
+
+The generation is kept in ``settings.API_GENERATION_CACHE``, which every
+process serving the API must share, so that a write in one of them makes
+the responses cached by all the others stale: a file cache on a single
+host, memcached or Redis across hosts. The responses themselves may stay
+local to each process.
+"""
+import hashlib
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+# Entries and locks of each LRUCache by name: Django creates a cache
+# instance per thread, and they share the entries, like LocMemCache.
+_data = {}
+_locks = {}
+_setup_lock = threading.Lock()
+
+
+class LRUCache(BaseCache):
+    """Local-memory cache evicting the least recently used entries.
+
+    Django's ``LocMemCache`` culls arbitrary entries once ``MAX_ENTRIES`` is
+    reached; this one drops the entries which were read the longest time ago.
+    The threads of a process share the entries; processes do not.
+    """
+
+    def __init__(self, name, params):
+        super(LRUCache, self).__init__(params)
+        with _setup_lock:
+            self._data = _data.setdefault(name, OrderedDict())
+            self._lock = _locks.setdefault(name, threading.Lock())
+
+    def _get_live(self, key):
+        value, expires = self._data[key]
+        if expires is not None and expires <= time.time():
+            del self._data[key]
+            raise KeyError(key)
+        self._data.move_to_end(key)
+        return value
+
+    def _store(self, key, value, timeout):
+        expires = self.get_backend_timeout(timeout)
+        self._data[key] = (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self._max_entries:
+            self._data.popitem(last=False)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            try:
+                self._get_live(key)
+                return False
+            except KeyError:
+                self._store(key, value, timeout)
+                return True
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            try:
+                value = self._get_live(key)
+            except KeyError:
+                return default
+        return pickle.loads(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            self._store(key, value, timeout)
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            self._data.pop(key, None)
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            try:
+                self._get_live(key)
+                return True
+            except KeyError:
+                return False
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+GENERATION_KEY = 'api:generation'
+
+
+def get_cache():
+    return caches[settings.API_CACHE]
+
+
+def get_generation_cache():
+    return caches[settings.API_GENERATION_CACHE]
+
+
+def data_generation():
+    """``(generation, last_modified)`` of the API data.
+
+    ``generation`` is a random token replaced by ``invalidate``, and
+    ``last_modified`` the epoch at which it was created.
+    """
+    cache = get_generation_cache()
+    state = cache.get(GENERATION_KEY)
+    if state is None:
+        cache.add(GENERATION_KEY, (uuid.uuid4().hex, int(time.time())), None)
+        state = cache.get(GENERATION_KEY)
+    return state
+
+
+def invalidate():
+    """Make every cached response stale, in every process sharing the generation cache."""
+    get_generation_cache().set(GENERATION_KEY, (uuid.uuid4().hex, int(time.time())), None)
+
+
+class CachedResponseMixin(object):
+    """Serve ``GET`` from the response cache, with ``ETag`` and ``Last-Modified``.
+
+    Conditional requests matching the current data get a 304 without running
+    the view. Responses are cached per path, query string and ``Accept``
+    header.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super(CachedResponseMixin, self).dispatch(request, *args, **kwargs)
+
+        generation, last_modified = data_generation()
+        key = 'api:response:{}'.format(hashlib.md5('\n'.join([
+            generation, request.get_full_path(), request.META.get('HTTP_ACCEPT', ''),
+        ]).encode()).hexdigest())
+        etag = quote_etag(key.rsplit(':', 1)[1])
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            cache = get_cache()
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                response = super(CachedResponseMixin, self).dispatch(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                if hasattr(response, 'render'):
+                    response.render()
+                cache.set(key, (response.content, response['Content-Type']))
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ['Accept'])
+        return response
@@ -0,0 +1,65 @@
+"""Streaming export of the monthly statistics as CSV or NDJSON.
+
+Rows are read with ``QuerySet.iterator()``, which fetches them from the
+cursor in chunks instead of loading the whole result, and each chunk is
+formatted and sent before the next is fetched, so memory use does not grow
+with the size of the export.
+"""
+import csv
+import json
+from itertools import islice
+
+from django.http import StreamingHttpResponse
+from django.utils.text import compress_sequence
+
+ROWS_PER_CHUNK = 1000
+
+COLUMNS = ('id', 'consumer_id', 'consumer__name', 'consumer__consumer_type',
+           'year', 'month', 'consumption', 'total_bill', 'total_cost')
+HEADER = ('id', 'consumer', 'name', 'consumer_type', 'year', 'month', 'consumption', 'total_bill', 'total_cost')
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class Echo(object):
+    """File-like object returning what is written, for ``csv.writer``."""
+
+    def write(self, value):
+        return value
+
+
+def _chunks(stats):
+    rows = stats.values_list(*COLUMNS).iterator()
+    while True:
+        chunk = list(islice(rows, ROWS_PER_CHUNK))
+        if not chunk:
+            return
+        yield chunk
+
+
+def csv_chunks(stats):
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADER)
+    for chunk in _chunks(stats):
+        yield ''.join(writer.writerow(row) for row in chunk)
+
+
+def ndjson_chunks(stats):
+    for chunk in _chunks(stats):
+        yield ''.join(json.dumps(dict(zip(HEADER, row))) + '\n' for row in chunk)
+
+
+def export_response(stats, fmt='csv', gzip=False):
+    """A ``StreamingHttpResponse`` of ``stats`` in format ``fmt``."""
+    generate = csv_chunks if fmt == 'csv' else ndjson_chunks
+    content = (chunk.encode('utf-8') for chunk in generate(stats))
+    if gzip:
+        content = compress_sequence(content)
+    response = StreamingHttpResponse(content, content_type=FORMATS[fmt])
+    if gzip:
+        response['Content-Encoding'] = 'gzip'
+    response['Content-Disposition'] = 'attachment; filename="monthly_statistics.{}"'.format(fmt)
+    return response
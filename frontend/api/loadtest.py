@@ -0,0 +1,91 @@
+"""Load test of the ASGI entry point, run in-process without a server.
+
+``run`` starts ``slow`` statistics requests and, while they are in flight,
+sends ``fast`` requests to the consumer list, ``concurrency`` at a time. Their
+latency is compared with the same requests sent before the slow ones.
+"""
+import asyncio
+import time
+
+from api.models import Consumer
+from common.benchmark import percentile
+
+
+def _latencies(seconds):
+    seconds = sorted(seconds)
+    return {
+        'count': len(seconds),
+        'p50': percentile(seconds, 0.5) * 1000,
+        'p90': percentile(seconds, 0.9) * 1000,
+        'p99': percentile(seconds, 0.99) * 1000,
+        'max': seconds[-1] * 1000,
+    }
+
+
+async def request(application, path, method='GET', query_string=b'', body=b'', headers=()):
+    """Call ``application`` like an ASGI server would; returns ``(status, body, seconds)``."""
+    started = time.perf_counter()
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application({
+        'type': 'http',
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'query_string': query_string,
+        'headers': [(b'host', b'localhost')] + list(headers),
+        'server': ('localhost', 80),
+        'client': ('127.0.0.1', 50000),
+    }, receive, send)
+    content = b''.join(message.get('body', b'') for message in messages[1:])
+    return messages[0]['status'], content, time.perf_counter() - started
+
+
+async def _fast_requests(application, path, count, concurrency):
+    seconds = []
+    statuses = []
+    for offset in range(0, count, concurrency):
+        results = await asyncio.gather(*(
+            request(application, path) for _ in range(min(concurrency, count - offset))))
+        statuses.extend(status for status, content, elapsed in results)
+        seconds.extend(elapsed for status, content, elapsed in results)
+    return statuses, seconds
+
+
+async def _scenario(application, slow, fast, concurrency, fast_path, slow_path):
+    baseline_statuses, baseline = await _fast_requests(application, fast_path, fast, concurrency)
+
+    slow_requests = [asyncio.ensure_future(request(application, slow_path)) for _ in range(slow)]
+    # Let the slow requests reach their threads before measuring.
+    await asyncio.sleep(0.1)
+    statuses, loaded = await _fast_requests(application, fast_path, fast, concurrency)
+    slow_in_flight = sum(not future.done() for future in slow_requests)
+    slow_results = await asyncio.gather(*slow_requests)
+
+    return {
+        'fast_path': fast_path,
+        'slow_path': slow_path,
+        'baseline': _latencies(baseline),
+        'under_load': _latencies(loaded),
+        'slow': _latencies([elapsed for status, content, elapsed in slow_results]),
+        'slow_in_flight': slow_in_flight,
+        'statuses': sorted(set(baseline_statuses + statuses + [status for status, c, e in slow_results])),
+    }
+
+
+def run(application, slow=50, fast=200, concurrency=8, fast_path='/api/consumers/', slow_path=None):
+    """Run the load test on a new event loop; returns latencies in milliseconds."""
+    if slow_path is None:
+        slow_path = '/api/monthly_statistics/{}'.format(Consumer.objects.order_by('id').values_list('id', flat=True)[0])
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(_scenario(application, slow, fast, concurrency, fast_path, slow_path))
+    finally:
+        loop.close()
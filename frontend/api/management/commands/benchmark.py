@@ -0,0 +1,21 @@
+from api import benchmark
+from common.benchmark import BenchmarkCommand
+
+
+class Command(BenchmarkCommand):
+    help = 'Benchmark the api endpoints on generated datasets.'
+    project = 'frontend'
+    default_sizes = benchmark.SIZES
+    sizes_help = 'Comma separated numbers of consumers of the generated datasets.'
+    run_options = ('years', 'repeat')
+
+    def add_run_arguments(self, parser):
+        parser.add_argument(
+            '--years', type=int, default=2,
+            help='Number of years of monthly statistics per consumer.')
+        parser.add_argument(
+            '--repeat', type=int, default=10,
+            help='Number of requests per endpoint.')
+
+    def run(self, sizes, seed, log, **options):
+        return benchmark.run(sizes, seed=seed, log=log, **options)
@@ -1,50 +1,128 @@
 import random
+import time
+
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max
+
+from api.cache import invalidate
+from api.search import invalidate_index
 from api.models import Consumer, MonthlyStatistics
 
+FIRST_NAMES = [
+    'John', 'Tom', 'Mary', 'Tina', 'Anne', 'Joseph', 'Jim', 'Lily', 'Harry', 'Dianne',
+    'Olivia', 'Rose', 'Megan', 'Julia', 'Adam', 'Alan', 'Brandon', 'Brian', 'Cameron',
+    'Carl',  'Charles', 'Evan', 'Frank', 'Gavin'
+]
+
+LAST_NAMES = [
+    'Arnold', 'Avery', 'Baker', 'Bell', 'Bond', 'Carr', 'Clark', 'Davis', 'Duncan', 'Glover',
+    'Gibson', 'Hamilton', 'Hart', 'Jackson', 'Jones', 'Kerr', 'King', 'Miller', 'Nash', 'Nolan',
+    'Oliver', 'Page', 'Piper', 'Rees', 'Short', 'Skinner', 'Taylor', 'Watson', 'Young', 'Martin',
+    'May', 'Know', 'Lewis', 'Lee', 'Grey', 'Clinton', 'Dyer', 'Cameron', 'Butler', 'Walsh', 'Wallace'
+]
+
+CONSUMER_TYPES = [Consumer.LOW_VOLTAGE, Consumer.HIGH_VOLTAGE, Consumer.EXTRA_HIGH_VOLTAGE]
+
+
+STATISTICS_COLUMNS = ('consumer', 'year', 'month', 'consumption', 'total_bill', 'total_cost')
+
+
+def insert_sql(model, fields):
+    qn = connection.ops.quote_name
+    return 'INSERT INTO {} ({}) VALUES ({})'.format(
+        qn(model._meta.db_table),
+        ', '.join(qn(model._meta.get_field(name).column) for name in fields),
+        ', '.join(['%s'] * len(fields)))
+
+
+def generate(rng, consumers, years, first_year, first_id):
+    """Yield ``(consumer, [statistics])`` rows for ``consumers`` consumers with ids from ``first_id``.
+
+    Rows are tuples in the order of ``insert_sql``: ``(id, name, consumer_type)``
+    and ``STATISTICS_COLUMNS``.
+    """
+    for consumer_id in range(first_id, first_id + consumers):
+        name = "{} {}".format(rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+        consumer = (consumer_id, name, rng.choice(CONSUMER_TYPES))
+        statistics = []
+        for year in range(first_year, first_year + years):
+            for month in range(1, 13):
+                consumption = 10000 * (rng.randrange(50, 99) / 100)
+                total_bill = consumption * (0.17 * (rng.randrange(80, 99) / 100))
+                total_cost = consumption * (0.17 * (rng.randrange(80, 99) / 100))
+                statistics.append((consumer_id, year, month, consumption, total_bill, total_cost))
+        yield consumer, statistics
+
 
 class Command(BaseCommand):
-    help = "Create dataset. Please do no run that command if you haven't drink SMAP coffee yet." 
+    help = "Create dataset. Please do no run that command if you haven't drink SMAP coffee yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--consumers', type=int, default=60,
+            help='Number of consumers to create.')
+        parser.add_argument(
+            '--years', type=int, default=2,
+            help='Number of years of monthly statistics per consumer.')
+        parser.add_argument(
+            '--first-year', type=int, default=2016,
+            help='Year of the first monthly statistics.')
+        parser.add_argument(
+            '--seed', type=int, default=None,
+            help='Seed of the random generator, for a reproducible dataset.')
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Number of monthly statistics inserted per transaction.')
+        parser.add_argument(
+            '--yes', action='store_true',
+            help='Do not ask for confirmation.')
 
     def handle(self, *args, **options):
-        check = input(self.style.ERROR(
-            "You should not run this command as database is already populated with necessary data. "
-            "Are you SMAP staff? Do you want to recreate the dataset? If you answered yes both times, then type 'yes': "
-        ))
-
-        if check == 'yes':
-            first_names = [
-                'John', 'Tom', 'Mary', 'Tina', 'Anne', 'Joseph', 'Jim', 'Lily', 'Harry', 'Dianne',
-                'Olivia', 'Rose', 'Megan', 'Julia', 'Adam', 'Alan', 'Brandon', 'Brian', 'Cameron',
-                'Carl',  'Charles', 'Evan', 'Frank', 'Gavin'
-            ]
-
-            last_names = [
-                'Arnold', 'Avery', 'Baker', 'Bell', 'Bond', 'Carr', 'Clark', 'Davis', 'Duncan', 'Glover',
-                'Gibson', 'Hamilton', 'Hart', 'Jackson', 'Jones', 'Kerr', 'King', 'Miller', 'Nash', 'Nolan',
-                'Oliver', 'Page', 'Piper', 'Rees', 'Short', 'Skinner', 'Taylor', 'Watson', 'Young', 'Martin',
-                'May', 'Know', 'Lewis', 'Lee', 'Grey', 'Clinton', 'Dyer', 'Cameron', 'Butler', 'Walsh', 'Wallace'
-            ]
-
-            for i in range(0, 60):
-                name = "{} {}".format(random.choice(first_names), random.choice(last_names))
-                consumer_type = random.choice([Consumer.LOW_VOLTAGE, Consumer.HIGH_VOLTAGE, Consumer.EXTRA_HIGH_VOLTAGE])
-                consumer = Consumer.objects.create(
-                    name=name,
-                    consumer_type=consumer_type
-                )
-
-                for year in [2016, 2017]:
-                    for month in range(1, 13):
-                        consumption = 10000 * (random.randrange(50, 99) / 100)
-                        total_bill = consumption * (0.17 * (random.randrange(80, 99) / 100))
-                        total_cost = consumption * (0.17 * (random.randrange(80, 99) / 100))
-                        MonthlyStatistics.objects.create(
-                            consumer=consumer,
-                            year=year,
-                            month=month,
-                            consumption=consumption,
-                            total_bill=total_bill,
-                            total_cost=total_cost
-                        )
-                    self.stdout.write(self.style.SUCCESS("Consumer {} created.".format(i+1)))
+        if not options['yes']:
+            check = input(self.style.ERROR(
+                "You should not run this command as database is already populated with necessary data. "
+                "Are you SMAP staff? Do you want to recreate the dataset? If you answered yes both times, "
+                "then type 'yes': "
+            ))
+            if check != 'yes':
+                return
+
+        rng = random.Random(options['seed'])
+        first_id = (Consumer.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        batch_size = options['batch_size']
+        started = time.time()
+        consumers, statistics, written = [], [], 0
+
+        # Rows are inserted with executemany: building the statements of
+        # bulk_create costs several times more than running them.
+        consumer_sql = insert_sql(Consumer, ('id', 'name', 'consumer_type'))
+        statistics_sql = insert_sql(MonthlyStatistics, STATISTICS_COLUMNS)
+
+        def flush():
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(consumer_sql, consumers)
+                cursor.executemany(statistics_sql, statistics)
+            elapsed = time.time() - started
+            self.stdout.write("{} consumers, {} statistics ({:.0f} rows/s)".format(
+                consumers[-1][0] - first_id + 1, written, written / max(elapsed, 1e-6)))
+            del consumers[:]
+            del statistics[:]
+
+        for consumer, rows in generate(
+                rng, options['consumers'], options['years'], options['first_year'], first_id):
+            consumers.append(consumer)
+            statistics.extend(rows)
+            written += len(rows)
+            if len(statistics) >= batch_size:
+                flush()
+        if consumers:
+            flush()
+
+        # Raw inserts do not send post_save, so the response cache and the search index are reset here.
+        invalidate()
+        invalidate_index()
+        elapsed = time.time() - started
+        self.stdout.write(self.style.SUCCESS(
+            "Created {} consumers and {} monthly statistics in {:.2f}s ({:.0f} rows/s).".format(
+                options['consumers'], written, elapsed, written / max(elapsed, 1e-6))))
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+
+from api import loadtest
+from frontend.asgi import ASGIHandler
+
+
+class Command(BaseCommand):
+    help = "Load test the ASGI application: fast requests while slow statistics requests are in flight."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--slow', type=int, default=50,
+            help='Number of concurrent slow statistics requests.')
+        parser.add_argument(
+            '--fast', type=int, default=200,
+            help='Number of consumer list requests sent while they are in flight.')
+        parser.add_argument(
+            '--concurrency', type=int, default=8,
+            help='Number of consumer list requests sent at a time.')
+        parser.add_argument(
+            '--shared-pool', action='store_true',
+            help='Run every request in one pool, like a threaded WSGI server, to compare.')
+
+    def handle(self, *args, **options):
+        application = ASGIHandler(
+            get_wsgi_application(),
+            threads=settings.ASGI_THREADS,
+            backlog=max(settings.ASGI_BACKLOG, options['slow']),
+            slow_paths=[] if options['shared_pool'] else settings.ASGI_SLOW_PATHS,
+            slow_threads=settings.ASGI_SLOW_THREADS,
+            slow_backlog=max(settings.ASGI_SLOW_BACKLOG, options['slow']),
+        )
+        result = loadtest.run(application, options['slow'], options['fast'], options['concurrency'])
+
+        self.stdout.write("{} requests to {} ({} at a time), {} slow requests to {}".format(
+            options['fast'], result['fast_path'], options['concurrency'], options['slow'], result['slow_path']))
+        for name in ('baseline', 'under_load', 'slow'):
+            self.stdout.write("{:<12} p50 {p50:>9.1f} ms  p90 {p90:>9.1f} ms  p99 {p99:>9.1f} ms  max {max:>9.1f} ms".format(
+                name, **result[name]))
+        self.stdout.write("{} slow requests were still in flight after the fast ones.".format(result['slow_in_flight']))
+        self.stdout.write("Statuses: {}".format(', '.join(str(status) for status in result['statuses'])))
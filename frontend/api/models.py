@@ -31,3 +31,6 @@ class MonthlyStatistics(models.Model):
     consumption = models.FloatField(blank=True, null=True)
     total_bill = models.FloatField(blank=True, null=True)
     total_cost = models.FloatField(blank=True, null=True)
+
+    class Meta:
+        index_together = ('consumer', 'year', 'month')
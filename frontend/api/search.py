@@ -0,0 +1,266 @@
+"""In-process search index of consumer names.
+
+``ConsumerIndex`` answers two kinds of queries without touching the database:
+
+* prefix: names with a word starting with the query, from a sorted list of
+  ``(text from a word start to the end of the name, id)`` searched with
+  ``bisect``. A query costs a binary search plus the rows returned.
+* fuzzy: names sharing at least ``FUZZY_THRESHOLD`` of the query's
+  trigrams, ranked by that share. An inverted index maps trigrams to
+  distinct names. A match must contain one of the query's rarest trigrams
+  (all but as many as it may lack), so only the names listed under those
+  are compared with the query, not every name sharing a common trigram.
+
+Results are in a fixed order, so pages are requested after the key of the
+last result (keyset pagination) rather than at an offset.
+
+The index of the process is built on first use (or by ``build_index`` at
+startup), along with the index generation it reflects. Once a write to
+``Consumer`` commits, ``api.signals`` replaces that generation, which is kept
+in ``settings.API_GENERATION_CACHE`` like the data generation of
+``api.cache``, so that every process sees it. The next search of each
+process then rebuilds its index; the other searches of the process keep
+using the previous index meanwhile. Writes which send no signals, like
+``create_dataset``, call ``invalidate_index``.
+"""
+import base64
+import bisect
+import json
+import math
+import sys
+import threading
+import uuid
+from collections import defaultdict
+
+from api.cache import get_generation_cache
+from api.models import Consumer
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+FUZZY_THRESHOLD = 0.5
+MODES = ('prefix', 'fuzzy')
+
+
+def normalize(name):
+    return ' '.join(name.lower().split())
+
+
+def word_starts(text):
+    """The suffixes of ``text`` starting at a word."""
+    words = text.split(' ')
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+def trigrams(text):
+    """Trigrams of the words of ``text``, padded like PostgreSQL's ``pg_trgm``.
+
+    Trigrams are interned, so that the index holds one string per distinct trigram.
+    """
+    grams = set()
+    for word in text.split():
+        padded = '  {} '.format(word)
+        grams.update(sys.intern(padded[i:i + 3]) for i in range(len(padded) - 2))
+    return grams
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (TypeError, ValueError, UnicodeError):
+        key = None
+    if not isinstance(key, list):
+        raise ValueError('Invalid cursor.')
+    return tuple(key)
+
+
+class ConsumerIndex(object):
+    """Prefix and trigram index of ``(id, name, consumer_type)`` rows, safe to share between threads."""
+
+    def __init__(self, consumers=()):
+        self._lock = threading.Lock()
+        self._consumers = {}
+        self._starts = []
+        self._ids_by_name = defaultdict(set)
+        self._grams_by_name = {}
+        self._names_by_gram = defaultdict(set)
+        for consumer_id, name, consumer_type in consumers:
+            self._add(consumer_id, name, consumer_type, sort=False)
+        self._starts.sort()
+
+    def __len__(self):
+        return len(self._consumers)
+
+    def _add(self, consumer_id, name, consumer_type, sort=True):
+        text = normalize(name)
+        self._consumers[consumer_id] = (name, consumer_type, text)
+        for start in word_starts(text):
+            if sort:
+                bisect.insort(self._starts, (start, consumer_id))
+            else:
+                self._starts.append((start, consumer_id))
+        if not self._ids_by_name[text]:
+            self._grams_by_name[text] = tuple(trigrams(text))
+            for gram in self._grams_by_name[text]:
+                self._names_by_gram[gram].add(text)
+        self._ids_by_name[text].add(consumer_id)
+
+    def _remove(self, consumer_id):
+        name, consumer_type, text = self._consumers.pop(consumer_id)
+        for start in word_starts(text):
+            del self._starts[bisect.bisect_left(self._starts, (start, consumer_id))]
+        self._ids_by_name[text].discard(consumer_id)
+        if not self._ids_by_name[text]:
+            del self._ids_by_name[text]
+            for gram in self._grams_by_name.pop(text):
+                self._names_by_gram[gram].discard(text)
+
+    def update(self, consumer_id, name, consumer_type):
+        with self._lock:
+            if consumer_id in self._consumers:
+                self._remove(consumer_id)
+            self._add(consumer_id, name, consumer_type)
+
+    def remove(self, consumer_id):
+        with self._lock:
+            if consumer_id in self._consumers:
+                self._remove(consumer_id)
+
+    def _row(self, consumer_id):
+        name, consumer_type, text = self._consumers[consumer_id]
+        return {'id': consumer_id, 'name': name, 'consumer_type': consumer_type}
+
+    def prefix(self, query, limit=DEFAULT_LIMIT, after=None):
+        """``(rows, next key)`` of the names with a word starting with ``query``, by matched text and id.
+
+        A name is listed once, at its first matching word start.
+        """
+        query = normalize(query)
+        rows, key = [], None
+        with self._lock:
+            index = bisect.bisect_left(self._starts, (query,))
+            if after is not None:
+                index = max(index, bisect.bisect_right(self._starts, tuple(after)))
+            while index < len(self._starts) and self._starts[index][0].startswith(query):
+                start, consumer_id = self._starts[index]
+                index += 1
+                text = self._consumers[consumer_id][2]
+                if min(s for s in word_starts(text) if s.startswith(query)) != start:
+                    continue
+                if len(rows) == limit:
+                    return rows, key
+                rows.append(self._row(consumer_id))
+                key = (start, consumer_id)
+        return rows, None
+
+    def fuzzy(self, query, limit=DEFAULT_LIMIT, after=None):
+        """``(rows, next key)`` of the names similar to ``query``, most similar first, then by name and id."""
+        grams = trigrams(normalize(query))
+        if not grams:
+            return [], None
+        needed = int(math.ceil(FUZZY_THRESHOLD * len(grams)))
+        with self._lock:
+            postings = sorted((self._names_by_gram.get(gram, ()) for gram in grams), key=len)
+            candidates = set().union(*postings[:len(grams) - needed + 1])
+            matches = []
+            for text in candidates:
+                shared = len(grams.intersection(self._grams_by_name[text]))
+                if shared >= needed:
+                    matches.append((-shared / len(grams), text))
+            matches.sort()
+            after = tuple(after) if after is not None else None
+            rows, key = [], None
+            for score, text in matches:
+                if after is not None and (score, text) < after[:2]:
+                    continue
+                for consumer_id in sorted(self._ids_by_name[text]):
+                    if after is not None and (score, text, consumer_id) <= after:
+                        continue
+                    if len(rows) == limit:
+                        return rows, key
+                    rows.append(self._row(consumer_id))
+                    key = (score, text, consumer_id)
+        return rows, None
+
+    def search(self, query, mode='prefix', limit=DEFAULT_LIMIT, after=None):
+        """``{'results': rows, 'next': cursor}``; ``next`` is ``None`` on the last page.
+
+        ``after`` is the ``next`` cursor of the previous page. Raises
+        ``ValueError`` for an unknown mode or an invalid cursor.
+        """
+        if mode not in MODES:
+            raise ValueError('mode must be prefix or fuzzy.')
+        find = self.prefix if mode == 'prefix' else self.fuzzy
+        try:
+            rows, key = find(query, limit, decode_cursor(after) if after else None)
+        except TypeError:
+            raise ValueError('Invalid cursor.')
+        return {'results': rows, 'next': encode_cursor(key) if key is not None else None}
+
+
+GENERATION_KEY = 'api:search-generation'
+
+# (generation, ConsumerIndex) of the process.
+_index = None
+_index_lock = threading.Lock()
+_build_lock = threading.Lock()
+
+
+def index_generation():
+    """A random token replaced by ``invalidate_index``, shared by the processes."""
+    cache = get_generation_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, uuid.uuid4().hex, None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def invalidate_index():
+    """Make the index of every process rebuild at its next search."""
+    get_generation_cache().set(GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+def build_index():
+    """Build the index of the process from the database."""
+    global _index
+    # Read first: a write committed meanwhile makes the index rebuild again, rather than be missed.
+    generation = index_generation()
+    index = ConsumerIndex(Consumer.objects.values_list('id', 'name', 'consumer_type').iterator())
+    with _index_lock:
+        _index = generation, index
+    return index
+
+
+def get_index():
+    """The index of the process, rebuilt first if consumers changed since it was built.
+
+    While a thread rebuilds it, the other threads search the previous one.
+    """
+    generation = index_generation()
+    with _index_lock:
+        current = _index
+    if current is not None and current[0] == generation:
+        return current[1]
+    if current is None:
+        _build_lock.acquire()
+    elif not _build_lock.acquire(blocking=False):
+        return current[1]
+    try:
+        with _index_lock:
+            current = _index
+        if current is not None and current[0] == generation:
+            return current[1]
+        return build_index()
+    finally:
+        _build_lock.release()
+
+
+def reset_index():
+    """Drop the index of the process; the next search rebuilds it."""
+    global _index
+    with _index_lock:
+        _index = None
@@ -0,0 +1,23 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from api import search
+from api.cache import invalidate
+from api.models import Consumer, MonthlyStatistics
+
+
+@receiver(post_save, sender=Consumer)
+@receiver(post_delete, sender=Consumer)
+@receiver(post_save, sender=MonthlyStatistics)
+@receiver(post_delete, sender=MonthlyStatistics)
+def invalidate_cached_responses(sender, **kwargs):
+    # Once committed: before, other connections would cache the old rows under the new generation.
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=Consumer)
+@receiver(post_delete, sender=Consumer)
+def invalidate_search_index(sender, **kwargs):
+    # Once committed, so that a rolled back write never shows up in searches.
+    transaction.on_commit(search.invalidate_index)
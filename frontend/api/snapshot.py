@@ -0,0 +1,57 @@
+"""Everything the first screen of the app shows, in one response.
+
+The snapshot holds the consumer types, every consumer and the monthly
+statistics summed per consumer type, with rows as lists under a list of
+``fields`` rather than as objects repeating the field names. It is built
+from two queries and stored in the API cache under the data generation of
+``api.cache``. A write through ``ConsumerDetail`` (or any other write to the
+models) replaces the generation, and the next request builds the snapshot
+again; a lock makes the concurrent requests of a process wait for one build
+instead of each running its own.
+"""
+import threading
+
+from django.db.models import Count, Sum
+
+from api.cache import data_generation, get_cache
+from api.models import Consumer, MonthlyStatistics
+
+CONSUMER_FIELDS = ('id', 'name', 'consumer_type')
+MONTHLY_GROUPS = ('consumer__consumer_type', 'year', 'month')
+MONTHLY_FIELDS = ('consumer_type', 'year', 'month', 'consumers', 'consumption', 'total_bill', 'total_cost')
+
+_build_lock = threading.Lock()
+
+
+def build_snapshot():
+    consumers = Consumer.objects.order_by('id').values_list(*CONSUMER_FIELDS)
+    monthly = MonthlyStatistics.objects.values(*MONTHLY_GROUPS).annotate(
+        consumers=Count('consumer', distinct=True),
+        consumption=Sum('consumption'),
+        total_bill=Sum('total_bill'),
+        total_cost=Sum('total_cost'),
+    ).order_by(*MONTHLY_GROUPS)
+    return {
+        'types': Consumer.CONSUMER_TYPE_MAP,
+        'consumers': {'fields': CONSUMER_FIELDS, 'rows': [list(row) for row in consumers]},
+        'monthly': {
+            'fields': MONTHLY_FIELDS,
+            'rows': [[row[MONTHLY_GROUPS[0]]] + [row[field] for field in MONTHLY_FIELDS[1:]] for row in monthly],
+        },
+    }
+
+
+def get_snapshot():
+    """The snapshot of the current data generation, built if there is none yet."""
+    generation = data_generation()[0]
+    key = 'api:snapshot:{}'.format(generation)
+    cache = get_cache()
+    data = cache.get(key)
+    if data is None:
+        with _build_lock:
+            data = cache.get(key)
+            if data is None:
+                data = build_snapshot()
+                data['generation'] = generation
+                cache.set(key, data)
+    return data
@@ -1,3 +1,801 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils.timezone import utc
+from rest_framework.renderers import JSONRenderer
+
+from api import benchmark, loadtest, search
+from api.cache import LRUCache, get_cache, invalidate
+from api.renderers import FastJSONRenderer, packb, to_columns
+from api.models import Consumer, MonthlyStatistics
+from api.views import ConsumerSerializer, MonthlyStatisticsSerializer
+from common import profiling
+from common.benchmark import compare
+from common.sqlite import ReadReplicaRouter
+from frontend.asgi import ASGIHandler
+
+
+def unpackb(data):
+    """Decode the MessagePack ``data`` of ``api.renderers``, for the tests."""
+    formats = {0xca: '>f', 0xcb: '>d', 0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+               0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q'}
+    sizes = {0xd9: '>B', 0xda: '>H', 0xdb: '>I', 0xc4: '>B', 0xc5: '>H', 0xc6: '>I',
+             0xdc: '>H', 0xdd: '>I', 0xde: '>H', 0xdf: '>I'}
+
+    def number(fmt, position):
+        return struct.unpack_from(fmt, data, position)[0], position + struct.calcsize(fmt)
+
+    def read(position):
+        marker = data[position]
+        position += 1
+        if marker < 0x80 or marker >= 0xe0:
+            return marker - (marker >= 0xe0) * 0x100, position
+        if marker in formats:
+            return number(formats[marker], position)
+        if marker in (0xc0, 0xc2, 0xc3):
+            return {0xc0: None, 0xc2: False, 0xc3: True}[marker], position
+        if marker in sizes:
+            size, position = number(sizes[marker], position)
+        else:
+            size = marker & (0x1f if marker >= 0xa0 else 0x0f)
+        if marker in (0xdc, 0xdd) or 0x90 <= marker < 0xa0:
+            items = []
+            for _ in range(size):
+                item, position = read(position)
+                items.append(item)
+            return items, position
+        if marker in (0xde, 0xdf) or 0x80 <= marker < 0x90:
+            items = {}
+            for _ in range(size):
+                key, position = read(position)
+                items[key], position = read(position)
+            return items, position
+        raw = data[position:position + size]
+        return raw if marker in (0xc4, 0xc5, 0xc6) else raw.decode('utf-8'), position + size
+
+    value, end = read(0)
+    assert end == len(data)
+    return value
+
+
+@contextmanager
+def committed():
+    """Run the ``on_commit`` callbacks registered within, as the commit a ``TestCase`` never makes would."""
+    start = len(connection.run_on_commit)
+    yield
+    callbacks = connection.run_on_commit[start:]
+    del connection.run_on_commit[start:]
+    for sids, function in callbacks:
+        function()
+
+
+class ApiTestCase(TestCase):
+
+    def setUp(self):
+        sleep = mock.patch('api.views.time.sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+        get_cache().clear()
+        search.reset_index()
+
+        self.consumers = [
+            Consumer.objects.create(name='John Baker', consumer_type=Consumer.LOW_VOLTAGE),
+            Consumer.objects.create(name='Mary Bell', consumer_type=Consumer.HIGH_VOLTAGE),
+            Consumer.objects.create(name='Tom Carr', consumer_type=Consumer.HIGH_VOLTAGE),
+        ]
+        for consumer in self.consumers:
+            for year in (2016, 2017):
+                for month in range(1, 13):
+                    MonthlyStatistics.objects.create(
+                        consumer=consumer, year=year, month=month,
+                        consumption=100.0 * month, total_bill=20.0 * month, total_cost=15.0 * month)
+
+
+class MonthlyStatisticsBatchApiTest(ApiTestCase):
+
+    def get(self, **params):
+        return self.client.get('/api/monthly_statistics/', params)
+
+    def test_consumers(self):
+        ids = '{},{}'.format(self.consumers[0].id, self.consumers[2].id)
+        with self.assertNumQueries(1):
+            response = self.get(consumers=ids, year=2017)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data), 24)
+        self.assertEqual({row['consumer']['name'] for row in data}, {'John Baker', 'Tom Carr'})
+        self.sleep.assert_called_once()
+
+    def test_consumer_type(self):
+        data = self.get(consumer_type=Consumer.HIGH_VOLTAGE, month=3).json()
+        self.assertEqual([(row['consumer']['id'], row['year']) for row in data], [
+            (self.consumers[1].id, 2016), (self.consumers[1].id, 2017),
+            (self.consumers[2].id, 2016), (self.consumers[2].id, 2017),
+        ])
+
+    def test_month_range(self):
+        data = self.get(consumers=str(self.consumers[0].id), start='2016-11', end='2017-02').json()
+        self.assertEqual([(row['year'], row['month']) for row in data], [(2016, 11), (2016, 12), (2017, 1), (2017, 2)])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.get().status_code, 400)
+        self.assertEqual(self.get(consumers='1,a').status_code, 400)
+        self.assertEqual(self.get(consumer_type='low', start='2016').status_code, 400)
+        self.sleep.assert_not_called()
+
+
+class StatisticsAggregateApiTest(ApiTestCase):
+
+    def get(self, **params):
+        return self.client.get('/api/aggregate/monthly_statistics/', params)
+
+    def test_group_by_consumer_type_and_month(self):
+        MonthlyStatistics.objects.filter(consumer=self.consumers[2]).update(total_bill=F('total_bill') * 2)
+        with self.assertNumQueries(1):
+            data = self.get(group_by='consumer_type,year,month').json()
+        self.assertEqual(len(data), 2 * 24)
+        row = data[-1]
+        self.assertEqual((row['consumer_type'], row['year'], row['month'], row['count']), ('low', 2017, 12, 1))
+        row = next(row for row in data if row['consumer_type'] == 'high' and (row['year'], row['month']) == (2016, 3))
+        self.assertEqual(row['count'], 2)
+        self.assertEqual(row['consumption'], {'sum': 600.0, 'avg': 300.0, 'min': 300.0, 'max': 300.0})
+        self.assertEqual(row['total_bill'], {'sum': 180.0, 'avg': 90.0, 'min': 60.0, 'max': 120.0})
+        self.assertEqual(row['margin'], {'sum': 90.0, 'avg': 45.0, 'min': 15.0, 'max': 75.0})
+
+    def test_default_and_filters(self):
+        data = self.get().json()
+        self.assertEqual([(row['year'], row['month']) for row in data[:2]], [(2016, 1), (2016, 2)])
+        self.assertEqual(data[0]['count'], 3)
+        data = self.get(group_by='consumer', consumers=str(self.consumers[0].id), year=2016).json()
+        self.assertEqual(data, [{
+            'consumer': self.consumers[0].id,
+            'count': 12,
+            'consumption': {'sum': 7800.0, 'avg': 650.0, 'min': 100.0, 'max': 1200.0},
+            'total_bill': {'sum': 1560.0, 'avg': 130.0, 'min': 20.0, 'max': 240.0},
+            'total_cost': {'sum': 1170.0, 'avg': 97.5, 'min': 15.0, 'max': 180.0},
+            'margin': {'sum': 390.0, 'avg': 32.5, 'min': 5.0, 'max': 60.0},
+        }])
+        self.assertEqual(self.get(group_by='').json()[0]['count'], 72)
+        self.sleep.assert_not_called()
+
+    def test_invalid_parameters(self):
+        for params in ({'group_by': 'day'}, {'group_by': 'year,year'}, {'consumers': 'a'}, {'start': '2016'}):
+            self.assertEqual(self.get(**params).status_code, 400)
+
+    def test_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN SELECT * FROM api_monthlystatistics '
+                           'WHERE consumer_id = 1 AND year = 2016 AND month = 1')
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('consumer_id_year_month', plan)
+
+
+class ExportTest(ApiTestCase):
+
+    def export(self, **params):
+        response = self.client.get('/api/export/monthly_statistics/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv(self):
+        lines = self.export().splitlines()
+        self.assertEqual(lines[0], 'id,consumer,name,consumer_type,year,month,consumption,total_bill,total_cost')
+        self.assertEqual(len(lines), 1 + 72)
+        self.assertEqual(lines[1].split(',')[1:], [
+            str(self.consumers[0].id), 'John Baker', 'low', '2016', '1', '100.0', '20.0', '15.0'])
+
+    def test_ndjson(self):
+        rows = [json.loads(line) for line in self.export(format='ndjson').splitlines()]
+        self.assertEqual(len(rows), 72)
+        self.assertEqual(rows[-1]['name'], 'Tom Carr')
+        self.assertEqual((rows[-1]['year'], rows[-1]['month'], rows[-1]['consumption']), (2017, 12, 1200.0))
+
+    def test_filters(self):
+        rows = [json.loads(line) for line in self.export(
+            format='ndjson', consumer_type=Consumer.HIGH_VOLTAGE, start='2017-11').splitlines()]
+        self.assertEqual([(row['consumer'], row['month']) for row in rows], [
+            (self.consumers[1].id, 11), (self.consumers[1].id, 12),
+            (self.consumers[2].id, 11), (self.consumers[2].id, 12),
+        ])
+        for params in ({'format': 'xml'}, {'consumers': 'a'}, {'end': '2017'}):
+            response = self.client.get('/api/export/monthly_statistics/', params)
+            self.assertEqual(response.status_code, 400)
+
+    def test_gzip(self):
+        response = self.client.get('/api/export/monthly_statistics/', {'gzip': '1'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)).decode('utf-8'), self.export())
+
+    def test_rows_are_fetched_in_chunks(self):
+        with mock.patch('api.export.ROWS_PER_CHUNK', 10):
+            response = self.client.get('/api/export/monthly_statistics/')
+            chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 1 + 8)
+
+
+class StatisticsResponseTest(ApiTestCase):
+
+    def test_same_data_as_serializer(self):
+        consumer = self.consumers[1]
+        expected = MonthlyStatisticsSerializer(MonthlyStatistics.objects.filter(consumer=consumer), many=True).data
+        response = self.client.get('/api/monthly_statistics/{}'.format(consumer.id))
+        self.assertEqual(response.json(), [dict(row, consumer=dict(row['consumer'])) for row in expected])
+
+    def test_query_count_does_not_grow_with_rows(self):
+        consumer = self.consumers[0]
+        with self.assertNumQueries(1):
+            self.client.get('/api/monthly_statistics/{}'.format(consumer.id), {'year': 2016, 'month': 1})
+        with self.assertNumQueries(1):
+            self.client.get('/api/monthly_statistics/{}'.format(consumer.id))
+        with self.assertNumQueries(1):
+            self.client.get('/api/monthly_statistics/', {'consumer_type': Consumer.HIGH_VOLTAGE})
+
+    def test_normalized(self):
+        data = self.client.get('/api/monthly_statistics/', {
+            'consumer_type': Consumer.HIGH_VOLTAGE, 'year': 2016, 'shape': 'normalized'}).json()
+        self.assertEqual(data['consumers'], [
+            {'id': c.id, 'name': c.name, 'consumer_type': c.consumer_type} for c in self.consumers[1:]])
+        self.assertEqual(len(data['statistics']), 24)
+        self.assertEqual(data['statistics'][0]['consumer'], self.consumers[1].id)
+        self.assertEqual(data['statistics'][0]['total_bill'], 20.0)
+
+
+class ConsumerListTest(ApiTestCase):
+
+    def test_same_data_as_serializer(self):
+        expected = ConsumerSerializer(Consumer.objects.all(), many=True).data
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/consumers/')
+        self.assertEqual(response.json(), [dict(row) for row in expected])
+
+    def test_consumer_type(self):
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/consumers/high').json()
+        self.assertEqual([row['name'] for row in data], ['Mary Bell', 'Tom Carr'])
+
+
+class SnapshotTest(ApiTestCase):
+
+    def rows(self, data, name):
+        return [dict(zip(data[name]['fields'], row)) for row in data[name]['rows']]
+
+    def test_content(self):
+        with self.assertNumQueries(2):
+            data = self.client.get('/api/snapshot/').json()
+        self.assertEqual(data['types'], Consumer.CONSUMER_TYPE_MAP)
+        self.assertEqual(self.rows(data, 'consumers'), [dict(row) for row in ConsumerSerializer(
+            Consumer.objects.order_by('id'), many=True).data])
+        monthly = self.rows(data, 'monthly')
+        self.assertEqual(len(monthly), 2 * 24)
+        self.assertEqual(monthly[0], {
+            'consumer_type': 'high', 'year': 2016, 'month': 1, 'consumers': 2,
+            'consumption': 200.0, 'total_bill': 40.0, 'total_cost': 30.0})
+        self.assertEqual(monthly[-1]['consumer_type'], 'low')
+
+    def test_revalidation(self):
+        response = self.client.get('/api/snapshot/')
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.client.get('/api/snapshot/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_rebuilt_after_writes(self):
+        first = self.client.get('/api/snapshot/')
+        with committed():
+            self.client.post('/api/consumer/', {'name': 'Lily King', 'consumer_type': Consumer.LOW_VOLTAGE})
+        response = self.client.get('/api/snapshot/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.json()['generation'], first.json()['generation'])
+        self.assertEqual(self.rows(response.json(), 'consumers')[-1]['name'], 'Lily King')
+
+        with committed():
+            self.client.delete('/api/consumer/{}'.format(self.consumers[1].id))
+        monthly = self.rows(self.client.get('/api/snapshot/').json(), 'monthly')
+        self.assertEqual(monthly[0]['consumers'], 1)
+
+
+class ConsumerSearchTest(ApiTestCase):
+
+    def setUp(self):
+        super(ConsumerSearchTest, self).setUp()
+        for name in ('Mary Baker', 'Bob Marley', 'Anna Bakerman', 'Jim Bond'):
+            Consumer.objects.create(name=name)
+
+    def get(self, **params):
+        return self.client.get('/api/consumers/search/', params)
+
+    def names(self, **params):
+        return [row['name'] for row in self.get(**params).json()['results']]
+
+    def test_prefix(self):
+        with self.assertNumQueries(1):
+            data = self.get(q='bak').json()
+        self.assertEqual([row['name'] for row in data['results']], ['John Baker', 'Mary Baker', 'Anna Bakerman'])
+        self.assertEqual(data['results'][0], ConsumerSerializer(self.consumers[0]).data)
+        self.assertIsNone(data['next'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(q='MARY b'), ['Mary Baker', 'Mary Bell'])
+        # A name matching at two words is listed once.
+        self.assertEqual(self.names(q='ma'), ['Bob Marley', 'Mary Baker', 'Mary Bell'])
+
+    def test_keyset_pagination(self):
+        pages, after = [], None
+        while True:
+            data = self.get(q='b', limit=2, **({'after': after} if after else {})).json()
+            pages.append([row['name'] for row in data['results']])
+            after = data['next']
+            if after is None:
+                break
+        self.assertEqual(pages, [
+            ['John Baker', 'Mary Baker'], ['Anna Bakerman', 'Mary Bell'], ['Bob Marley', 'Jim Bond']])
+
+    def test_fuzzy(self):
+        # 8 and 7 of the 10 trigrams of the query; John Baker shares 3.
+        self.assertEqual(self.names(q='mary bakr', mode='fuzzy'), ['Mary Baker', 'Mary Bell'])
+        first = self.get(q='mary bakr', mode='fuzzy', limit=1).json()
+        second = self.get(q='mary bakr', mode='fuzzy', limit=1, after=first['next']).json()
+        self.assertEqual([row['name'] for row in second['results']], ['Mary Bell'])
+        self.assertIsNone(second['next'])
+        self.assertEqual(self.names(q='xyz', mode='fuzzy'), [])
+
+    def test_writes_of_other_processes(self):
+        self.assertEqual(self.names(q='lily'), [])
+        Consumer.objects.bulk_create([Consumer(name='Lily King')])
+        # Another process commits it: Django creates the cache instances per thread, as it would per process.
+        thread = threading.Thread(target=search.invalidate_index)
+        thread.start()
+        thread.join()
+        self.assertEqual(self.names(q='lily'), ['Lily King'])
+
+    def test_previous_index_is_searched_during_a_rebuild(self):
+        index = search.get_index()
+        search.invalidate_index()
+        with search._build_lock:
+            self.assertIs(search.get_index(), index)
+        self.assertIsNot(search.get_index(), index)
+
+    def test_invalid_parameters(self):
+        for params in ({'limit': 0}, {'limit': 'x'}, {'mode': 'regex'}, {'after': 'x'}, {'after': 'e30='}):
+            self.assertEqual(self.get(q='a', **params).status_code, 400, params)
+
+    def test_index(self):
+        index = search.ConsumerIndex([(1, 'Ann  Lee', 'low'), (2, 'Lee Ann', 'high')])
+        index.update(3, 'Leo Ray', 'low')
+        index.update(1, 'Ann Ray', 'low')
+        index.remove(2)
+        self.assertEqual(len(index), 2)
+        self.assertEqual([row['id'] for row in index.prefix('ray')[0]], [1, 3])
+        self.assertEqual(index.prefix('lee'), ([], None))
+        self.assertEqual([row['id'] for row in index.fuzzy('ann ray')[0]], [1, 3])
+
+
+class LRUCacheTest(TestCase):
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LRUCache('test', {'OPTIONS': {'MAX_ENTRIES': 2}})
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    def test_expiry(self):
+        cache = LRUCache('test', {})
+        cache.set('a', 1, timeout=-1)
+        self.assertIsNone(cache.get('a'))
+        self.assertTrue(cache.add('a', 2))
+        self.assertFalse(cache.add('a', 3))
+        self.assertEqual(cache.get('a'), 2)
+
+
+class CachedResponseTest(ApiTestCase):
+
+    def test_repeated_request_is_served_from_cache(self):
+        first = self.client.get('/api/consumers/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/consumers/')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertIn('Last-Modified', second)
+
+    def test_conditional_request(self):
+        etag = self.client.get('/api/consumer_types/')['ETag']
+        response = self.client.get('/api/consumer_types/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        last_modified = self.client.get('/api/consumers/')['Last-Modified']
+        response = self.client.get('/api/consumers/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_create_and_delete_invalidate(self):
+        etag = self.client.get('/api/consumers/')['ETag']
+        with committed():
+            self.client.post('/api/consumer/', {'name': 'Lily King', 'consumer_type': Consumer.LOW_VOLTAGE})
+        response = self.client.get('/api/consumers/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 4)
+
+        etag = response['ETag']
+        with committed():
+            self.client.delete('/api/consumer/{}'.format(self.consumers[0].id))
+        response = self.client.get('/api/consumers/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(len(response.json()), 3)
+
+    def test_statistics_write_invalidates(self):
+        etag = self.client.get('/api/consumers/')['ETag']
+        with committed():
+            MonthlyStatistics.objects.filter(consumer=self.consumers[0]).first().delete()
+        self.assertEqual(self.client.get('/api/consumers/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_invalidated_once_committed(self):
+        etag = self.client.get('/api/consumers/')['ETag']
+        with committed():
+            self.consumers[0].delete()
+            # Until the commit, other connections still read the deleted consumer.
+            self.assertEqual(self.client.get('/api/consumers/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/api/consumers/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cached_per_path_and_accept(self):
+        self.assertEqual(len(self.client.get('/api/consumers/high').json()), 2)
+        self.assertEqual(len(self.client.get('/api/consumers/').json()), 3)
+        response = self.client.get('/api/consumers/', HTTP_ACCEPT='text/html')
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+
+    def test_invalidation_reaches_other_cache_instances(self):
+        # Django creates the cache instances per thread, as a server would per process.
+        etag = self.client.get('/api/consumers/')['ETag']
+        thread = threading.Thread(target=invalidate)
+        thread.start()
+        thread.join()
+        self.assertEqual(self.client.get('/api/consumers/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    @override_settings(API_CACHE='default')
+    def test_pluggable_backend(self):
+        self.client.get('/api/consumers/')
+        with self.assertNumQueries(0):
+            self.client.get('/api/consumers/')
+
+
+class RendererTest(ApiTestCase):
+
+    def get(self, **extra):
+        return self.client.get('/api/monthly_statistics/', {'consumer_type': Consumer.HIGH_VOLTAGE, 'year': 2016},
+                               **extra)
+
+    def test_msgpack(self):
+        expected = self.get().json()
+        response = self.client.get('/api/monthly_statistics/', {
+            'consumer_type': Consumer.HIGH_VOLTAGE, 'year': 2016, 'format': 'msgpack'})
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(unpackb(response.content), expected)
+        self.assertLess(len(response.content), len(json.dumps(expected, separators=(',', ':'))))
+
+    def test_columnar(self):
+        rows = self.get().json()
+        response = self.get(HTTP_ACCEPT='application/vnd.columnar+json')
+        self.assertEqual(response['Content-Type'], 'application/vnd.columnar+json')
+        data = response.json()
+        self.assertEqual(list(data), list(rows[0]))
+        self.assertEqual(data['total_bill'], [row['total_bill'] for row in rows])
+        self.assertEqual(data['consumer']['name'][11:13], ['Mary Bell', 'Tom Carr'])
+
+        response = self.get(HTTP_ACCEPT='application/vnd.columnar+msgpack')
+        self.assertEqual(unpackb(response.content), data)
+
+    def test_cached_per_format(self):
+        path = '/api/aggregate/monthly_statistics/?group_by=consumer_type'
+        expected = self.client.get(path).json()
+        for accept in ('application/msgpack', 'application/vnd.columnar+msgpack'):
+            self.client.get(path, HTTP_ACCEPT=accept)
+            with self.assertNumQueries(0):
+                response = self.client.get(path, HTTP_ACCEPT=accept)
+            self.assertEqual(response['Content-Type'], accept)
+        self.assertEqual(unpackb(self.client.get(path + '&format=msgpack').content), expected)
+        self.assertEqual(self.client.get(path).json(), expected)
+
+    def test_errors_and_unknown_format(self):
+        response = self.client.get('/api/monthly_statistics/', {'format': 'msgpack'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(unpackb(response.content)['success'], False)
+        self.assertEqual(self.client.get('/api/consumers/', {'format': 'xml'}).status_code, 404)
+
+    def test_to_columns(self):
+        self.assertEqual(to_columns({'rows': [{'a': 1, 'b': {'c': 2}}, {'b': {'c': 3}, 'd': 4}], 'empty': []}), {
+            'rows': {'a': [1, None], 'b': {'c': [2, 3]}, 'd': [None, 4]},
+            'empty': [],
+        })
+        self.assertEqual(to_columns([1, {'a': 1}]), [1, {'a': 1}])
+        self.assertEqual(list(to_columns([{'z': 1, 'a': 2}])), ['z', 'a'])
+
+    def test_packb(self):
+        self.assertEqual(packb({'a': [1, -1, 200, 1.5, None, True, '\xe9']}), (
+            b'\x81\xa1a\x97\x01\xff\xcc\xc8\xcb\x3f\xf8\x00\x00\x00\x00\x00\x00\xc0\xc3\xa2\xc3\xa9'))
+        # The integers of a list take the size of the largest one.
+        self.assertEqual(packb([1, 300]), b'\x92\xcd\x00\x01\xcd\x01\x2c')
+        values = [None, 2 ** 64 - 1, -2 ** 63, 'x' * 40, 'y' * 300, list(range(20)), {str(i): i for i in range(20)},
+                  [2 ** 64 - 1, -1], [{'a': 1.0, 'b': 'x'}] * 3, [{}, {}], (1, 2), b'\x00']
+        self.assertEqual(unpackb(packb(values)), values[:10] + [[1, 2], b'\x00'])
+        with self.assertRaises(OverflowError):
+            packb(2 ** 64)
+
+    def test_fast_json(self):
+        data = [{'name': 'Zo\xeb \u2028', 'value': 0.1, 'day': date(2016, 7, 15), 'amount': Decimal('1.50'),
+                 'at': datetime(2016, 7, 15, 12, tzinfo=utc), 1: None}] * 3
+        for media_type in ('application/json', 'application/json; indent=2'):
+            self.assertEqual(FastJSONRenderer().render(data, media_type), JSONRenderer().render(data, media_type))
+        with self.assertRaises(ValueError):
+            FastJSONRenderer().render({'value': float('nan')})
+
+
+class CreateDatasetTest(ApiTestCase):
+
+    def create_dataset(self, **options):
+        out = StringIO()
+        call_command('create_dataset', yes=True, stdout=out, **options)
+        return out.getvalue()
+
+    def test_create_dataset(self):
+        etag = self.client.get('/api/consumers/')['ETag']
+        out = self.create_dataset(consumers=5, years=3, first_year=2015, seed=1, batch_size=40)
+        self.assertIn('Created 5 consumers and 180 monthly statistics', out)
+        self.assertEqual(Consumer.objects.count(), 8)
+        new = MonthlyStatistics.objects.filter(consumer_id__gt=self.consumers[-1].id)
+        self.assertEqual(new.count(), 180)
+        self.assertEqual(sorted(new.values_list('year', flat=True).distinct()), [2015, 2016, 2017])
+        response = self.client.get('/api/consumers/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(len(response.json()), 8)
+
+    def test_seed_is_reproducible(self):
+        datasets = []
+        for _ in range(2):
+            MonthlyStatistics.objects.all().delete()
+            Consumer.objects.all().delete()
+            self.create_dataset(consumers=3, years=1, seed=7)
+            datasets.append((
+                list(Consumer.objects.order_by('id').values_list('name', 'consumer_type')),
+                list(MonthlyStatistics.objects.order_by('id').values_list('consumption', 'total_bill')),
+            ))
+        self.assertEqual(datasets[0], datasets[1])
+
+    def test_prompt(self):
+        with mock.patch('builtins.input', return_value='no'):
+            call_command('create_dataset', consumers=2, stdout=StringIO())
+        self.assertEqual(Consumer.objects.count(), 3)
+
+
+class BenchmarkTest(TestCase):
+
+    def test_run(self):
+        results = benchmark.run(sizes=[3], years=1, repeat=2)
+        by_name = {result['name']: result for result in results}
+        self.assertEqual(len(by_name), len(benchmark.endpoints()) + 2 + 2 * len(benchmark.RENDERERS))
+        self.assertLess(by_name['render statistics high columnar']['bytes'],
+                        by_name['render statistics high json']['bytes'])
+        self.assertEqual(by_name['consumers']['queries'], 1)
+        self.assertEqual(by_name['consumers (cached)']['queries'], 0)
+        for result in results:
+            self.assertEqual(result['size'], 3)
+            self.assertLessEqual(result['p50'], result['p99'])
+            self.assertLess(result['p50'], 1000)
+
+    def test_compare(self):
+        baseline = [{'name': 'consumers', 'size': 10, 'p50': 10.0, 'queries': 1}]
+        rows = compare(baseline, [{'name': 'consumers', 'size': 10, 'p50': 15.0, 'queries': 1}])
+        self.assertTrue(rows[0][3])
+        rows = compare(baseline, [{'name': 'consumers', 'size': 10, 'p50': 11.5, 'queries': 1}])
+        self.assertFalse(rows[0][3])
+
+
+class ProfilingTest(ApiTestCase):
+
+    def setUp(self):
+        super(ProfilingTest, self).setUp()
+        profiling.STATS.clear()
+        self.addCleanup(profiling.STATS.clear)
+        self.staff = get_user_model().objects.create_user('staff', is_staff=True)
+
+    def stats(self):
+        self.client.force_login(self.staff)
+        return self.client.get('/profiling/').json()
+
+    def test_disabled_by_default(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/consumers/'))
+        self.assertEqual(self.stats()['views'], {})
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_server_timing(self):
+        response = self.client.get('/api/monthly_statistics/{}'.format(self.consumers[0].id))
+        metrics = [metric.split(';')[0] for metric in response['Server-Timing'].split(', ')]
+        self.assertEqual(metrics, ['total', 'sql', 'template', 'render'])
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_stats(self):
+        url = '/api/monthly_statistics/{}'.format(self.consumers[0].id)
+        for _ in range(2):
+            self.client.get(url)
+        self.client.get('/api/consumers/')
+        self.client.get('/api/consumers/')
+        views = self.stats()['views']
+        statistics = views['api.views.MonthlyStatisticsApi']
+        self.assertEqual(statistics['count'], 2)
+        self.assertEqual(statistics['mean']['queries'], 1)
+        self.assertGreater(statistics['mean']['render'], 0)
+        self.assertIn('api_monthlystatistics', statistics['slowest_queries'][0]['sql'])
+        self.assertEqual(views['api.views.ConsumerList']['mean']['queries'], 0.5)
+
+    def test_stats_require_staff(self):
+        self.assertEqual(self.client.get('/profiling/').status_code, 404)
+
+
+@override_settings(ALLOWED_HOSTS=['localhost'])
+class ASGIHandlerTest(TransactionTestCase):
+    # Requests run in pool threads, which need committed data.
+
+    def setUp(self):
+        self.consumer = Consumer.objects.create(name='John Baker', consumer_type=Consumer.LOW_VOLTAGE)
+        MonthlyStatistics.objects.create(consumer=self.consumer, year=2017, month=1, consumption=1.0)
+        sleep = time.sleep
+        patcher = mock.patch('api.views.time.sleep', side_effect=lambda seconds: sleep(0.5))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        get_cache().clear()
+
+    def application(self, **options):
+        options.setdefault('slow_paths', [r'^/api/monthly_statistics/'])
+        return ASGIHandler(get_wsgi_application(), **options)
+
+    def request(self, application, path, **kwargs):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        return loop.run_until_complete(loadtest.request(application, path, **kwargs))
+
+    def test_get_and_post(self):
+        application = self.application()
+        status, content, elapsed = self.request(application, '/api/consumers/low', query_string=b'shape=x')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(content.decode())[0]['name'], 'John Baker')
+
+        status, content, elapsed = self.request(
+            application, '/api/consumer/', method='POST', body=b'name=Lily+King&consumer_type=high',
+            headers=[(b'content-type', b'application/x-www-form-urlencoded')])
+        self.assertEqual(status, 200)
+        self.assertTrue(Consumer.objects.filter(name='Lily King').exists())
+
+    def test_body_size_limit(self):
+        application = self.application(max_body_size=10)
+        post = dict(method='POST', headers=[(b'content-type', b'application/x-www-form-urlencoded')])
+        status, content, elapsed = self.request(
+            application, '/api/consumer/', body=b'name=Lily+King&consumer_type=high', **post)
+        self.assertEqual(status, 413)
+        status, content, elapsed = self.request(
+            application, '/api/consumer/', method='POST', headers=[(b'content-length', b'11')])
+        self.assertEqual(status, 413)
+        self.assertFalse(Consumer.objects.filter(name='Lily King').exists())
+
+        # The body is not read past the limit.
+        chunks = [b'name=Lily', b'+King', b'&consumer_type=high']
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': chunks.pop(0), 'more_body': bool(chunks)}
+
+        async def send(message):
+            sent.append(message)
+        scope = {'type': 'http', 'method': 'POST', 'path': '/api/consumer/', 'headers': post['headers']}
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        loop.run_until_complete(application(scope, receive, send))
+        self.assertEqual((sent[0]['status'], chunks), (413, [b'&consumer_type=high']))
+
+        status, content, elapsed = self.request(
+            self.application(max_body_size=100), '/api/consumer/', body=b'name=Lily+King&consumer_type=high', **post)
+        self.assertEqual(status, 200)
+
+    def test_uploads_have_their_own_limit(self):
+        body = (
+            b'--b\r\nContent-Disposition: form-data; name="name"\r\n\r\nLily King\r\n'
+            b'--b\r\nContent-Disposition: form-data; name="consumer_type"\r\n\r\nhigh\r\n--b--\r\n')
+        post = dict(method='POST', body=body, headers=[
+            (b'content-type', b'multipart/form-data; boundary=b'), (b'content-length', str(len(body)).encode())])
+        status, content, elapsed = self.request(
+            self.application(max_body_size=10, max_upload_size=len(body) - 1), '/api/consumer/', **post)
+        self.assertEqual(status, 413)
+        status, content, elapsed = self.request(self.application(max_body_size=10), '/api/consumer/', **post)
+        self.assertEqual(status, 200)
+        self.assertTrue(Consumer.objects.filter(name='Lily King').exists())
+
+    def test_search_index_follows_writes(self):
+        application = self.application(startup=[search.build_index])
+        search.reset_index()
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+        loop.run_until_complete(application({'type': 'lifespan'}, receive, send))
+        self.assertEqual(len(search.get_index()), 1)
+
+        application = self.application()
+        self.request(
+            application, '/api/consumer/', method='POST', body=b'name=Lily+King&consumer_type=high',
+            headers=[(b'content-type', b'application/x-www-form-urlencoded')])
+        status, content, elapsed = self.request(application, '/api/consumers/search/', query_string=b'q=king')
+        results = json.loads(content.decode())['results']
+        self.assertEqual([row['name'] for row in results], ['Lily King'])
+
+        self.request(application, '/api/consumer/{}'.format(results[0]['id']), method='DELETE')
+        status, content, elapsed = self.request(application, '/api/consumers/search/', query_string=b'q=king')
+        self.assertEqual(json.loads(content.decode())['results'], [])
+
+    def test_fast_requests_are_not_starved(self):
+        result = loadtest.run(self.application(threads=2, slow_threads=10), slow=10, fast=8, concurrency=2)
+        self.assertEqual(result['statuses'], [200])
+        self.assertEqual(result['slow_in_flight'], 10)
+        self.assertLess(result['under_load']['max'], 400)
+        self.assertGreaterEqual(result['slow']['p50'], 500)
+
+    def test_shared_pool_starves(self):
+        result = loadtest.run(self.application(threads=2, slow_paths=[]), slow=4, fast=2, concurrency=2)
+        self.assertGreaterEqual(result['under_load']['max'], 500)
+
+    def test_overload(self):
+        application = self.application(slow_threads=1, slow_backlog=0)
+        path = '/api/monthly_statistics/{}'.format(self.consumer.id)
+
+        async def both():
+            return await asyncio.gather(loadtest.request(application, path), loadtest.request(application, path))
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        results = loop.run_until_complete(both())
+        self.assertEqual(sorted(status for status, content, elapsed in results), [200, 503])
+
+
+class SQLiteTest(TestCase):
+
+    def test_pragmas_on_new_connections(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        wrapper = DatabaseWrapper(dict(
+            connection.settings_dict, NAME=os.path.join(directory, 'db.sqlite3'),
+            PRAGMAS=[('journal_mode', 'wal'), ('cache_size', -1024)]))
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -1024)
+
+    def test_router(self):
+        router = ReadReplicaRouter()
+        with override_settings(SQLITE_READ_ALIAS='replica'):
+            self.assertEqual(router.db_for_read(Consumer), 'default')
+            with mock.patch.object(connection, 'in_atomic_block', False):
+                self.assertEqual(router.db_for_read(Consumer), 'replica')
+        self.assertEqual(router.db_for_write(Consumer), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'api'))
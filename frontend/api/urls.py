@@ -3,11 +3,16 @@ from api import views
 
 
 urlpatterns = [
+    url(r'^snapshot/$', views.Snapshot.as_view()),
+    url(r'^consumers/search/$', views.ConsumerSearch.as_view()),
     url(r'^consumers/(?P<consumer_type>[a-zA-Z_]+)$', views.ConsumerList.as_view()),
     url(r'^consumers/', views.ConsumerList.as_view()),
     url(r'^consumer/(?P<consumer_id>[0-9]+)$', views.ConsumerDetail.as_view()),
     url(r'^consumer/', views.ConsumerDetail.as_view()),
     url(r'^consumer_types/', views.ConsumerTypes.as_view()),
     url(r'^monthly_statistics/(?P<consumer_id>[0-9]+)$', views.MonthlyStatisticsApi.as_view()),
+    url(r'^monthly_statistics/$', views.MonthlyStatisticsBatchApi.as_view()),
+    url(r'^aggregate/monthly_statistics/$', views.StatisticsAggregateApi.as_view()),
+    url(r'^export/monthly_statistics/$', views.export_statistics),
 
 ]
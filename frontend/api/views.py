@@ -1,12 +1,18 @@
 import time
 import random
+from collections import OrderedDict
 
+from django.db.models import Avg, Count, F, FloatField, Max, Min, Q, Sum
+from django.http import JsonResponse
 from rest_framework import serializers
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
+from api import export, search, snapshot
+from api.cache import CachedResponseMixin
 from api.models import Consumer, MonthlyStatistics
 
+
 class ConsumerSerializer(serializers.ModelSerializer):
     class Meta:
         model = Consumer
@@ -21,12 +27,132 @@ class MonthlyStatisticsSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class ConsumerTypes(APIView):
+CONSUMER_FIELDS = ('id', 'name', 'consumer_type')
+STATISTICS_FIELDS = ('year', 'month', 'consumption', 'total_bill', 'total_cost')
+
+
+def consumer_rows(consumers):
+    """Same data as ``ConsumerSerializer(consumers, many=True)``, without model instances."""
+    return list(consumers.values(*CONSUMER_FIELDS))
+
+
+def statistics_rows(stats, normalized=False):
+    """Same data as ``MonthlyStatisticsSerializer(stats, many=True)`` in one query.
+
+    With ``normalized``, returns ``{'consumers': [...], 'statistics': [...]}``
+    instead: every consumer is listed once and the statistics refer to it by
+    id.
+    """
+    columns = ('id', 'consumer_id') + STATISTICS_FIELDS + tuple('consumer__' + f for f in CONSUMER_FIELDS)
+    consumers = OrderedDict()
+    rows = []
+    for row in stats.values(*columns):
+        consumer = consumers.get(row['consumer_id'])
+        if consumer is None:
+            consumer = consumers[row['consumer_id']] = {f: row['consumer__' + f] for f in CONSUMER_FIELDS}
+        stat = {'id': row['id'], 'consumer': row['consumer_id'] if normalized else consumer}
+        stat.update((f, row[f]) for f in STATISTICS_FIELDS)
+        rows.append(stat)
+
+    if normalized:
+        return {'consumers': list(consumers.values()), 'statistics': rows}
+    return rows
+
+
+def is_normalized(request):
+    return request.GET.get('shape') == 'normalized'
+
+
+def filter_statistics(query):
+    """Monthly statistics selected by the query string ``query``, by consumer and month.
+
+    ``consumers`` (comma separated ids) and ``consumer_type`` select the
+    consumers, ``year`` and ``month`` filter exactly and ``start`` and ``end``
+    (``YYYY-MM``, inclusive) select a range of months. Raises ``ValueError``
+    with the message to return for invalid values.
+    """
+    filters = {}
+
+    if query.get('consumers'):
+        try:
+            filters['consumer__in'] = [int(i) for i in query['consumers'].split(',') if i]
+        except ValueError:
+            raise ValueError('consumers must be comma separated ids.')
+
+    if query.get('consumer_type'):
+        filters['consumer__consumer_type'] = query['consumer_type']
+
+    if query.get('year'):
+        filters['year'] = query.get('year')
+
+    if query.get('month'):
+        filters['month'] = query.get('month')
+
+    stats = MonthlyStatistics.objects.filter(**filters)
+
+    try:
+        if query.get('start'):
+            year, month = (int(part) for part in query['start'].split('-'))
+            stats = stats.filter(Q(year__gt=year) | Q(year=year, month__gte=month))
+        if query.get('end'):
+            year, month = (int(part) for part in query['end'].split('-'))
+            stats = stats.filter(Q(year__lt=year) | Q(year=year, month__lte=month))
+    except ValueError:
+        raise ValueError('start and end must be YYYY-MM.')
+
+    return stats.order_by('consumer', 'year', 'month')
+
+
+# Dimensions of ``StatisticsAggregateApi`` and the columns they group by.
+GROUP_BY = OrderedDict([
+    ('year', 'year'),
+    ('month', 'month'),
+    ('consumer_type', 'consumer__consumer_type'),
+    ('consumer', 'consumer_id'),
+])
+AGGREGATES = OrderedDict([('sum', Sum), ('avg', Avg), ('min', Min), ('max', Max)])
+MEASURES = OrderedDict([
+    ('consumption', F('consumption')),
+    ('total_bill', F('total_bill')),
+    ('total_cost', F('total_cost')),
+    ('margin', F('total_bill') - F('total_cost')),
+])
+
+
+def aggregate_statistics(stats, group_by):
+    """Sum, average, minimum and maximum of every measure of ``stats`` per group, in SQL.
+
+    ``group_by`` is a list of ``GROUP_BY`` names. Each row holds the group's
+    values, its ``count`` and ``{measure: {aggregate: value}}``.
+    """
+    columns = [GROUP_BY[name] for name in group_by]
+    annotations = OrderedDict([('count', Count('id'))])
+    for measure, expression in MEASURES.items():
+        for name, function in AGGREGATES.items():
+            annotations['{}__{}'.format(measure, name)] = function(expression, output_field=FloatField())
+
+    if columns:
+        groups = stats.order_by(*columns).values(*columns).annotate(**annotations)
+    else:
+        groups = [stats.order_by().aggregate(**annotations)]
+
+    rows = []
+    for values in groups:
+        row = OrderedDict((name, values[GROUP_BY[name]]) for name in group_by)
+        row['count'] = values['count']
+        for measure in MEASURES:
+            row[measure] = OrderedDict(
+                (name, values['{}__{}'.format(measure, name)]) for name in AGGREGATES)
+        rows.append(row)
+    return rows
+
+
+class ConsumerTypes(CachedResponseMixin, APIView):
     def get(self, request):
         return Response(Consumer.CONSUMER_TYPE_MAP)
 
 
-class ConsumerList(APIView):
+class ConsumerList(CachedResponseMixin, APIView):
 
     def get(self, request, consumer_type=None):
         filters = {}
@@ -35,9 +161,41 @@ class ConsumerList(APIView):
 
         consumers = Consumer.objects.filter(**filters)
 
-        serializer = ConsumerSerializer(consumers, many=True)
+        return Response(consumer_rows(consumers))
+
+
+class Snapshot(CachedResponseMixin, APIView):
+    """Consumer types, consumers and the monthly statistics per type in one response, see ``api.snapshot``."""
+
+    def get(self, request):
+        return Response(snapshot.get_snapshot())
 
-        return Response(serializer.data)
+
+class ConsumerSearch(APIView):
+    """Consumers by name, from the in-process index of ``api.search``.
+
+    ``q`` is matched against the start of every word of the names, or with
+    ``mode=fuzzy`` by shared trigrams. Returns at most ``limit`` results
+    (up to ``search.MAX_LIMIT``) and the ``next`` cursor to pass as
+    ``after`` for the following page.
+    """
+
+    def get(self, request):
+        try:
+            limit = int(request.GET.get('limit', search.DEFAULT_LIMIT))
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= search.MAX_LIMIT:
+            return Response(dict(success=False, message='limit must be between 1 and {}.'.format(
+                search.MAX_LIMIT)), status=400)
+
+        try:
+            data = search.get_index().search(
+                request.GET.get('q', ''), request.GET.get('mode', 'prefix'), limit, request.GET.get('after'))
+        except ValueError as e:
+            return Response(dict(success=False, message=str(e)), status=400)
+
+        return Response(data)
 
 
 class ConsumerDetail(APIView):
@@ -84,10 +242,79 @@ class MonthlyStatisticsApi(APIView):
 
         stats = MonthlyStatistics.objects.filter(**filters)
 
-        serializer = MonthlyStatisticsSerializer(stats, many=True)
+        data = statistics_rows(stats, is_normalized(request))
 
         # This simulates slow response api. Please do not remove it.
         t = random.choice(range(6, 12))
         time.sleep(t)
 
-        return Response(serializer.data)
+        return Response(data)
+
+
+class MonthlyStatisticsBatchApi(APIView):
+    """Monthly statistics of several consumers in one response.
+
+    Consumers are selected with ``consumers`` (comma separated ids) and/or
+    ``consumer_type``. ``year`` and ``month`` filter like in
+    ``MonthlyStatisticsApi``; ``start`` and ``end`` (``YYYY-MM``, inclusive)
+    select a range of months.
+    """
+
+    def get(self, request):
+        if not request.GET.get('consumers') and not request.GET.get('consumer_type'):
+            return Response(dict(success=False, message='Specify consumers or consumer_type.'), status=400)
+
+        try:
+            stats = filter_statistics(request.GET)
+        except ValueError as e:
+            return Response(dict(success=False, message=str(e)), status=400)
+
+        data = statistics_rows(stats, is_normalized(request))
+
+        # This simulates slow response api. Please do not remove it.
+        t = random.choice(range(6, 12))
+        time.sleep(t)
+
+        return Response(data)
+
+
+class StatisticsAggregateApi(CachedResponseMixin, APIView):
+    """Monthly statistics aggregated per group, see ``aggregate_statistics``.
+
+    ``group_by`` is a comma separated list of ``year``, ``month``,
+    ``consumer_type`` and ``consumer`` (default ``year,month``); an empty
+    value aggregates everything in one row. Statistics are filtered like in
+    ``MonthlyStatisticsBatchApi``, and all of them are aggregated without any
+    filter.
+    """
+
+    def get(self, request):
+        group_by = [name for name in request.GET.get('group_by', 'year,month').split(',') if name]
+        unknown = [name for name in group_by if name not in GROUP_BY]
+        if unknown or len(set(group_by)) != len(group_by):
+            return Response(dict(success=False, message='group_by must be a list of {}.'.format(
+                ', '.join(GROUP_BY))), status=400)
+
+        try:
+            stats = filter_statistics(request.GET)
+        except ValueError as e:
+            return Response(dict(success=False, message=str(e)), status=400)
+
+        return Response(aggregate_statistics(stats, group_by))
+
+
+def export_statistics(request):
+    """Monthly statistics as streamed CSV or NDJSON, see ``api.export``.
+
+    Filtered like ``MonthlyStatisticsBatchApi``, except that without any
+    filter every statistic is exported. ``format`` is ``csv`` (default) or
+    ``ndjson``; ``gzip=1`` compresses the response.
+    """
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return JsonResponse(dict(success=False, message='format must be csv or ndjson.'), status=400)
+    try:
+        stats = filter_statistics(request.GET)
+    except ValueError as e:
+        return JsonResponse(dict(success=False, message=str(e)), status=400)
+    return export.export_response(stats, fmt, request.GET.get('gzip') in ('1', 'true'))
@@ -0,0 +1,206 @@
+"""
+ASGI config for frontend project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+to be served by any ASGI server, e.g. ``uvicorn frontend.asgi:application``.
+
+Django 1.11 has no ASGI support, so ``ASGIHandler`` runs the WSGI application
+in thread pools. Requests to ``ASGI_SLOW_PATHS`` get a pool of their own, so
+that the statistics endpoints, which sleep for several seconds, cannot take
+every thread and starve the fast endpoints. Request bodies are read whole
+before a thread is taken, so one larger than ``DATA_UPLOAD_MAX_MEMORY_SIZE``
+gets a 413 as soon as its ``Content-Length`` or the bytes received exceed it.
+As in Django, that limit leaves out file uploads: ``multipart/form-data``
+bodies are limited by ``ASGI_MAX_UPLOAD_SIZE`` instead.
+"""
+
+import asyncio
+import io
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "frontend.settings")
+
+
+class Pool(object):
+    """Threads running requests, and a bound on the requests waiting for one."""
+
+    def __init__(self, name, threads, backlog):
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='asgi-{}'.format(name))
+        self.limit = threads + backlog
+        self.in_flight = 0
+
+
+class ASGIHandler(object):
+    """ASGI 3 application running a WSGI application in bounded thread pools.
+
+    A request is handled by one thread from start to end, including sending
+    the body, so Django's per-thread database connections and streaming
+    responses work as under a threaded WSGI server. Requests beyond the
+    threads and backlog of their pool get a 503, and bodies over
+    ``max_body_size`` bytes a 413, ``multipart/form-data`` ones over
+    ``max_upload_size`` bytes (``None`` for no limit). The ``startup``
+    functions run in a pool thread on the lifespan startup event.
+    """
+
+    def __init__(self, wsgi_application, threads=16, backlog=64, slow_paths=(), slow_threads=64,
+                 slow_backlog=64, startup=(), max_body_size=None, max_upload_size=None):
+        self.wsgi_application = wsgi_application
+        self.max_body_size = max_body_size
+        self.max_upload_size = max_upload_size
+        self.startup = startup
+        self.pool = Pool('fast', threads, backlog)
+        self.slow_paths = [re.compile(pattern) for pattern in slow_paths]
+        self.slow_pool = Pool('slow', slow_threads, slow_backlog) if self.slow_paths else self.pool
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError('Unsupported scope type {!r}.'.format(scope['type']))
+
+        content_type = self.header(scope, b'content-type') or b''
+        limit = self.max_upload_size if content_type.startswith(b'multipart/form-data') else self.max_body_size
+        if self.too_large(self.content_length(scope), limit):
+            return await self.reject(send, 413, [(b'connection', b'close')])
+        pool = self.slow_pool if any(p.match(scope['path']) for p in self.slow_paths) else self.pool
+        if pool.in_flight >= pool.limit:
+            return await self.reject(send, 503, [(b'retry-after', b'1')])
+
+        pool.in_flight += 1
+        try:
+            body = []
+            size = 0
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                chunk = message.get('body', b'')
+                size += len(chunk)
+                if self.too_large(size, limit):
+                    return await self.reject(send, 413, [(b'connection', b'close')])
+                body.append(chunk)
+                more_body = message.get('more_body', False)
+
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(
+                pool.executor, self.handle, loop, self.environ(scope, b''.join(body)), send)
+        finally:
+            pool.in_flight -= 1
+
+    @staticmethod
+    def too_large(size, limit):
+        return limit is not None and size is not None and size > limit
+
+    @staticmethod
+    def header(scope, header):
+        """The value of request header ``header`` (lowercase bytes), ``None`` if it has none."""
+        for name, value in scope.get('headers', []):
+            if name.lower() == header:
+                return value
+        return None
+
+    @classmethod
+    def content_length(cls, scope):
+        """The ``Content-Length`` of the request, ``None`` if it has none or an invalid one."""
+        value = cls.header(scope, b'content-length')
+        return int(value) if value is not None and value.isdigit() else None
+
+    @staticmethod
+    async def reject(send, status, headers):
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                loop = asyncio.get_event_loop()
+                for function in self.startup:
+                    await loop.run_in_executor(self.pool.executor, function)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for pool in {self.pool, self.slow_pool}:
+                    pool.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def handle(self, loop, environ, send):
+        """Run the WSGI application and send its response, in a pool thread."""
+        def call(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [int(status.split(' ', 1)[0]), [
+                (name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]]
+
+        result = self.wsgi_application(environ, start_response)
+        try:
+            call({'type': 'http.response.start', 'status': started[0], 'headers': started[1]})
+            for chunk in result:
+                if chunk:
+                    call({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            call({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    @staticmethod
+    def environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin1').upper().replace('-', '_')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = 'HTTP_' + name
+            value = value.decode('latin1')
+            environ[name] = environ[name] + ',' + value if name in environ else value
+        # The body is read whole, and Django only reads CONTENT_LENGTH bytes of it.
+        environ['CONTENT_LENGTH'] = str(len(body))
+        return environ
+
+
+def get_asgi_application():
+    wsgi_application = get_wsgi_application()
+    # Models can only be imported once get_wsgi_application() has set Django up.
+    from api.search import build_index
+    from api.snapshot import get_snapshot
+    return ASGIHandler(
+        wsgi_application,
+        threads=settings.ASGI_THREADS,
+        backlog=settings.ASGI_BACKLOG,
+        slow_paths=settings.ASGI_SLOW_PATHS,
+        slow_threads=settings.ASGI_SLOW_THREADS,
+        slow_backlog=settings.ASGI_SLOW_BACKLOG,
+        startup=[build_index, get_snapshot],
+        max_body_size=settings.DATA_UPLOAD_MAX_MEMORY_SIZE,
+        max_upload_size=settings.ASGI_MAX_UPLOAD_SIZE,
+    )
+
+
+application = get_asgi_application()
@@ -11,10 +11,18 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 """
 
 import os
+import sys
+from urllib.request import pathname2url
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# The code shared by the dashboard and the frontend (common/) is at the root
+# of the repository.
+ROOT_DIR = os.path.dirname(BASE_DIR)
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/1.11/howto/deployment/checklist/
@@ -43,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'common.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,6 +61,10 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Fraction of the requests profiled by ProfilingMiddleware, 0 disables it.
+# See common/profiling.py; the summary is served at /profiling/.
+PROFILING_SAMPLE_RATE = 0
+
 ROOT_URLCONF = 'frontend.urls'
 
 TEMPLATES = [
@@ -72,6 +85,18 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'frontend.wsgi.application'
 
+# frontend.asgi.application runs requests in a pool of ASGI_THREADS threads,
+# except those matching ASGI_SLOW_PATHS, which get a pool of their own. Up
+# to *_BACKLOG requests wait for a thread, further ones get a 503. It reads
+# request bodies whole, and answers 413 to one over DATA_UPLOAD_MAX_MEMORY_SIZE,
+# or to a multipart/form-data one (file uploads) over ASGI_MAX_UPLOAD_SIZE.
+ASGI_THREADS = 16
+ASGI_BACKLOG = 64
+ASGI_SLOW_PATHS = [r'^/api/monthly_statistics/']
+ASGI_SLOW_THREADS = 64
+ASGI_SLOW_BACKLOG = 64
+ASGI_MAX_UPLOAD_SIZE = 100 * 1024 * 1024
+
 
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
@@ -83,6 +108,85 @@ DATABASES = {
     }
 }
 
+# Production SQLite, see common/sqlite.py. SQLITE_PRODUCTION=1 in the
+# environment runs the PRAGMAS below on every connection and keeps
+# connections open between requests; SQLITE_READ_REPLICA=1 also sends reads
+# outside of transactions to a read-only connection.
+
+SQLITE_PRODUCTION = os.environ.get('SQLITE_PRODUCTION') == '1'
+SQLITE_READ_ALIAS = 'replica'
+
+if SQLITE_PRODUCTION:
+    DATABASES['default'].update(
+        CONN_MAX_AGE=600,
+        PRAGMAS=[
+            ('journal_mode', 'wal'),
+            # Durable at each checkpoint rather than each commit; never corrupts in WAL mode.
+            ('synchronous', 'normal'),
+            ('cache_size', -64 * 1024),  # KiB
+            ('mmap_size', 256 * 1024 * 1024),
+            ('temp_store', 'memory'),
+        ],
+    )
+
+    if os.environ.get('SQLITE_READ_REPLICA') == '1':
+        DATABASES[SQLITE_READ_ALIAS] = dict(
+            DATABASES['default'],
+            NAME='file:{}?mode=ro'.format(pathname2url(DATABASES['default']['NAME'])),
+            OPTIONS={'uri': True},
+            # The journal mode is stored in the file, and set by the writable connection.
+            PRAGMAS=DATABASES['default']['PRAGMAS'][1:],
+            TEST={'MIRROR': 'default'},
+        )
+        DATABASE_ROUTERS = ['common.sqlite.ReadReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'api.cache.LRUCache',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+    'api_generation': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'generation'),
+        'TIMEOUT': None,
+    },
+}
+
+# Cache alias used for API responses, see api/cache.py
+API_CACHE = 'api'
+
+# Cache alias holding the generation of the API data, see api/cache.py. All
+# the processes serving the API must share it: the file cache below works on
+# one host; use memcached or Redis across hosts.
+API_GENERATION_CACHE = 'api_generation'
+
+# Response formats, see api/renderers.py: JSON, or MessagePack and the
+# columnar layouts through the Accept header or ?format=msgpack, columnar
+# and columnar-msgpack. API_FAST_JSON=1 in the environment encodes JSON
+# without the circular reference check.
+
+API_FAST_JSON = os.environ.get('API_FAST_JSON') == '1'
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer' if API_FAST_JSON else 'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'api.renderers.MessagePackRenderer',
+        'api.renderers.ColumnarJSONRenderer',
+        'api.renderers.ColumnarMessagePackRenderer',
+    ],
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
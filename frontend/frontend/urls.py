@@ -16,9 +16,11 @@ Including another URLconf
 from django.conf.urls import url, include
 from django.contrib import admin
 from app import views as app_views
+from common import profiling
 
 urlpatterns = [
     url(r'^$', app_views.index),
     url(r'^admin/', admin.site.urls),
     url(r'^api/', include('api.urls')),
+    url(r'^profiling/$', profiling.stats),
 ]